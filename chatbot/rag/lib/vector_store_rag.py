@@ -4,6 +4,8 @@ from langsmith import traceable
 from pinecone import Pinecone
 from langchain_openai import OpenAIEmbeddings
 from langchain_pinecone import PineconeVectorStore
+from shared.utils import DBHelper
+from shared.lib.car_names import CarNameRecognizer, get_default_entries
 
 from .base_rag import BaseRAG
 
@@ -30,10 +32,22 @@ class VectorStoreRAG(BaseRAG):
         except Exception as e:
             self._log(f"Failed to initialize Pinecone: {str(e)}", "ERROR")
             raise
+        self.recognizer = self._load_recognizer()
+
+    def _load_recognizer(self) -> CarNameRecognizer:
+        try:
+            return CarNameRecognizer.from_db(DBHelper())
+        except Exception as e:
+            self._log(f"Could not load the car names from the database, using the defaults: {str(e)}", "WARNING")
+            return CarNameRecognizer(get_default_entries())
 
     @traceable(name="retrieve_relevant_context")
     def _retrieve_relevant_context(self, query: str, k: int = 3) -> List[Document]:
-        docs = self.vectorstore.similarity_search(query, k=k)
+        # Questions about a make only look at its launches and articles, if any were tagged with it
+        make = self.recognizer.find_make(query)
+        docs = self.vectorstore.similarity_search(query, k=k, filter={"make": make}) if make else []
+        if not docs:
+            docs = self.vectorstore.similarity_search(query, k=k)
         if not docs:
             self._log("No relevant context found")
         return docs
@@ -1,3 +1,4 @@
 from .launches_connector import LaunchesConnector
 from .prices_connector import PricesConnector
-from .articles_connector import ArticlesConnector
\ No newline at end of file
+from .articles_connector import ArticlesConnector
+from .similar_cars_connector import SimilarCarsConnector
\ No newline at end of file
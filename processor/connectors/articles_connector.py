@@ -1,86 +1,142 @@
-import re
-from typing import List, Dict, Any, Tuple
+from collections import defaultdict
+from typing import List, Dict, Any, Tuple, Collection
 from bs4 import BeautifulSoup, NavigableString, Tag
-from fuzzywuzzy import fuzz
 from loguru import logger
-from shared.utils import DBHelper
+from shared.utils import DBHelper, TrigramMatcher
 from lib.processor_result import ProcessorResult
+from lib.connect_state import ConnectState
+
+# Word similarity of a car name ("full_model_name variant") and the closest part of an article title
+LAUNCH_MATCH_SIMILARITY = 0.5
+CAR_MATCH_SIMILARITY = 0.6
 
 class ArticlesConnector:
     def __init__(self):
         self.db = DBHelper()
+        # Titles are only compared with the cars of the launches linked from the article
+        self.launch_matcher = TrigramMatcher("cars", key_column="launch_id", scope_column="launch_id", word_similarity=True,
+                                             threshold=LAUNCH_MATCH_SIMILARITY, top_k=1, db=self.db)
+        self.car_matcher = TrigramMatcher("cars", scope_column="launch_id", word_similarity=True,
+                                          threshold=CAR_MATCH_SIMILARITY, top_k=1, db=self.db)
+        self.launch_state = ConnectState("article_launches")
+        self.car_state = ConnectState("article_cars")
 
     def connect(self) -> ProcessorResult:
         result = ProcessorResult(action="connect", entity="articles")
         
         # Connect articles to launches
+        self._update_launch_links(self._get_articles_without_launch_links())
         unconnected_articles = self._get_unconnected_articles()
-        logger.info(f"Found {len(unconnected_articles)} unconnected articles")
+        logger.info(f"Found {len(unconnected_articles)} unconnected articles to try")
 
-        for article in unconnected_articles:
-            try:
-                launch_links = self._extract_launch_links(article['html_content'])
-                if not launch_links:
-                    logger.warning(f"No launch links found for article ID {article['id']}")
-                    continue
-
-                car_names = self._get_car_names_for_launches(launch_links)
-                if not car_names:
-                    logger.warning(f"No car names found for article ID {article['id']}")
-                    continue
-
-                best_match = self._find_best_match(article['title'], car_names, threshold=65)
-                if best_match:
-                    self._update_article(article['id'], best_match[1])
-                    result.items_processed += 1
-                    logger.info(f"Connected article '{article['title']}' to launch with car {best_match[0]}, score: {best_match[2]}")
-                else:
-                    logger.warning(f"No matching car found for article ID {article['id']}")
+        launch_ids_by_url = self._get_launch_ids_for_urls({link for article in unconnected_articles for link in article['launch_links']})
+        urls_by_launch_id = {launch_id: url for url, launch_ids in launch_ids_by_url.items() for launch_id in launch_ids}
 
-            except Exception as e:
-                logger.error(f"Error processing article ID {article['id']}: {str(e)}")
+        articles = []
+        attempts = []
+        for article in unconnected_articles:
+            launch_links = article['launch_links']
+            if not launch_links:
+                logger.warning(f"No launch links found for article ID {article['id']}")
+                attempts.append((article['id'], ConnectState.NO_INPUT, article['input_versions']))
+                continue
+
+            launch_ids = [launch_id for link in dict.fromkeys(launch_links) for launch_id in launch_ids_by_url.get(link, [])]
+            if not launch_ids:
+                logger.warning(f"No launches found for article ID {article['id']}")
+                attempts.append((article['id'], ConnectState.NO_INPUT, article['input_versions']))
+                continue
+            articles.append((article, launch_ids))
+
+        launch_urls = []
+        matches = self.launch_matcher.match([article['title'] for article, _ in articles], [launch_ids for _, launch_ids in articles])
+        for (article, _), match in zip(articles, matches):
+            if match:
+                launch_id, car_name, similarity = match[0]
+                launch_urls.append((article['id'], urls_by_launch_id[launch_id]))
+                attempts.append((article['id'], ConnectState.CONNECTED, article['input_versions']))
+                logger.info(f"Connected article '{article['title']}' to launch with car {car_name}, similarity: {similarity:.2f}")
+            else:
+                attempts.append((article['id'], ConnectState.NO_MATCH, article['input_versions']))
+                logger.warning(f"No matching car found for article ID {article['id']}")
+        self._update_articles(launch_urls)
+        self.launch_state.save(attempts)
+        result.items_processed += len(launch_urls)
 
         # Connect articles to main cars
         unlinked_articles = self._get_articles_without_car_link()
         logger.info(f"Found {len(unlinked_articles)} articles unlinked to main cars")
 
-        for article in unlinked_articles:
-            try:
-                car_names = self._get_car_names_for_launch(article['related_launch_id'])
-                if not car_names:
-                    logger.warning(f"No car names found for article ID {article['id']}")
-                    continue
-
-                best_match = self._find_best_match(article['title'], car_names, threshold=70)
-                if best_match:
-                    self._link_article_to_car(article['id'], best_match[1])
-                    result.items_processed += 1
-                    logger.info(f"Connected article '{article['title']}' to car {best_match[0]}, score: {best_match[2]}")
-                    logger.info(f"Linked article ID {article['id']} to car ID {best_match[1]}")
-                else:
-                    logger.warning(f"No matching car found for article ID {article['id']} with threshold 70")
-
-            except Exception as e:
-                logger.error(f"Error linking article ID {article['id']} to car: {str(e)}")
+        car_links = []
+        attempts = []
+        matches = self.car_matcher.match([article['title'] for article in unlinked_articles],
+                                         [[article['related_launch_id']] for article in unlinked_articles])
+        for article, match in zip(unlinked_articles, matches):
+            if match:
+                car_id, car_name, similarity = match[0]
+                car_links.append((article['id'], car_id))
+                attempts.append((article['id'], ConnectState.CONNECTED, article['input_versions']))
+                logger.info(f"Connected article '{article['title']}' to car {car_name}, similarity: {similarity:.2f}")
+            else:
+                attempts.append((article['id'], ConnectState.NO_MATCH, article['input_versions']))
+                logger.warning(f"No matching car found for article ID {article['id']} with similarity {CAR_MATCH_SIMILARITY}")
+        self._link_articles_to_cars(car_links)
+        self.car_state.save(attempts)
+        result.items_processed += len(car_links)
 
         return result
 
-    def _get_unconnected_articles(self) -> List[Dict[str, Any]]:
+    def _get_articles_without_launch_links(self) -> List[Dict[str, Any]]:
         return self.db.execute_query("""
-            SELECT a.id, a.title, p.html_content
+            SELECT a.id, p.html_content
             FROM articles a
             JOIN posts p ON a.post_id = p.id
-            WHERE a.related_launch_url IS NULL
+            WHERE a.launch_links IS NULL
+        """)
+
+    def _update_launch_links(self, articles: List[Dict[str, Any]]) -> None:
+        """Extract the launch links of each article once, so its HTML is not parsed on every run."""
+        launch_links = []
+        for article in articles:
+            try:
+                launch_links.append((article['id'], self._extract_launch_links(article['html_content'])))
+            except Exception as e:
+                logger.error(f"Error processing article ID {article['id']}: {str(e)}")
+                launch_links.append((article['id'], []))
+        self.db.execute_values("""
+            UPDATE articles
+            SET launch_links = v.launch_links
+            FROM (VALUES %s) AS v(id, launch_links)
+            WHERE articles.id = v.id
+        """, launch_links, template="(%s, %s::text[])")
+
+    def _get_unconnected_articles(self) -> List[Dict[str, Any]]:
+        # An article that did not connect is tried again when the launches it links to get new cars
+        return self.launch_state.select_pending("""
+            SELECT a.id, a.title, a.launch_links,
+                   jsonb_build_object('cars', (
+                       SELECT COALESCE(MAX(c.id), 0)
+                       FROM posts lp
+                       JOIN launches l ON l.post_id = lp.id
+                       JOIN cars c ON c.launch_id = l.id
+                       WHERE lp.url = ANY(a.launch_links)
+                   )) AS input_versions
+            FROM articles a
+            WHERE a.related_launch_url IS NULL AND a.launch_links IS NOT NULL
         """)
 
     def _get_articles_without_car_link(self) -> List[Dict[str, Any]]:
-        return self.db.execute_query("""
-            SELECT a.id, a.title, l.id AS related_launch_id
+        # The launch of the first post with the related URL, as posts may have been scraped twice.
+        # An article that did not link to a car is tried again when the cars of its launch change.
+        return self.car_state.select_pending("""
+            SELECT DISTINCT ON (a.id) a.id, a.title, l.id AS related_launch_id,
+                   jsonb_build_object('cars', (SELECT COALESCE(MAX(c.id), 0) FROM cars c WHERE c.launch_id = l.id)) AS input_versions
             FROM articles a
-            JOIN posts p ON a.post_id = p.id
-            JOIN launches l ON l.post_id = (SELECT p2.id FROM posts p2 WHERE url = a.related_launch_url LIMIT 1)
-            LEFT JOIN car_articles ca ON a.id = ca.article_id
-            WHERE ca.article_id IS NULL AND a.related_launch_url IS NOT NULL
+            JOIN posts lp ON lp.url = a.related_launch_url
+            JOIN launches l ON l.post_id = lp.id
+            WHERE a.related_launch_url IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM car_articles ca WHERE ca.article_id = a.id)
+            ORDER BY a.id, lp.id
         """)
 
     def _extract_launch_links(self, html_content: str) -> List[str]:
@@ -99,56 +155,34 @@ class ArticlesConnector:
 
         return launch_links
 
-    def _get_car_names_for_launches(self, launch_links: List[str]) -> List[Tuple[str, int]]:
-        placeholders = ','.join(['%s'] * len(launch_links))
-        query = f"""
-            SELECT DISTINCT c.full_model_name || ' ' || c.variant AS car_name, l.id AS launch_id
-            FROM cars c
-            JOIN launches l ON c.launch_id = l.id
+    def _get_launch_ids_for_urls(self, launch_links: Collection[str]) -> Dict[str, List[int]]:
+        """Ids of the launches of each launch URL, more than one if the post was scraped twice."""
+        launch_ids = defaultdict(list)
+        if not launch_links:
+            return launch_ids
+        for row in self.db.execute_query("""
+            SELECT p.url, l.id
+            FROM launches l
             JOIN posts p ON l.post_id = p.id
-            WHERE p.url IN ({placeholders})
-        """
-        results = self.db.execute_query(query, tuple(launch_links))
-        return [(result['car_name'], result['launch_id']) for result in results]
-    
-    def _get_car_names_for_launch(self, launch_id: int) -> List[Tuple[str, int]]:
-        query = """
-            SELECT DISTINCT c.full_model_name || ' ' || c.variant AS car_name, c.id AS car_id
-            FROM cars c
-            WHERE c.launch_id = %s
-        """
-        results = self.db.execute_query(query, (launch_id,))
-        return [(result['car_name'], result['car_id']) for result in results]
-
-    def _find_best_match(self, article_title: str, car_names: List[Tuple[str, int]], threshold: int = 65) -> Tuple[str, int, int]:
-        best_match = None
-        highest_ratio = 0
-
-        for car_name, car_id in car_names:
-            ratio = fuzz.partial_ratio(self._normalize_string(article_title), self._normalize_string(car_name))
-            if ratio > highest_ratio:
-                highest_ratio = ratio
-                best_match = (car_name, car_id, highest_ratio)
-
-        if ratio >= threshold:
-            return best_match
-        return None
-
-    @staticmethod
-    def _normalize_string(s: str) -> str:
-        return re.sub(r'[^a-zA-Z0-9\s]', '', s).lower()
-
-    def _update_article(self, article_id: int, launch_id: int) -> None:
-        self.db.execute_query("""
+            WHERE p.url = ANY(%s)
+            ORDER BY p.url, l.id
+        """, (list(launch_links),)):
+            launch_ids[row['url']].append(row['id'])
+        return launch_ids
+
+    def _update_articles(self, launch_urls: List[Tuple[int, str]]) -> None:
+        self.db.execute_values("""
             UPDATE articles
-            SET related_launch_url = (SELECT url FROM posts WHERE id = (SELECT post_id FROM launches WHERE id = %s))
-            WHERE id = %s
-        """, (launch_id, article_id))
-
-    def _link_article_to_car(self, article_id: int, car_id: int) -> None:
-        self.db.execute_query("""
+            SET related_launch_url = v.url
+            FROM (VALUES %s) AS v(id, url)
+            WHERE articles.id = v.id
+        """, launch_urls)
+        logger.info(f"Connected {len(launch_urls)} articles to launches")
+
+    def _link_articles_to_cars(self, car_links: List[Tuple[int, int]]) -> None:
+        self.db.execute_values("""
             INSERT INTO car_articles (article_id, car_id)
-            VALUES (%s, %s)
+            VALUES %s
             ON CONFLICT (article_id, car_id) DO NOTHING
-        """, (article_id, car_id))
-        pass
\ No newline at end of file
+        """, car_links)
+        logger.info(f"Linked {len(car_links)} articles to cars")
@@ -1,134 +1,128 @@
-import re
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 from collections import Counter
-from fuzzywuzzy import fuzz
 from loguru import logger
-from shared.utils import DBHelper
+from shared.utils import DBHelper, TrigramMatcher
+from shared.lib.car_names import contains_name
 from lib.processor_result import ProcessorResult
+from lib.connect_state import ConnectState
+
+# Trigram word similarity of a car model's make and model within a launch car name, for the candidates to check.
+# A launch is only connected to a candidate whose words all appear in its car name (see _select_car_model).
+CANDIDATE_SIMILARITY = 0.3
+# Candidates checked for each launch, as several car models may appear in full in a name ("Tiggo 4" and "Tiggo 4 Pro")
+NUM_CANDIDATES = 10
 
 class LaunchesConnector:
     def __init__(self):
         self.db = DBHelper()
-        self.models = None
+        self.matcher = TrigramMatcher("car_models", word_similarity=True, threshold=CANDIDATE_SIMILARITY,
+                                      top_k=NUM_CANDIDATES, db=self.db)
+        self.state = ConnectState("launches")
 
     def connect(self) -> ProcessorResult:
         result = ProcessorResult(action="connect", entity="launches")
         
         # Part 1: Connect launches to car models
         launches = self._get_unconnected_launches()
-        for launch in launches:
-            try:
-                car_model = self._find_matching_car_model(launch)
-                if car_model:
-                    self._update_launch(launch['id'], car_model['id'])
-                    result.items_processed += 1
-            except Exception as e:
-                logger.error(f"Error processing launch ID {launch['id']}: {str(e)}")
+        try:
+            connections = self._find_matching_car_models(launches)
+            self._update_launches(connections)
+            connected_ids = {launch_id for launch_id, _ in connections}
+            self.state.save([(launch['id'], ConnectState.CONNECTED if launch['id'] in connected_ids else ConnectState.NO_MATCH,
+                              launch['input_versions']) for launch in launches])
+            result.items_processed += len(connections)
+        except Exception as e:
+            logger.error(f"Error connecting launches to car models: {str(e)}")
         
         # Part 2: Populate similar_cars table
-        cars_to_process = self._get_cars_not_in_similar_cars()
-        for car in cars_to_process:
-            try:
-                similar_cars = self._get_similar_cars(car['id'], car['launch_id'])
-                self._add_similar_cars(car['id'], similar_cars)
-                logger.info(f"Found {len(similar_cars)} similar cars for car ID {car['id']}")
-                result.items_processed += len(similar_cars)
-            except Exception as e:
-                logger.error(f"Error processing similar cars for car ID {car['id']}: {str(e)}")
+        try:
+            num_cars, num_similar_cars = self._add_similar_cars()
+            logger.info(f"Found {num_similar_cars} similar cars for {num_cars} new cars")
+            result.items_processed += num_similar_cars
+        except Exception as e:
+            logger.error(f"Error populating similar cars: {str(e)}")
         
         return result
 
     def _get_unconnected_launches(self) -> List[Dict[str, Any]]:
-        return self.db.execute_query("""
-            SELECT DISTINCT l.id, 
-                   ARRAY_AGG(c.full_model_name) AS full_model_names
+        # A launch that did not match is tried again when a car model is added or its cars change
+        return self.state.select_pending("""
+            SELECT l.id,
+                   ARRAY_AGG(c.full_model_name) AS full_model_names,
+                   jsonb_build_object('car_models', (SELECT COALESCE(MAX(id), 0) FROM car_models), 'cars', MAX(c.id)) AS input_versions
             FROM launches l
             JOIN cars c ON l.id = c.launch_id
             WHERE l.car_model_id IS NULL
             GROUP BY l.id
         """)
 
-    def _get_car_models(self) -> List[Dict[str, Any]]:
-        return self.db.execute_query("SELECT id, make, model FROM car_models")
-
-    def _find_matching_car_model(self, launch: Dict[str, Any]) -> Dict[str, Any]:
-        self.models = self.models or self._get_car_models()
-        car_models = self.models
-        best_match = None
-        highest_ratio = 0
-
+    def _find_matching_car_models(self, launches: List[Dict[str, Any]]) -> List[Tuple[int, int]]:
+        """(launch_id, car_model_id) of the launches whose most common car name contains a car model's make and model."""
         # Select the most common full_model_name
-        full_model_name = self._select_most_common_model(launch['full_model_names'])
-        full_model_name = self._normalize_string(full_model_name)
-
-        for car_model in car_models:
-            combined_name = self._normalize_string(f"{car_model['make']} {car_model['model']}")
-            ratio = fuzz.partial_ratio(full_model_name, combined_name)
-
-            if ratio > highest_ratio:
-                if ratio == 100:
-                    return car_model
-                highest_ratio = ratio
-                best_match = car_model
-        
-        logger.warning(f"No matching car model found for {full_model_name}. Highest ratio: {highest_ratio}, best match: {best_match['make']} {best_match['model']}")
-        return None
+        full_model_names = [self._select_most_common_model(launch['full_model_names']) for launch in launches]
+
+        connections = []
+        for launch, full_model_name, candidates in zip(launches, full_model_names, self.matcher.match(full_model_names)):
+            car_model_id = self._select_car_model(full_model_name, candidates)
+            if car_model_id is not None:
+                connections.append((launch['id'], car_model_id))
+            else:
+                near_misses = ", ".join(f"{name} ({similarity:.2f})" for _, name, similarity in candidates[:3])
+                logger.warning(f"No matching car model found for launch ID {launch['id']} ({full_model_name}). Best matches: {near_misses or 'none'}")
+        return connections
+
+    @staticmethod
+    def _select_car_model(full_model_name: str, candidates: List[Tuple[int, str, float]]) -> Optional[int]:
+        """
+        The candidate car model whose make and model appear in full in the car name, the longest
+        if several do ("Chery Tiggo 4 Pro" is a Tiggo 4 Pro rather than a Tiggo 4), or None.
+        Similar names of other models ("Chery Tiggo 5" for a Tiggo 4) are never connected.
+        """
+        contained = [(len(name.split()), -car_model_id, car_model_id) for car_model_id, name, _ in candidates
+                     if contains_name(full_model_name, name)]
+        return max(contained)[2] if contained else None
 
     def _select_most_common_model(self, full_model_names: List[str]) -> str:
         counter = Counter(full_model_names)
         most_common = counter.most_common(1)
         return most_common[0][0] if most_common else ''
 
-    def _normalize_string(self, s: str) -> str:
-        # Remove special characters and convert to lowercase
-        return re.sub(r'[^a-zA-Z0-9\s]', '', s).lower()
-
-    def _update_launch(self, launch_id: int, car_model_id: int) -> None:
-        self.db.execute_query(
-            "UPDATE launches SET car_model_id = %s WHERE id = %s",
-            (car_model_id, launch_id)
-        )
-        logger.info(f"Updated launch ID {launch_id} with car_model_id {car_model_id}")
+    def _update_launches(self, connections: List[Tuple[int, int]]) -> None:
+        self.db.execute_values("""
+            UPDATE launches SET car_model_id = v.car_model_id
+            FROM (VALUES %s) AS v(id, car_model_id)
+            WHERE launches.id = v.id
+        """, connections)
+        logger.info(f"Connected {len(connections)} launches to car models")
         
-    def _get_cars_not_in_similar_cars(self) -> List[Dict[str, Any]]:
-        return self.db.execute_query("""
-            SELECT DISTINCT c.id, c.launch_id
-            FROM cars c
-            LEFT JOIN similar_cars sc ON c.id = sc.launch_car_id
-            WHERE sc.launch_car_id IS NULL
-        """)
-
-    def _get_similar_cars(self, car_id: int, launch_id: int) -> List[int]:
-        similar_launches = self.db.execute_query("""
-            SELECT DISTINCT sl.url
-            FROM similar_launches sl
-            WHERE sl.launch_id = %s
-        """, (launch_id,))
-
-        similar_car_ids = []
-        for similar_launch in similar_launches:
-            similar_cars = self.db.execute_query("""
-                SELECT c.id
+    def _add_similar_cars(self) -> Tuple[int, int]:
+        """
+        Add the similar cars of the cars not connected yet (without date_similar_connected):
+        the cars of the launches listed as similar to their launch. Pairs where only the
+        similar car is new are added too, so the order in which launches are processed does
+        not matter. The new cars are marked in the same statement, so later runs only look
+        at newer ones. Pairs already found from the specs become links, without the specs
+        distance. Returns the number of new cars and of similar cars added.
+        """
+        rows = self.db.execute_query("""
+            WITH new_cars AS (
+                UPDATE cars SET date_similar_connected = NOW()
+                WHERE date_similar_connected IS NULL
+                RETURNING id
+            ), inserted AS (
+                INSERT INTO similar_cars (launch_car_id, similar_car_id)
+                SELECT DISTINCT c.id, s.id
                 FROM cars c
-                LEFT JOIN launches l ON l.id = c.launch_id
-                LEFT JOIN posts p ON l.post_id = p.id
-                WHERE p.url = %s AND c.id != %s
-            """, (similar_launch['url'], car_id))
-            similar_car_ids.extend([car['id'] for car in similar_cars])
-
-        return similar_car_ids
-
-    def _add_similar_cars(self, car_id: int, similar_car_ids: List[int]) -> None:
-        for similar_car_id in similar_car_ids:
-            # Check if the relationship already exists
-            existing = self.db.execute_query("""
-                SELECT 1 FROM similar_cars
-                WHERE launch_car_id = %s AND similar_car_id = %s
-            """, (car_id, similar_car_id))
-
-            if not existing:
-                self.db.execute_query("""
-                    INSERT INTO similar_cars (launch_car_id, similar_car_id)
-                    VALUES (%s, %s)
-                """, (car_id, similar_car_id))
-                logger.info(f"Added similar car relationship: {car_id} - {similar_car_id}")
+                JOIN similar_launches sl ON sl.launch_id = c.launch_id
+                JOIN posts p ON p.url = sl.url
+                JOIN launches l ON l.post_id = p.id
+                JOIN cars s ON s.launch_id = l.id
+                WHERE s.id != c.id
+                  AND (c.id IN (SELECT id FROM new_cars) OR s.id IN (SELECT id FROM new_cars))
+                ON CONFLICT (launch_car_id, similar_car_id) DO UPDATE SET source = EXCLUDED.source, distance = NULL
+                WHERE similar_cars.source <> EXCLUDED.source
+                RETURNING 1
+            )
+            SELECT (SELECT COUNT(*) FROM new_cars) AS num_cars, (SELECT COUNT(*) FROM inserted) AS num_similar_cars
+        """)
+        return rows[0]['num_cars'], rows[0]['num_similar_cars']
@@ -1,8 +1,7 @@
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional
 from loguru import logger
 from shared.utils import DBHelper
 from lib.processor_result import ProcessorResult
-from fuzzywuzzy import fuzz
 from collections import defaultdict
 import numpy as np
 from scipy.optimize import linear_sum_assignment
@@ -19,14 +18,20 @@ class PricesConnector:
         prices_by_url = defaultdict(list)
         for price in unprocessed_prices:
             prices_by_url[price['launch_url']].append(price)
+        cars_by_url = self._get_cars_for_launch_urls(list(prices_by_url))
+        similarities = self._get_similarities([price['id'] for price in unprocessed_prices])
         
+        car_prices = []
+        processed_price_ids = []
         for launch_url, prices in prices_by_url.items():
             try:
-                self._process_prices_for_url(launch_url, prices)
+                car_prices.extend(self._process_prices_for_url(launch_url, prices, cars_by_url.get(launch_url, []), similarities))
+                processed_price_ids.extend(price['id'] for price in prices)
                 result.items_processed += len(prices)
             except Exception as e:
                 logger.error(f"Error processing prices for URL {launch_url}: {str(e)}")
         
+        self._save_prices(car_prices, processed_price_ids)
         return result
 
     def _get_unprocessed_prices(self) -> List[Dict]:
@@ -36,41 +41,59 @@ class PricesConnector:
             WHERE date_processed IS NULL
         """)
 
-    def _process_prices_for_url(self, launch_url: str, prices: List[Dict]) -> None:
-        cars = self._get_cars_for_launch_url(launch_url)
-        
+    def _process_prices_for_url(self, launch_url: str, prices: List[Dict], cars: List[Dict],
+                                similarities: Dict[Tuple[int, int], float]) -> List[Tuple[int, int]]:
+        """(car_id, price) of the cars of the launch whose price changed."""
         if not cars:
             logger.warning(f"No cars found for launch URL: {launch_url}")
-            for price in prices:
-                self._mark_price_as_processed(price['id'])
-            return
-
-        matches = self._match_cars_to_prices(cars, prices)
-        
-        for car, price in matches:
-            if car and price:
-                self._update_car_price(car, price['price'])
-            self._mark_price_as_processed(price['id'])
-
-    def _get_cars_for_launch_url(self, launch_url: str) -> List[Dict]:
-        return self.db.execute_query("""
-            SELECT c.id, c.variant, c.current_price, c.price_date
+            return []
+
+        car_prices = []
+        for car, price, _ in self._match_cars_to_prices(cars, prices, similarities):
+            if car and price and car['current_price'] != price['price']:
+                car_prices.append((car['id'], price['price']))
+                logger.info(f"Updated price for car {car['id']} from {car['current_price']} to {price['price']}")
+        return car_prices
+
+    def _get_cars_for_launch_urls(self, launch_urls: List[str]) -> Dict[str, List[Dict]]:
+        cars_by_url = defaultdict(list)
+        if not launch_urls:
+            return cars_by_url
+        for car in self.db.execute_query("""
+            SELECT p.url, c.id, c.variant, c.current_price, c.price_date
             FROM cars c
             JOIN launches l ON c.launch_id = l.id
             JOIN posts p ON l.post_id = p.id
-            WHERE p.url = %s
-        """, (launch_url,))
-
-    def _match_cars_to_prices(self, cars: List[Dict], prices: List[Dict]) -> List[Tuple[Dict, Dict]]:
+            WHERE p.url = ANY(%s)
+            ORDER BY c.id
+        """, (launch_urls,)):
+            cars_by_url[car['url']].append(car)
+        return cars_by_url
+
+    def _get_similarities(self, price_ids: List[int]) -> Dict[Tuple[int, int], float]:
+        """Trigram similarity of the variant of each car and the name of each price of its launch URL, by (car_id, price_id)."""
+        if not price_ids:
+            return {}
+        rows = self.db.execute_query("""
+            SELECT c.id AS car_id, cp.id AS price_id, similarity(normalize_car_name(c.variant), cp.normalized_name) AS similarity
+            FROM car_prices cp
+            JOIN posts p ON p.url = cp.launch_url
+            JOIN launches l ON l.post_id = p.id
+            JOIN cars c ON c.launch_id = l.id
+            WHERE cp.id = ANY(%s)
+        """, (price_ids,))
+        return {(row['car_id'], row['price_id']): float(row['similarity']) for row in rows}
+
+    def _match_cars_to_prices(self, cars: List[Dict], prices: List[Dict],
+                              similarities: Dict[Tuple[int, int], float]) -> List[Tuple[Optional[Dict], Optional[Dict], Optional[float]]]:
         """
         Match cars to prices using the Hungarian algorithm for optimal assignment,
-        without applying any similarity threshold.
+        without applying any similarity threshold. Returns (car, price, similarity)
+        for each match, and the unmatched cars and prices with None in the other places.
         """
         # Create a similarity matrix (higher is better)
-        similarity_matrix = np.zeros((len(cars), len(prices)))
-        for i, car in enumerate(cars):
-            for j, price in enumerate(prices):
-                similarity_matrix[i][j] = fuzz.ratio(car['variant'].lower(), price['name'].lower())
+        similarity_matrix = np.array([[similarities.get((car['id'], price['id']), 0.0) for price in prices] for car in cars],
+                                     dtype=np.float64)
 
         # Convert to a cost matrix (lower is better)
         cost_matrix = np.max(similarity_matrix) - similarity_matrix
@@ -79,28 +102,16 @@ class PricesConnector:
         row_ind, col_ind = linear_sum_assignment(cost_matrix)
 
         # Create the matches
-        matches = []
-        matched_cars = set()
-        matched_prices = set()
-
-        for i, j in zip(row_ind, col_ind):
-            matches.append((cars[i], prices[j]))
-            matched_cars.add(i)
-            matched_prices.add(j)
+        matches = [(cars[i], prices[j], float(similarity_matrix[i, j])) for i, j in zip(row_ind, col_ind)]
 
         # Add any unmatched cars or prices
-        for i in range(len(cars)):
-            if i not in matched_cars:
-                matches.append((cars[i], None))
-        for j in range(len(prices)):
-            if j not in matched_prices:
-                matches.append((None, prices[j]))
+        matches.extend((cars[i], None, None) for i in sorted(set(range(len(cars))) - set(row_ind)))
+        matches.extend((None, prices[j], None) for j in sorted(set(range(len(prices))) - set(col_ind)))
 
         # Log the matches for debugging
-        for car, price in matches:
+        for car, price, similarity in matches:
             if car and price:
-                similarity = fuzz.ratio(car['variant'].lower(), price['name'].lower())
-                logger.info(f"Matched car variant '{car['variant']}' to price name '{price['name']}' with similarity {similarity}")
+                logger.info(f"Matched car variant '{car['variant']}' to price name '{price['name']}' with similarity {similarity:.2f}")
             elif car:
                 logger.info(f"Unmatched car variant: {car['variant']}")
             elif price:
@@ -108,19 +119,18 @@ class PricesConnector:
 
         return matches
 
-    def _update_car_price(self, car: Dict, new_price: int) -> None:
-        if car['current_price'] != new_price:
-            self.db.execute_query("""
+    def _save_prices(self, car_prices: List[Tuple[int, int]], processed_price_ids: List[int]) -> None:
+        # The new car prices and the processed marks are written together, so no price is lost or applied twice
+        with self.db.get_cursor() as cur:
+            self.db.execute_values("""
                 UPDATE cars
-                SET current_price = %s, price_date = NOW()
-                WHERE id = %s
-            """, (new_price, car['id']))
-            logger.info(f"Updated price for car {car['id']} from {car['current_price']} to {new_price}")
-
-    def _mark_price_as_processed(self, price_id: int) -> None:
-        self.db.execute_query("""
-            UPDATE car_prices
-            SET date_processed = NOW()
-            WHERE id = %s
-        """, (price_id,))
-        pass
\ No newline at end of file
+                SET current_price = v.price, price_date = NOW()
+                FROM (VALUES %s) AS v(id, price)
+                WHERE cars.id = v.id
+            """, car_prices, cur=cur)
+            cur.execute("""
+                UPDATE car_prices
+                SET date_processed = NOW()
+                WHERE id = ANY(%s)
+            """, (processed_price_ids,))
+        logger.info(f"Updated the price of {len(car_prices)} cars from {len(processed_price_ids)} prices")
@@ -0,0 +1,78 @@
+from typing import Any, Dict, List, Tuple
+import numpy as np
+from loguru import logger
+from shared.utils import DBHelper
+from lib.processor_result import ProcessorResult
+from lib.connect_state import ConnectState
+from lib.spec_neighbours import (NUMERIC_FEATURES, CATEGORICAL_FEATURES, BOOLEAN_FEATURES, build_spec_matrix, get_segments,
+                                 nearest_neighbours)
+
+# Competitors found for each car from its specs, besides the ones linked from its launch post
+NUM_NEIGHBOURS = 5
+# similar_cars.source of the competitors found from the specs
+SPECS_SOURCE = "specs"
+
+class SimilarCarsConnector:
+    """
+    Adds to similar_cars the nearest cars of each car by price, specs and equipment
+    (see lib/spec_neighbours.py), so that cars without "COMPETIDORES" links in their
+    launch post have competitors too. Cars of the same car model are not competitors.
+    Neighbours are recomputed for all cars at once, only when cars or prices changed.
+    """
+    def __init__(self, num_neighbours: int = NUM_NEIGHBOURS):
+        self.db = DBHelper()
+        self.num_neighbours = num_neighbours
+        self.state = ConnectState("similar_cars")
+
+    def connect(self) -> ProcessorResult:
+        result = ProcessorResult(action="connect", entity="similar_cars")
+        pending = self.state.select_pending("""
+            SELECT 0 AS id,
+                   jsonb_build_object('cars', COUNT(*), 'last_car', COALESCE(MAX(c.id), 0), 'last_price', MAX(c.price_date),
+                                      'last_processed', MAX(l.date_processed)) AS input_versions
+            FROM cars c
+            JOIN launches l ON c.launch_id = l.id
+        """)
+        if not pending:
+            logger.info("No cars changed since the similar cars were computed from their specs")
+            return result
+
+        cars = self._get_cars()
+        similar_cars = self._find_similar_cars(cars)
+        self._save_similar_cars(similar_cars)
+        self.state.save([(0, ConnectState.CONNECTED, pending[0]['input_versions'])])
+        logger.info(f"Found {len(similar_cars)} similar cars from the specs of {len(cars)} cars")
+        result.items_processed += len(similar_cars)
+        return result
+
+    def _get_cars(self) -> List[Dict[str, Any]]:
+        columns = ", ".join(f"c.{feature}" for feature in [*NUMERIC_FEATURES, *CATEGORICAL_FEATURES, *BOOLEAN_FEATURES] if feature != "price")
+        # Cars of launches not connected to a car model yet are only kept apart from the other cars of their launch
+        return self.db.execute_query(f"""
+            SELECT c.id, COALESCE(l.car_model_id, -l.id) AS model_group,
+                   COALESCE(c.current_price, c.launch_price) AS price, {columns}
+            FROM cars c
+            JOIN launches l ON c.launch_id = l.id
+            ORDER BY c.id
+        """)
+
+    def _find_similar_cars(self, cars: List[Dict[str, Any]]) -> List[Tuple[int, int, float]]:
+        """(car_id, similar_car_id, distance) of the nearest cars of each car."""
+        if len(cars) < 2:
+            return []
+        groups = np.array([car['model_group'] for car in cars])
+        indices, distances = nearest_neighbours(build_spec_matrix(cars), self.num_neighbours, groups=groups, segments=get_segments(cars))
+        return [(car['id'], cars[j]['id'], float(distance))
+                for car, row, row_distances in zip(cars, indices, distances)
+                for j, distance in zip(row, row_distances) if j >= 0]
+
+    def _save_similar_cars(self, similar_cars: List[Tuple[int, int, float]]) -> None:
+        # Replaced in one transaction, so the chatbot never sees cars without competitors. Linked pairs are kept as they are.
+        with self.db.get_cursor() as cur:
+            cur.execute("DELETE FROM similar_cars WHERE source = %s", (SPECS_SOURCE,))
+            self.db.execute_values("""
+                INSERT INTO similar_cars (launch_car_id, similar_car_id, source, distance)
+                VALUES %s
+                ON CONFLICT (launch_car_id, similar_car_id) DO NOTHING
+            """, [(car_id, similar_car_id, SPECS_SOURCE, distance) for car_id, similar_car_id, distance in similar_cars],
+                page_size=1000, cur=cur)
@@ -0,0 +1,173 @@
+import argparse
+import json
+import re
+import sys
+import os
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+from loguru import logger
+
+# Add the shared directory to sys.path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from lib.fake_llm import FakeChatModel, FakeProviderError
+
+MESSAGE_TYPES = {"system": SystemMessage, "user": HumanMessage, "assistant": AIMessage}
+
+class FakeBatchStore:
+    """Files and batches of the fake server, kept in memory. Batches complete after delay seconds."""
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+
+    def add_file(self, content: bytes, filename: str, purpose: str) -> Dict[str, Any]:
+        file = {"id": f"file-{uuid.uuid4().hex[:24]}", "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                "filename": filename, "purpose": purpose, "status": "processed"}
+        with self.lock:
+            self.files[file["id"]] = {**file, "content": content}
+        return file
+
+    def create_batch(self, input_file_id: str, endpoint: str, completion_window: str, metadata: Dict[str, str]) -> Dict[str, Any]:
+        batch = {"id": f"batch_{uuid.uuid4().hex[:24]}", "object": "batch", "endpoint": endpoint, "input_file_id": input_file_id,
+                 "completion_window": completion_window, "status": "validating", "created_at": int(time.time()),
+                 "metadata": metadata, "output_file_id": None, "error_file_id": None, "errors": None,
+                 "request_counts": {"total": 0, "completed": 0, "failed": 0}}
+        with self.lock:
+            self.batches[batch["id"]] = batch
+        threading.Thread(target=self._run_batch, args=(batch["id"],), daemon=True).start()
+        return batch
+
+    def _run_batch(self, batch_id: str) -> None:
+        batch = self.batches[batch_id]
+        lines = [json.loads(line) for line in self.files[batch["input_file_id"]]["content"].decode("utf-8").splitlines() if line.strip()]
+        batch.update(status="in_progress", in_progress_at=int(time.time()))
+        batch["request_counts"]["total"] = len(lines)
+        time.sleep(self.delay)
+
+        outputs, errors = [], []
+        for line in lines:
+            output = self._complete(line)
+            if output["response"]["status_code"] == 200:
+                outputs.append(output)
+                batch["request_counts"]["completed"] += 1
+            else:
+                errors.append(output)
+                batch["request_counts"]["failed"] += 1
+        batch["output_file_id"] = self._write_results(outputs, batch_id, "output")
+        batch["error_file_id"] = self._write_results(errors, batch_id, "error")
+        batch.update(status="completed", completed_at=int(time.time()))
+        logger.info(f"Batch {batch_id} completed: {len(outputs)} completions, {len(errors)} errors")
+
+    def _write_results(self, results: List[Dict[str, Any]], batch_id: str, kind: str) -> Any:
+        if not results:
+            return None
+        content = "".join(json.dumps(result, ensure_ascii=False) + "\n" for result in results).encode("utf-8")
+        return self.add_file(content, f"{batch_id}_{kind}.jsonl", "batch_output")["id"]
+
+    @staticmethod
+    def _complete(line: Dict[str, Any]) -> Dict[str, Any]:
+        body = line["body"]
+        request_id = uuid.uuid4().hex[:24]
+        messages = [MESSAGE_TYPES[message["role"]](content=message["content"]) for message in body["messages"]]
+        llm = FakeChatModel(model_name=body["model"])
+        if body.get("tools"):
+            llm = llm.bind_tools([tool["function"] for tool in body["tools"]])
+        try:
+            response = llm.invoke(messages)
+        except FakeProviderError as e:
+            return {"id": f"batch_req_{request_id}", "custom_id": line["custom_id"], "error": None,
+                    "response": {"status_code": e.status_code, "request_id": request_id, "body": {"error": {"message": str(e)}}}}
+
+        message = {"role": "assistant", "content": response.content or None}
+        if response.tool_calls:
+            message["tool_calls"] = [{"id": call["id"], "type": "function",
+                                      "function": {"name": call["name"], "arguments": json.dumps(call["args"], ensure_ascii=False)}}
+                                     for call in response.tool_calls]
+        usage = response.usage_metadata
+        return {"id": f"batch_req_{request_id}", "custom_id": line["custom_id"], "error": None,
+                "response": {"status_code": 200, "request_id": request_id, "body": {
+                    "id": f"chatcmpl-{request_id}", "object": "chat.completion", "created": int(time.time()), "model": body["model"],
+                    "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if response.tool_calls else "stop"}],
+                    "usage": {"prompt_tokens": usage["input_tokens"], "completion_tokens": usage["output_tokens"],
+                              "total_tokens": usage["total_tokens"]}}}}
+
+class FakeBatchHandler(BaseHTTPRequestHandler):
+    """Files and batches endpoints of the OpenAI API used by lib.llm_batch.BatchClient."""
+    store: FakeBatchStore = None
+
+    def do_POST(self):
+        path = self._get_path()
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if path == "/files":
+            fields = self._parse_multipart(body)
+            file = fields.get("file")
+            if not file:
+                return self._send({"error": {"message": "Missing file"}}, 400)
+            return self._send(self.store.add_file(file["content"], file["filename"] or "batch.jsonl", fields["purpose"]["content"].decode()))
+        if path == "/batches":
+            request = json.loads(body)
+            if request.get("input_file_id") not in self.store.files:
+                return self._send({"error": {"message": f"No such file: {request.get('input_file_id')}"}}, 404)
+            return self._send(self.store.create_batch(request["input_file_id"], request["endpoint"],
+                                                      request["completion_window"], request.get("metadata") or {}))
+        self._send({"error": {"message": f"Unknown path {path}"}}, 404)
+
+    def do_GET(self):
+        path = self._get_path()
+        match = re.fullmatch(r"/batches/([\w-]+)", path)
+        if match and match.group(1) in self.store.batches:
+            return self._send(self.store.batches[match.group(1)])
+        match = re.fullmatch(r"/files/([\w-]+)/content", path)
+        if match and match.group(1) in self.store.files:
+            return self._send_bytes(self.store.files[match.group(1)]["content"], "application/octet-stream")
+        self._send({"error": {"message": f"Unknown path {path}"}}, 404)
+
+    def _get_path(self) -> str:
+        path = self.path.split("?")[0]
+        return path[len("/v1"):] if path.startswith("/v1/") else path
+
+    def _parse_multipart(self, body: bytes) -> Dict[str, Dict[str, Any]]:
+        message = BytesParser(policy=HTTP).parsebytes(f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body)
+        return {part.get_param("name", header="content-disposition"): {"filename": part.get_filename(), "content": part.get_payload(decode=True)}
+                for part in message.iter_parts()}
+
+    def _send(self, data: Dict[str, Any], status: int = 200):
+        self._send_bytes(json.dumps(data, ensure_ascii=False).encode("utf-8"), "application/json", status)
+
+    def _send_bytes(self, content: bytes, content_type: str, status: int = 200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+def create_server(port: int = 8400, delay: float = 5.0) -> ThreadingHTTPServer:
+    handler = type("Handler", (FakeBatchHandler,), {"store": FakeBatchStore(delay)})
+    return ThreadingHTTPServer(("127.0.0.1", port), handler)
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI Batch API, answering with the fake chat model")
+    parser.add_argument("-p", "--port", type=int, default=8400, help="Port to listen on")
+    parser.add_argument("-d", "--delay", type=float, default=5.0, help="Seconds each batch stays in progress before completing")
+    args = parser.parse_args()
+
+    server = create_server(args.port, args.delay)
+    logger.info(f"Fake Batch API listening on http://127.0.0.1:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple
+from shared.utils import DBHelper
+
+class ConnectState:
+    """
+    Last connect attempt of each item of an entity, stored in the connect_state table
+    with its result and the versions of the inputs it depended on (e.g. the last car
+    model id, or the last car of the launches it links to). Items that did not connect
+    are only attempted again when the versions of their inputs change, so runs without
+    new data do not parse or score them again.
+    """
+    CONNECTED = "connected"
+    NO_MATCH = "no_match"
+    NO_INPUT = "no_input"
+
+    def __init__(self, entity: str):
+        self.db = DBHelper()
+        self.entity = entity
+
+    def select_pending(self, items_query: str, params: Optional[tuple] = None) -> List[Dict[str, Any]]:
+        """
+        Rows of items_query, which must return id and input_versions (JSONB) columns,
+        of the items never attempted or whose input versions changed since the last attempt.
+        """
+        return self.db.execute_query(f"""
+            SELECT i.* FROM ({items_query}) AS i
+            WHERE NOT EXISTS (
+                SELECT 1 FROM connect_state cs
+                WHERE cs.entity = %s AND cs.item_id = i.id AND cs.input_versions = i.input_versions
+            )
+        """, (*(params or ()), self.entity))
+
+    def save(self, attempts: List[Tuple[int, str, Dict[str, Any]]]) -> None:
+        """Record the (item_id, result, input_versions) of the items just attempted."""
+        self.db.execute_values("""
+            INSERT INTO connect_state (entity, item_id, result, input_versions)
+            VALUES %s
+            ON CONFLICT (entity, item_id) DO UPDATE
+            SET result = EXCLUDED.result, input_versions = EXCLUDED.input_versions, date_attempted = NOW()
+        """, [(self.entity, item_id, result, json.dumps(input_versions)) for item_id, result, input_versions in attempts],
+            template="(%s, %s, %s, %s::jsonb)")
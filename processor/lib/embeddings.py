@@ -1,6 +1,28 @@
-from typing import List, Dict, Any
+from typing import Any, Callable, Dict, List
 from dataclasses import dataclass, asdict
 
+def _create_openai_embeddings(model_name: str, dimensions: int):
+    from langchain_openai import OpenAIEmbeddings
+    return OpenAIEmbeddings(model=model_name)
+
+def _create_fake_embeddings(model_name: str, dimensions: int):
+    from lib.fake_llm import FakeEmbeddings
+    return FakeEmbeddings(model_name=model_name, dimensions=dimensions)
+
+# Embedding model factories by provider name, taking model name and dimensions
+EMBEDDING_PROVIDERS: Dict[str, Callable[[str, int], Any]] = {
+    "openai": _create_openai_embeddings,
+    "fake": _create_fake_embeddings,
+}
+
+def register_embedding_provider(company_name: str, factory: Callable[[str, int], Any]) -> None:
+    EMBEDDING_PROVIDERS[company_name] = factory
+
+def get_embedding_model(company_name: str, model_name: str, dimensions: int):
+    if company_name not in EMBEDDING_PROVIDERS:
+        raise ValueError(f"Embedding provider {company_name} not supported")
+    return EMBEDDING_PROVIDERS[company_name](model_name, dimensions)
+
 @dataclass
 class AutobotEmbedding:
     chunk: str
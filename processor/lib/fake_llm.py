@@ -0,0 +1,201 @@
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+FAKE_PROVIDER = "fake"
+# PydanticOutputParser embeds the JSON schema of the expected output in its format instructions
+FORMAT_INSTRUCTIONS_SCHEMA = re.compile(r"output schema:\s*```(?:json)?\s*(\{.*?\})\s*```", re.DOTALL)
+# Batched section prompts identify each section as "[id=N]"; generated section_ids come from them
+SECTION_ID_PATTERN = re.compile(r"\[id=(\d+)\]")
+FAKE_WORDS = ["motor", "diseño", "confort", "precio", "equipamiento", "seguridad", "consumo", "espacio",
+              "calidad", "manejo", "tecnología", "versión", "potencia", "terminaciones", "garantía"]
+
+@dataclass
+class FakeProviderConfig:
+    """
+    Behaviour of the fake chat and embedding providers. Latency follows a lognormal
+    distribution around latency_median; error_rate and rate_limit_rate are the
+    probabilities of a call failing with a server error or a 429, and
+    requests_per_minute, if set, makes every model answer 429 above that rate.
+    """
+    latency_median: float = 0.5
+    latency_sigma: float = 0.5
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    requests_per_minute: Optional[int] = None
+    chars_per_token: float = 4.0
+    embedding_dimensions: int = 1536
+    seed: int = 0
+
+    @classmethod
+    def from_env(cls) -> 'FakeProviderConfig':
+        config = cls()
+        for name, value in vars(config).items():
+            env_value = os.getenv(f"FAKE_LLM_{name.upper()}")
+            if env_value is not None:
+                setattr(config, name, int(env_value) if name in ("requests_per_minute", "embedding_dimensions", "seed") else float(env_value))
+        return config
+
+class FakeProviderError(Exception):
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+class FakeProvider:
+    """Latency, failure injection and server-side rate limits shared by the fake models."""
+    def __init__(self, config: FakeProviderConfig):
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.calls: Dict[str, Deque[float]] = {}
+        self.lock = threading.Lock()
+
+    def simulate_call(self, model_name: str) -> None:
+        with self.lock:
+            latency = self.config.latency_median * math.exp(self.config.latency_sigma * self.random.gauss(0, 1))
+            failure = self.random.random()
+            rate_limited = self._over_rate_limit(model_name)
+        time.sleep(latency)
+        if rate_limited or failure < self.config.rate_limit_rate:
+            raise FakeProviderError(f"Rate limit reached for {model_name} (fake)", 429)
+        if failure < self.config.rate_limit_rate + self.config.error_rate:
+            raise FakeProviderError(f"Internal server error from {model_name} (fake)", 500)
+
+    def _over_rate_limit(self, model_name: str) -> bool:
+        if not self.config.requests_per_minute:
+            return False
+        now = time.monotonic()
+        calls = self.calls.setdefault(model_name, deque())
+        while calls and calls[0] < now - 60:
+            calls.popleft()
+        if len(calls) >= self.config.requests_per_minute:
+            return True
+        calls.append(now)
+        return False
+
+    def count_tokens(self, text: str) -> int:
+        return max(1, math.ceil(len(text) / self.config.chars_per_token))
+
+_provider: Optional[FakeProvider] = None
+_provider_lock = threading.Lock()
+
+def get_fake_provider() -> FakeProvider:
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            _provider = FakeProvider(FakeProviderConfig.from_env())
+        return _provider
+
+def configure_fake_provider(config: FakeProviderConfig) -> None:
+    global _provider
+    with _provider_lock:
+        _provider = FakeProvider(config)
+
+def seeded_random(*parts: Any) -> random.Random:
+    digest = hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return random.Random(int(digest[:16], 16))
+
+def generate_from_schema(schema: Dict[str, Any], rng: random.Random, definitions: Optional[Dict[str, Any]] = None,
+                         section_ids: Optional[List[int]] = None, name: str = "") -> Any:
+    """Generate a value valid for a JSON schema, as produced by pydantic or lib.llm_schema."""
+    definitions = definitions if definitions is not None else schema.get("definitions", {})
+    if "$ref" in schema:
+        return generate_from_schema(definitions[schema["$ref"].split("/")[-1]], rng, definitions, section_ids, name)
+    if "allOf" in schema:
+        return generate_from_schema(schema["allOf"][0], rng, definitions, section_ids, name)
+    if "enum" in schema:
+        return rng.choice(schema["enum"])
+
+    schema_type = schema.get("type", "object" if "properties" in schema else "string")
+    if schema_type == "object":
+        return {prop_name: generate_from_schema(prop, rng, definitions, section_ids, prop_name)
+                for prop_name, prop in schema.get("properties", {}).items()}
+    if schema_type == "array":
+        items = schema.get("items", {})
+        item_properties = definitions.get(items.get("$ref", "").split("/")[-1], items).get("properties", {})
+        if section_ids and "section_id" in item_properties:
+            return [{**generate_from_schema(items, rng, definitions, None), "section_id": section_id} for section_id in section_ids]
+        return [generate_from_schema(items, rng, definitions, section_ids) for _ in range(rng.randint(1, 3))]
+    if schema_type == "integer":
+        return rng.randint(1, 99999) if "price" in name else rng.randint(1, 500)
+    if schema_type == "number":
+        # Scores are the only unbounded numbers in the analyses and must stay within -1..1
+        return round(rng.uniform(-1, 1), 2) if "score" in name else round(rng.uniform(1, 100), 1)
+    if schema_type == "boolean":
+        return rng.random() < 0.5
+    return " ".join(rng.choice(FAKE_WORDS) for _ in range(rng.randint(3, 12)))
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model answering offline. Completions are generated deterministically from the
+    messages: a tool call matching the bound tool schema, JSON matching the schema in
+    PydanticOutputParser format instructions, or plain Spanish-looking text.
+    """
+    model_name: str = "fake"
+
+    @property
+    def _llm_type(self) -> str:
+        return FAKE_PROVIDER
+
+    def bind_tools(self, tools: List[Dict[str, Any]], tool_choice: Optional[str] = None, **kwargs: Any):
+        return self.bind(tools=tools, tool_choice=tool_choice, **kwargs)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                  tools: Optional[List[Dict[str, Any]]] = None, **kwargs: Any) -> ChatResult:
+        provider = get_fake_provider()
+        provider.simulate_call(self.model_name)
+        prompt = "\n".join(str(message.content) for message in messages)
+        rng = seeded_random(self.model_name, prompt, tools)
+        section_ids = [int(section_id) for section_id in SECTION_ID_PATTERN.findall(prompt)]
+
+        tool_calls = []
+        if tools:
+            tool = tools[0]
+            arguments = generate_from_schema(tool["parameters"], rng, section_ids=section_ids)
+            tool_calls = [{"name": tool["name"], "args": arguments, "id": f"call_{rng.getrandbits(32):08x}"}]
+            content = ""
+            completion = json.dumps(arguments, ensure_ascii=False)
+        else:
+            match = FORMAT_INSTRUCTIONS_SCHEMA.search(prompt)
+            if match:
+                content = json.dumps(generate_from_schema(json.loads(match.group(1)), rng, section_ids=section_ids), ensure_ascii=False)
+            else:
+                content = generate_from_schema({"type": "string"}, rng)
+            completion = content
+
+        input_tokens = provider.count_tokens(prompt)
+        output_tokens = provider.count_tokens(completion)
+        message = AIMessage(content=content, tool_calls=tool_calls,
+                            usage_metadata={"input_tokens": input_tokens, "output_tokens": output_tokens,
+                                            "total_tokens": input_tokens + output_tokens})
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+class FakeEmbeddings(Embeddings):
+    """Unit vectors derived from a hash of each text, so equal texts always get equal embeddings."""
+    def __init__(self, model_name: str = "fake", dimensions: Optional[int] = None):
+        self.model_name = model_name
+        self.dimensions = dimensions or get_fake_provider().config.embedding_dimensions
+
+    def _embed(self, text: str) -> List[float]:
+        rng = seeded_random(self.model_name, text)
+        vector = [rng.gauss(0, 1) for _ in range(self.dimensions)]
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        get_fake_provider().simulate_call(self.model_name)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
@@ -0,0 +1,135 @@
+import os
+import socket
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from shared.utils import DBHelper
+
+# Jobs of stages that work on the whole data set rather than on single entities
+SINGLETON_ENTITY_ID = 0
+
+@dataclass
+class Job:
+    id: int
+    stage: str
+    entity_id: int
+    attempts: int
+
+def get_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+class JobQueue:
+    """
+    Queue of pipeline jobs stored in the jobs table, one per stage and entity.
+    Workers claim pending jobs (or jobs whose lease expired) with SELECT ... FOR UPDATE
+    SKIP LOCKED, so several processes never claim the same job, and keep their leases
+    alive with heartbeats while they work. Failed jobs go back to pending until they
+    reach max_attempts, and are then left as dead for inspection.
+    """
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    DEAD = "dead"
+
+    def __init__(self, worker_id: Optional[str] = None, lease_seconds: int = 600, max_attempts: int = 3):
+        self.db = DBHelper()
+        self.worker_id = worker_id or get_worker_id()
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def enqueue(self, stage: str, pending_query: str) -> int:
+        """
+        Add a job for every id returned by pending_query. Done jobs whose entity is pending
+        again are reopened; jobs already pending, running or dead are left untouched.
+        """
+        results = self.db.execute_query(f"""
+            WITH enqueued AS (
+                INSERT INTO jobs (stage, entity_id, max_attempts)
+                SELECT %s, p.id, %s FROM ({pending_query}) AS p
+                ON CONFLICT (stage, entity_id) DO UPDATE
+                SET status = 'pending', attempts = 0, last_error = NULL, worker_id = NULL, lease_expires_at = NULL
+                WHERE jobs.status = 'done'
+                RETURNING 1
+            )
+            SELECT COUNT(*) AS count FROM enqueued
+        """, (stage, self.max_attempts))
+        return results[0]["count"]
+
+    def enqueue_singleton(self, stage: str) -> int:
+        return self.enqueue(stage, f"SELECT {SINGLETON_ENTITY_ID} AS id")
+
+    def claim(self, stage: str, limit: int = 1) -> List[Job]:
+        with self.db.get_cursor() as cur:
+            # Jobs abandoned by a dead worker with no attempts left are not claimed again
+            cur.execute("""
+                UPDATE jobs SET status = 'dead', last_error = COALESCE(last_error, 'Lease expired')
+                WHERE stage = %s AND status = 'running' AND lease_expires_at < NOW() AND attempts >= max_attempts
+            """, (stage,))
+            cur.execute("""
+                UPDATE jobs
+                SET status = 'running', worker_id = %s, attempts = attempts + 1,
+                    lease_expires_at = NOW() + %s * INTERVAL '1 second', date_started = NOW()
+                WHERE id IN (
+                    SELECT id FROM jobs
+                    WHERE stage = %s
+                      AND (status = 'pending' OR (status = 'running' AND lease_expires_at < NOW()))
+                    ORDER BY id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, stage, entity_id, attempts
+            """, (self.worker_id, self.lease_seconds, stage, limit))
+            return [Job(*row) for row in cur.fetchall()]
+
+    def heartbeat(self, jobs: List[Job]) -> None:
+        self.db.execute_query("""
+            UPDATE jobs SET lease_expires_at = NOW() + %s * INTERVAL '1 second'
+            WHERE id = ANY(%s) AND worker_id = %s AND status = 'running'
+        """, (self.lease_seconds, [job.id for job in jobs], self.worker_id))
+
+    def complete(self, jobs: List[Job]) -> None:
+        if not jobs:
+            return
+        self.db.execute_query("""
+            UPDATE jobs SET status = 'done', lease_expires_at = NULL, last_error = NULL, date_finished = NOW()
+            WHERE id = ANY(%s) AND worker_id = %s
+        """, ([job.id for job in jobs], self.worker_id))
+
+    def fail(self, jobs: List[Job], error: str) -> None:
+        if not jobs:
+            return
+        self.db.execute_query("""
+            UPDATE jobs
+            SET status = CASE WHEN attempts >= max_attempts THEN 'dead' ELSE 'pending' END,
+                lease_expires_at = NULL, last_error = %s, date_finished = NOW()
+            WHERE id = ANY(%s) AND worker_id = %s
+        """, (error, [job.id for job in jobs], self.worker_id))
+
+    def release(self, jobs: List[Job]) -> None:
+        """Return claimed jobs to pending without counting the attempt, e.g. when the run budget is spent."""
+        if not jobs:
+            return
+        self.db.execute_query("""
+            UPDATE jobs SET status = 'pending', attempts = GREATEST(attempts - 1, 0), worker_id = NULL, lease_expires_at = NULL
+            WHERE id = ANY(%s) AND worker_id = %s
+        """, ([job.id for job in jobs], self.worker_id))
+
+    def retry_dead(self, stage: Optional[str] = None) -> int:
+        results = self.db.execute_query("""
+            WITH retried AS (
+                UPDATE jobs SET status = 'pending', attempts = 0, last_error = NULL
+                WHERE status = 'dead' AND (%s IS NULL OR stage = %s)
+                RETURNING 1
+            )
+            SELECT COUNT(*) AS count FROM retried
+        """, (stage, stage))
+        return results[0]["count"]
+
+    def get_counts(self) -> Dict[str, Dict[str, int]]:
+        counts: Dict[str, Dict[str, int]] = {}
+        for row in self.db.execute_query("SELECT stage, status, COUNT(*) AS count FROM jobs GROUP BY stage, status ORDER BY stage"):
+            counts.setdefault(row["stage"], {})[row["status"]] = row["count"]
+        return counts
+
+    def get_summary(self) -> str:
+        return "\n".join(f"{stage}: " + ", ".join(f"{count} {status}" for status, count in statuses.items())
+                         for stage, statuses in self.get_counts().items())
@@ -0,0 +1,192 @@
+import io
+import json
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+from loguru import logger
+from shared.utils import DBHelper
+from shared.lib.llm_usage import LLMUsage
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_COMPLETION_WINDOW = "24h"
+# Limits of a single batch input file, below the API limits so that the requests of an entity can stay together
+MAX_BATCH_REQUESTS = 49000
+MAX_BATCH_BYTES = 190 * 1024 * 1024
+# Provider batch statuses after which no output will come
+FINISHED_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+@dataclass
+class BatchRequest:
+    custom_id: str
+    body: Dict[str, Any]
+    # What the processor needs to ingest the result: entity ids, action, model, cache key
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+@dataclass
+class BatchResult:
+    custom_id: str
+    metadata: Dict[str, Any]
+    completion: Optional[str] = None
+    error: Optional[str] = None
+    usage: LLMUsage = field(default_factory=LLMUsage)
+
+class BatchClient:
+    """
+    Files and batches endpoints of the OpenAI API. The client honours OPENAI_BASE_URL,
+    so it can be pointed at a stand-in server such as fake_batch_server.py.
+    """
+    def __init__(self, base_url: Optional[str] = None, api_key: Optional[str] = None):
+        from openai import OpenAI
+        self.client = OpenAI(base_url=base_url, api_key=api_key)
+
+    def submit(self, requests: List[BatchRequest], description: str) -> Dict[str, str]:
+        lines = "".join(json.dumps({"custom_id": request.custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": request.body},
+                                   ensure_ascii=False) + "\n" for request in requests)
+        input_file = self.client.files.create(file=("batch.jsonl", io.BytesIO(lines.encode("utf-8"))), purpose="batch")
+        batch = self.client.batches.create(input_file_id=input_file.id, endpoint=BATCH_ENDPOINT,
+                                           completion_window=BATCH_COMPLETION_WINDOW, metadata={"description": description})
+        return {"batch_id": batch.id, "input_file_id": input_file.id}
+
+    def retrieve(self, batch_id: str):
+        return self.client.batches.retrieve(batch_id)
+
+    def download(self, file_id: Optional[str]) -> List[Dict[str, Any]]:
+        if not file_id:
+            return []
+        content = self.client.files.content(file_id).text
+        return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+class LLMBatches:
+    """
+    Chat completion requests run through the OpenAI Batch API at half price, for
+    backfills that do not need interactive latency. Submitted batches are recorded
+    in the llm_batches table with the ids of their entities, so that they are not
+    submitted or processed again while open, and any later process can poll and
+    ingest them.
+    """
+    SUBMITTED = "submitted"
+    INGESTED = "ingested"
+    FAILED = "failed"
+
+    def __init__(self, gateway, client: Optional[BatchClient] = None, poll_seconds: int = 60):
+        self.db = DBHelper()
+        # LLMGateway reading the completions, their usage and caching them
+        self.gateway = gateway
+        self._client = client
+        self.poll_seconds = poll_seconds
+
+    @property
+    def client(self) -> BatchClient:
+        # Created on first use, so processors that never batch need no API key
+        if self._client is None:
+            self._client = BatchClient()
+        return self._client
+
+    @staticmethod
+    def get_open_filter(entity: str, id_column: str) -> str:
+        """SQL condition excluding the entities waiting in an open batch. id_column must be qualified with its table."""
+        return f"""NOT EXISTS (SELECT 1 FROM llm_batches b
+                   WHERE b.entity = '{entity}' AND b.status = 'submitted' AND {id_column} = ANY(b.entity_ids))"""
+
+    def submit(self, entity: str, requests: List[BatchRequest]) -> int:
+        """Submit requests in as few batches as the API limits allow. Returns the number of entities submitted."""
+        submitted = 0
+        for chunk in self._split(requests):
+            try:
+                ids = self.client.submit(chunk, f"autobot {entity}")
+            except Exception as e:
+                logger.error(f"Error submitting a batch of {len(chunk)} {entity} requests: {str(e)}")
+                continue
+            entity_ids = sorted({entity_id for request in chunk for entity_id in request.metadata.get("entity_ids", [])})
+            self.db.execute_query("""
+                INSERT INTO llm_batches (batch_id, entity, entity_ids, requests, num_requests, input_file_id)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, (ids["batch_id"], entity, entity_ids, json.dumps({request.custom_id: request.metadata for request in chunk}),
+                  len(chunk), ids["input_file_id"]))
+            logger.info(f"Submitted batch {ids['batch_id']} with {len(chunk)} requests for {len(entity_ids)} {entity}")
+            submitted += len(entity_ids)
+        return submitted
+
+    @staticmethod
+    def _split(requests: List[BatchRequest]) -> List[List[BatchRequest]]:
+        # Consecutive requests of the same entities (an article and its sections) stay in the same batch, so they are ingested together
+        chunks: List[List[BatchRequest]] = [[]]
+        chunk_bytes = 0
+        for request in requests:
+            request_bytes = len(json.dumps(request.body, ensure_ascii=False).encode("utf-8")) + 200
+            same_entities = chunks[-1] and chunks[-1][-1].metadata.get("entity_ids") == request.metadata.get("entity_ids")
+            if chunks[-1] and not same_entities and (len(chunks[-1]) >= MAX_BATCH_REQUESTS or chunk_bytes + request_bytes > MAX_BATCH_BYTES):
+                chunks.append([])
+                chunk_bytes = 0
+            chunks[-1].append(request)
+            chunk_bytes += request_bytes
+        return [chunk for chunk in chunks if chunk]
+
+    def get_open_batches(self, entity: str) -> List[Dict[str, Any]]:
+        return self.db.execute_query("""
+            SELECT id, batch_id, requests, num_requests
+            FROM llm_batches
+            WHERE entity = %s AND status = 'submitted'
+            ORDER BY id ASC
+        """, (entity,))
+
+    def collect(self, entity: str, ingest: Callable[[List[BatchResult]], None], wait: bool = False) -> int:
+        """
+        Poll the open batches of entity and pass the results of every finished one to
+        ingest, which must persist them before the batch is marked as ingested.
+        With wait, keep polling until no batch is left open. Returns the number of
+        batches ingested.
+        """
+        ingested = 0
+        while True:
+            open_batches = self.get_open_batches(entity)
+            waiting = 0
+            for batch in open_batches:
+                provider_batch = self.client.retrieve(batch["batch_id"])
+                if provider_batch.status not in FINISHED_STATUSES:
+                    counts = provider_batch.request_counts
+                    progress = f"{counts.completed + counts.failed}/{counts.total}" if counts else "?"
+                    logger.info(f"Batch {batch['batch_id']} is {provider_batch.status} ({progress} requests)")
+                    waiting += 1
+                    continue
+                if provider_batch.status != "completed" and not provider_batch.output_file_id:
+                    self._mark(batch["id"], self.FAILED, last_error=f"Batch {provider_batch.status}: {provider_batch.errors}")
+                    logger.error(f"Batch {batch['batch_id']} {provider_batch.status}, its {entity} are pending again")
+                    continue
+
+                # Expired and cancelled batches still return the requests that completed
+                lines = self.client.download(provider_batch.output_file_id) + self.client.download(provider_batch.error_file_id)
+                results = [self._read_line(line, batch["requests"]) for line in lines]
+                results = [result for result in results if result]
+                ingest(results)
+                self._mark(batch["id"], self.INGESTED, output_file_id=provider_batch.output_file_id)
+                failed = sum(1 for result in results if result.error)
+                logger.info(f"Ingested batch {batch['batch_id']}: {len(results) - failed} completions, {failed} errors")
+                ingested += 1
+            if not wait or not waiting:
+                return ingested
+            time.sleep(self.poll_seconds)
+
+    def _read_line(self, line: Dict[str, Any], requests: Dict[str, Dict[str, Any]]) -> Optional[BatchResult]:
+        metadata = requests.get(line.get("custom_id"))
+        if metadata is None:
+            logger.warning(f"Batch result with unknown custom_id {line.get('custom_id')}")
+            return None
+        result = BatchResult(custom_id=line["custom_id"], metadata=metadata,
+                             usage=LLMUsage(action=metadata.get("action", ""), model_name=metadata.get("model_name", "")))
+        response = line.get("response") or {}
+        if line.get("error") or response.get("status_code") != 200:
+            error = line.get("error") or (response.get("body") or {}).get("error")
+            result.error = f"{response.get('status_code')}: {error}"
+            return result
+        try:
+            result.completion = self.gateway.read_batch_response(response["body"], result.usage)
+        except (KeyError, IndexError, ValueError) as e:
+            result.error = f"Malformed response: {str(e)}"
+        return result
+
+    def _mark(self, id: int, status: str, output_file_id: Optional[str] = None, last_error: Optional[str] = None) -> None:
+        self.db.execute_query("""
+            UPDATE llm_batches SET status = %s, output_file_id = %s, last_error = %s, date_finished = NOW()
+            WHERE id = %s
+        """, (status, output_file_id, last_error, id))
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+from langchain.prompts import ChatPromptTemplate
+from loguru import logger
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'shared', 'tmp', 'llm_cache', 'completions.sqlite')
+
+class LLMCacheMiss(Exception):
+    """Raised in cache-only mode when a completion is not in the cache."""
+    pass
+
+@dataclass
+class CachedCompletion:
+    completion: str
+    token_input: int
+    token_output: int
+    cost: float
+
+class LLMCache:
+    """
+    On-disk cache of raw LLM completions, keyed by provider, model, temperature,
+    prompt template and input. Least recently used entries are evicted once the
+    stored completions exceed max_size_mb.
+    """
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_size_mb: int = 512, cache_only: bool = False):
+        self.path = path
+        self.max_size = max_size_mb * 1024 * 1024
+        self.cache_only = cache_only
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                company TEXT,
+                model TEXT,
+                completion TEXT,
+                token_input INTEGER,
+                token_output INTEGER,
+                cost REAL,
+                size INTEGER,
+                created_at REAL,
+                last_used_at REAL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS completions_last_used_at ON completions (last_used_at)")
+        self.conn.commit()
+        self.size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+
+    @staticmethod
+    def _hash(value: Any) -> str:
+        return hashlib.sha256(json.dumps(value, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+    def make_key(self, company_name: str, model_name: str, temperature: Any, prompt: ChatPromptTemplate, input_data: Dict[str, Any],
+                 tool_schema: Optional[Dict[str, Any]] = None) -> str:
+        template_hash = self._hash([repr(message) for message in prompt.messages])
+        input_hash = self._hash(input_data)
+        key = [company_name, model_name, str(temperature), template_hash, input_hash]
+        if tool_schema:
+            key.append(self._hash(tool_schema))
+        return self._hash(key)
+
+    def get(self, key: str) -> Optional[CachedCompletion]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT completion, token_input, token_output, cost FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row:
+                self.hits += 1
+                self.conn.execute("UPDATE completions SET last_used_at = ? WHERE key = ?", (time.time(), key))
+                self.conn.commit()
+                return CachedCompletion(*row)
+            self.misses += 1
+        if self.cache_only:
+            raise LLMCacheMiss(f"Completion {key[:12]} is not cached and the cache is in cache-only mode")
+        return None
+
+    def contains(self, key: str) -> bool:
+        """Whether key is cached, without counting a hit or miss."""
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM completions WHERE key = ?", (key,)).fetchone() is not None
+
+    def put(self, key: str, company_name: str, model_name: str, completion: str, token_input: int = 0, token_output: int = 0, cost: float = 0.0) -> None:
+        size = len(completion.encode('utf-8'))
+        now = time.time()
+        with self.lock:
+            previous = self.conn.execute("SELECT size FROM completions WHERE key = ?", (key,)).fetchone()
+            self.conn.execute("""
+                INSERT OR REPLACE INTO completions
+                (key, company, model, completion, token_input, token_output, cost, size, created_at, last_used_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (key, company_name, model_name, completion, token_input, token_output, cost, size, now, now))
+            self.size += size - (previous[0] if previous else 0)
+            if self.size > self.max_size:
+                self._evict()
+            self.conn.commit()
+
+    def _evict(self) -> None:
+        # Drop least recently used entries until the cache is back to 90% of its size budget
+        target = int(self.max_size * 0.9)
+        evicted = 0
+        for key, size in self.conn.execute("SELECT key, size FROM completions ORDER BY last_used_at ASC").fetchall():
+            if self.size <= target:
+                break
+            self.conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+            self.size -= size
+            evicted += 1
+        logger.info(f"LLM cache evicted {evicted} completions")
+
+    def get_summary(self) -> str:
+        return f"LLM cache: {self.hits} hits, {self.misses} misses, {self.size / (1024 * 1024):.1f}MB stored"
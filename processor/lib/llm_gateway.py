@@ -0,0 +1,251 @@
+import json
+import threading
+from typing import Any, Callable, Dict, Optional
+from langchain.prompts import ChatPromptTemplate
+from langchain_core.language_models.base import BaseLanguageModel
+from langchain_community.callbacks.manager import get_openai_callback
+from loguru import logger
+from shared.lib.llm_usage import LLMUsage
+from shared.lib.llm_tokens import count_tokens, get_context_window
+from shared.lib.llm_pricing import estimate_time, get_cost
+from lib.llm_cache import LLMCache
+from lib.llm_scheduler import LLMScheduler
+from lib.llm_batch import BatchRequest, BatchResult
+from lib.run_budget import RunBudget
+
+DEFAULT_COMPANY = "openai"
+DEFAULT_MODEL = "gpt-3.5-turbo"
+DEFAULT_TEMPERATURE = "0"
+# Completion tokens reserved from the token budget before a request is sent
+ESTIMATED_OUTPUT_TOKENS = 500
+# Per-message formatting tokens added by the chat APIs, rounded up
+MESSAGE_OVERHEAD_TOKENS = 20
+# Chat API roles of the langchain message types
+MESSAGE_ROLES = {"system": "system", "human": "user", "ai": "assistant"}
+
+class InputBudgetError(ValueError):
+    """Raised when a model's context window leaves no room for the variable inputs of a prompt, so a larger model is needed."""
+    pass
+
+def _create_openai(model_name: str, temperature: str, max_retries: int) -> BaseLanguageModel:
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(model=model_name, temperature=temperature, max_retries=max_retries)
+
+def _create_groq(model_name: str, temperature: str, max_retries: int) -> BaseLanguageModel:
+    from langchain_groq import ChatGroq
+    return ChatGroq(model=model_name, temperature=temperature, max_retries=max_retries)
+
+def _create_anthropic(model_name: str, temperature: str, max_retries: int) -> BaseLanguageModel:
+    from langchain_anthropic import ChatAnthropic
+    return ChatAnthropic(model=model_name, temperature=temperature, max_retries=max_retries)
+
+def _create_fake(model_name: str, temperature: str, max_retries: int) -> BaseLanguageModel:
+    from lib.fake_llm import FakeChatModel
+    return FakeChatModel(model_name=model_name)
+
+# Chat model factories by provider name, taking model name, temperature and max retries
+CHAT_PROVIDERS: Dict[str, Callable[[str, str, int], BaseLanguageModel]] = {
+    "openai": _create_openai,
+    "groq": _create_groq,
+    "anthropic": _create_anthropic,
+    "fake": _create_fake,
+}
+
+def register_chat_provider(company_name: str, factory: Callable[[str, str, int], BaseLanguageModel]) -> None:
+    CHAT_PROVIDERS[company_name] = factory
+
+class LLM:
+    def __init__(self, model: str, company: str, temperature: str = "0", llm = None, max_retries: int = 2):
+        self.model = model
+        self.company = company
+        self.temperature = temperature
+        self.llm = llm
+        self.max_retries = max_retries
+
+class LLMGateway:
+    """
+    Entry point used by the processors to build chat models and run completions.
+    Completions are served from the LLM cache when available, and every provider
+    call goes through the process-wide LLMScheduler and is charged to the run budget.
+    """
+    def __init__(self, cache: Optional[LLMCache] = None, scheduler: Optional[LLMScheduler] = None, provider: Optional[str] = None,
+                 budget: Optional[RunBudget] = None):
+        self.cache = cache
+        self.scheduler = scheduler or LLMScheduler.get_instance()
+        self.budget = budget
+        # Serve every company's models from this provider instead, e.g. "fake" for offline runs
+        self.provider = provider
+        self.llms = []
+        self.lock = threading.Lock()
+
+    def _get_provider(self, company_name: str) -> str:
+        return self.provider or company_name
+
+    def get_llm(self, company_name: str = DEFAULT_COMPANY, model_name: str = DEFAULT_MODEL, temperature: str = DEFAULT_TEMPERATURE, max_retries=2) -> BaseLanguageModel:
+        company_name = self._get_provider(company_name)
+        with self.lock:
+            for llm in self.llms:
+                if llm.company == company_name and llm.model == model_name and llm.temperature == temperature and llm.max_retries == max_retries:
+                    return llm.llm
+
+            if company_name not in CHAT_PROVIDERS:
+                raise ValueError(f"LLM provider {company_name} not supported")
+            llm = CHAT_PROVIDERS[company_name](model_name, temperature, max_retries)
+
+            self.llms.append(LLM(model=model_name, company=company_name, temperature=temperature, llm=llm, max_retries=max_retries))
+            return llm
+
+    def get_input_budget(self, prompt: ChatPromptTemplate, static_input: Dict[str, Any], model_name: str, output_tokens: int,
+                         tool_schema: Optional[Dict[str, Any]] = None) -> int:
+        """
+        Tokens left in the model's context window for the variable inputs of prompt,
+        once the template, static_input, tool_schema and output_tokens of completion are accounted for.
+        Raises InputBudgetError if none are left, which ModelRouter.run escalates to a stronger model.
+        """
+        messages = prompt.format_messages(**static_input)
+        static_tokens = count_tokens(" ".join(m.content for m in messages), model_name) + MESSAGE_OVERHEAD_TOKENS * len(messages)
+        if tool_schema:
+            static_tokens += count_tokens(json.dumps(tool_schema), model_name)
+        budget = get_context_window(model_name) - static_tokens - output_tokens
+        if budget <= 0:
+            raise InputBudgetError(f"The {get_context_window(model_name)} token context window of {model_name} leaves no room for the "
+                                   f"input after {static_tokens} prompt and {output_tokens} completion tokens")
+        return budget
+
+    def estimate(self, prompt: ChatPromptTemplate, input_data: Dict[str, Any], company_name: str, model_name: str, output_tokens: int,
+                 action: str, temperature: str = DEFAULT_TEMPERATURE, tool_schema: Optional[Dict[str, Any]] = None) -> LLMUsage:
+        """
+        Estimated usage of invoke() with the same arguments, without calling the provider:
+        counted input tokens, the expected output_tokens, list price and wall time.
+        Completions already in the cache cost nothing.
+        """
+        usage = LLMUsage(action=action, model_name=model_name)
+        if self.cache and self.cache.contains(self.cache.make_key(self._get_provider(company_name), model_name, temperature, prompt, input_data, tool_schema)):
+            return usage
+        messages = prompt.format_messages(**input_data)
+        usage.token_input = count_tokens(" ".join(m.content for m in messages), model_name) + MESSAGE_OVERHEAD_TOKENS * len(messages)
+        if tool_schema:
+            usage.token_input += count_tokens(json.dumps(tool_schema), model_name)
+        usage.token_output = output_tokens
+        usage.cost = get_cost(model_name, usage.token_input, usage.token_output)
+        usage.time = estimate_time(model_name, output_tokens)
+        return usage
+
+    def invoke(self, prompt: ChatPromptTemplate, parser, input_data: Dict[str, Any], company_name: str, model_name: str,
+               usage: LLMUsage, temperature: str = DEFAULT_TEMPERATURE, tool_schema: Optional[Dict[str, Any]] = None) -> Any:
+        """
+        Run prompt | llm | parser, recording token usage and cost in usage. With a
+        tool_schema (see lib.llm_schema.to_tool_schema) the model is forced to call that
+        tool, and the JSON of its arguments is what parser receives.
+        """
+        key = None
+        if self.cache:
+            key = self.cache.make_key(self._get_provider(company_name), model_name, temperature, prompt, input_data, tool_schema)
+            cached = self.cache.get(key)
+            if cached:
+                logger.debug(f"LLM cache hit for {usage.action or usage.node_title} ({model_name})")
+                return parser.parse(cached.completion)
+
+        if self.budget:
+            self.budget.check()
+        messages = prompt.format_messages(**input_data)
+        completion = self._complete(messages, company_name, model_name, temperature, usage, tool_schema)
+        if self.budget:
+            self.budget.record(usage)
+        output = parser.parse(completion)
+
+        # Only completions that parse are cached, so a bad answer is retried on the next run
+        if self.cache:
+            self.cache.put(key, self._get_provider(company_name), model_name, completion, usage.token_input, usage.token_output, usage.cost)
+        return output
+
+    def _complete(self, messages, company_name: str, model_name: str, temperature: str, usage: LLMUsage,
+                  tool_schema: Optional[Dict[str, Any]] = None) -> str:
+        # Retries are left to the scheduler so that rate limit errors reach it
+        llm = self.get_llm(company_name, model_name, temperature, max_retries=0)
+        estimated_tokens = count_tokens(" ".join(m.content for m in messages), model_name) + ESTIMATED_OUTPUT_TOKENS
+        if tool_schema:
+            llm = llm.bind_tools([tool_schema], tool_choice=tool_schema["name"])
+            estimated_tokens += count_tokens(json.dumps(tool_schema), model_name)
+        # In the lane of the provider that serves the call, so that fake runs are not held to the real provider's limits
+        provider = self._get_provider(company_name)
+        future = self.scheduler.submit(provider, model_name, lambda: self._call(llm, messages, provider, model_name, usage),
+                                       estimated_tokens,
+                                       actual_tokens=lambda _: usage.token_input + usage.token_output)
+        return future.result()
+
+    def _call(self, llm: BaseLanguageModel, messages, company_name: str, model_name: str, usage: LLMUsage) -> str:
+        if company_name == "openai":
+            with get_openai_callback() as cb:
+                response = llm.invoke(messages)
+            usage.token_input = cb.prompt_tokens
+            usage.token_output = cb.completion_tokens
+            usage.cost = cb.total_cost
+        else:
+            response = llm.invoke(messages)
+            usage_metadata = getattr(response, "usage_metadata", None)
+            if usage_metadata:
+                usage.token_input = usage_metadata["input_tokens"]
+                usage.token_output = usage_metadata["output_tokens"]
+                usage.cost = get_cost(model_name, usage.token_input, usage.token_output)
+            else:
+                usage.set_estimated_token_usage_and_cost(company_name, model_name, " ".join(m.content for m in messages), str(response.content))
+        usage.token_cached = self._get_cached_tokens(response)
+        if getattr(response, "tool_calls", None):
+            return json.dumps(response.tool_calls[0]["args"], ensure_ascii=False)
+        return response.content
+
+    @staticmethod
+    def _get_cached_tokens(response) -> int:
+        """Prompt tokens served from the provider's prefix cache, as reported in the response."""
+        usage_metadata = getattr(response, "usage_metadata", None) or {}
+        cache_read = (usage_metadata.get("input_token_details") or {}).get("cache_read")
+        if cache_read is not None:
+            return cache_read
+        metadata = getattr(response, "response_metadata", None) or {}
+        token_usage = metadata.get("token_usage") or metadata.get("usage") or {}
+        if "cache_read_input_tokens" in token_usage:
+            return token_usage["cache_read_input_tokens"] or 0
+        return (token_usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+
+    def make_batch_request(self, custom_id: str, prompt: ChatPromptTemplate, input_data: Dict[str, Any], company_name: str, model_name: str,
+                           temperature: str = DEFAULT_TEMPERATURE, tool_schema: Optional[Dict[str, Any]] = None,
+                           metadata: Optional[Dict[str, Any]] = None) -> BatchRequest:
+        """
+        Build the Batch API request equivalent to invoke(prompt, ..., tool_schema).
+        metadata is returned with the result, together with the model and the cache key.
+        """
+        if company_name != "openai":
+            raise ValueError(f"Batch requests are only supported for OpenAI models, not {company_name}")
+        messages = prompt.format_messages(**input_data)
+        body = {
+            "model": model_name,
+            "temperature": float(temperature),
+            "messages": [{"role": MESSAGE_ROLES[m.type], "content": m.content} for m in messages],
+        }
+        if tool_schema:
+            body["tools"] = [{"type": "function", "function": tool_schema}]
+            body["tool_choice"] = {"type": "function", "function": {"name": tool_schema["name"]}}
+        key = self.cache.make_key(self._get_provider(company_name), model_name, temperature, prompt, input_data, tool_schema) if self.cache else None
+        return BatchRequest(custom_id=custom_id, body=body,
+                            metadata={**(metadata or {}), "model_name": model_name, "cache_key": key})
+
+    def read_batch_response(self, body: Dict[str, Any], usage: LLMUsage) -> str:
+        """Completion of a Batch API response body, recording its token usage and discounted cost in usage."""
+        token_usage = body.get("usage") or {}
+        usage.token_input = token_usage.get("prompt_tokens", 0)
+        usage.token_output = token_usage.get("completion_tokens", 0)
+        usage.token_cached = (token_usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+        usage.cost = get_cost(usage.model_name, usage.token_input, usage.token_output, usage.token_cached, batch=True)
+        message = body["choices"][0]["message"]
+        if message.get("tool_calls"):
+            return json.dumps(json.loads(message["tool_calls"][0]["function"]["arguments"]), ensure_ascii=False)
+        return message.get("content") or ""
+
+    def parse_batch_result(self, result: BatchResult, parser) -> Any:
+        """Parse a batch completion like invoke does, caching it once it parses."""
+        output = parser.parse(result.completion)
+        if self.cache and result.metadata.get("cache_key"):
+            self.cache.put(result.metadata["cache_key"], self._get_provider("openai"), result.usage.model_name, result.completion,
+                           result.usage.token_input, result.usage.token_output, result.usage.cost)
+        return output
@@ -0,0 +1,191 @@
+import asyncio
+import concurrent.futures
+import functools
+import importlib
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+from loguru import logger
+
+# Requests and tokens per minute for each provider and model; "*" applies to any other model of the provider
+DEFAULT_RATE_LIMITS: Dict[str, Dict[str, Tuple[int, int]]] = {
+    "openai": {
+        "gpt-3.5-turbo": (3500, 200000),
+        "gpt-4o": (5000, 450000),
+        "gpt-4o-mini": (5000, 2000000),
+        "*": (500, 30000),
+    },
+    "anthropic": {"*": (50, 40000)},
+    "groq": {"*": (30, 6000)},
+    # The offline fake models, limited only by the lane's concurrency
+    "fake": {"*": (1000000, 1000000000)},
+}
+FALLBACK_RATE_LIMIT = (60, 60000)
+
+# Providers whose client library raises a RateLimitError of its own
+RATE_LIMIT_ERROR_MODULES = ["openai", "anthropic", "groq"]
+
+@functools.lru_cache(maxsize=1)
+def _get_rate_limit_error_types() -> Tuple[type, ...]:
+    # Only the client libraries installed, as each provider's is optional
+    error_types = []
+    for module_name in RATE_LIMIT_ERROR_MODULES:
+        try:
+            error_types.append(importlib.import_module(module_name).RateLimitError)
+        except (ImportError, AttributeError):
+            pass
+    return tuple(error_types)
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Whether error, or the error it was raised from, is a provider's rate limit response (HTTP 429)."""
+    while error is not None:
+        if isinstance(error, _get_rate_limit_error_types()) or getattr(error, "status_code", None) == 429:
+            return True
+        error = error.__cause__
+    return False
+
+class TokenBucket:
+    """Refills at rate_per_minute up to one minute worth of capacity."""
+    def __init__(self, rate_per_minute: float):
+        self.max_rate_per_minute = rate_per_minute
+        self.rate_per_minute = rate_per_minute
+        self.capacity = rate_per_minute
+        self.available = rate_per_minute
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated_at) * self.rate_per_minute / 60)
+        self.updated_at = now
+
+    async def acquire(self, amount: float) -> None:
+        # Requests larger than the whole bucket go through once it is full
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.available >= amount:
+                self.available -= amount
+                return
+            await asyncio.sleep((amount - self.available) * 60 / self.rate_per_minute)
+
+    def adjust(self, amount: float) -> None:
+        # Settle the difference between estimated and actual usage; the bucket may go negative
+        self._refill()
+        self.available -= amount
+
+    def set_rate(self, rate_per_minute: float) -> None:
+        self._refill()
+        self.rate_per_minute = min(self.max_rate_per_minute, max(1.0, rate_per_minute))
+        self.capacity = self.rate_per_minute
+        self.available = min(self.available, self.capacity)
+
+class ModelLane:
+    """Rate limits and adaptive concurrency (AIMD) for one provider and model."""
+    def __init__(self, company_name: str, model_name: str, requests_per_minute: int, tokens_per_minute: int,
+                 initial_concurrency: int = 4, max_concurrency: int = 64):
+        self.name = f"{company_name}/{model_name}"
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.concurrency = float(initial_concurrency)
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.min_latency = None
+        self.latency = None
+        self.slot_released = asyncio.Condition()
+
+    async def acquire(self, estimated_tokens: int) -> None:
+        async with self.slot_released:
+            await self.slot_released.wait_for(lambda: self.in_flight < int(self.concurrency))
+            self.in_flight += 1
+        await self.requests.acquire(1)
+        await self.tokens.acquire(estimated_tokens)
+
+    async def release(self) -> None:
+        async with self.slot_released:
+            self.in_flight -= 1
+            self.slot_released.notify_all()
+
+    def on_success(self, latency: float) -> None:
+        self.min_latency = latency if self.min_latency is None else min(self.min_latency, latency)
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        if self.latency > 3 * self.min_latency:
+            # The provider is queueing our requests; back off a little
+            self.concurrency = max(1.0, self.concurrency * 0.9)
+        else:
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+        # Recover slowly from earlier rate limit errors
+        self.requests.set_rate(self.requests.rate_per_minute * 1.01)
+        self.tokens.set_rate(self.tokens.rate_per_minute * 1.01)
+
+    def on_rate_limited(self) -> None:
+        self.concurrency = max(1.0, self.concurrency / 2)
+        self.requests.set_rate(self.requests.rate_per_minute * 0.8)
+        self.tokens.set_rate(self.tokens.rate_per_minute * 0.8)
+        logger.warning(f"Rate limited by {self.name}. Concurrency: {int(self.concurrency)}, "
+                       f"RPM: {int(self.requests.rate_per_minute)}, TPM: {int(self.tokens.rate_per_minute)}")
+
+class LLMScheduler:
+    """
+    Scheduler for LLM requests. Calls are submitted from any thread and run on a
+    background event loop, subject to the request and token budgets of their provider
+    and model. Each submission returns a concurrent.futures.Future. The processors share
+    the process-wide instance from get_instance(), so that they share the rate limits.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls) -> 'LLMScheduler':
+        """The process-wide scheduler, with the default rate limits."""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, rate_limits: Optional[Dict[str, Dict[str, Tuple[int, int]]]] = None, max_retries: int = 5, max_threads: int = 64):
+        self.rate_limits = rate_limits or DEFAULT_RATE_LIMITS
+        self.max_retries = max_retries
+        self.lanes: Dict[Tuple[str, str], ModelLane] = {}
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="llm")
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="llm-scheduler", daemon=True).start()
+
+    def _get_lane(self, company_name: str, model_name: str) -> ModelLane:
+        key = (company_name, model_name)
+        if key not in self.lanes:
+            company_limits = self.rate_limits.get(company_name, {})
+            requests_per_minute, tokens_per_minute = company_limits.get(model_name, company_limits.get("*", FALLBACK_RATE_LIMIT))
+            self.lanes[key] = ModelLane(company_name, model_name, requests_per_minute, tokens_per_minute)
+        return self.lanes[key]
+
+    def submit(self, company_name: str, model_name: str, fn: Callable[[], Any], estimated_tokens: int,
+               actual_tokens: Optional[Callable[[Any], int]] = None) -> concurrent.futures.Future:
+        """
+        Schedule fn, a blocking call to the provider. actual_tokens, if given, maps the
+        result of fn to the tokens really used so the token budget can be corrected.
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self._run(company_name, model_name, fn, estimated_tokens, actual_tokens), self.loop
+        )
+
+    async def _run(self, company_name: str, model_name: str, fn: Callable[[], Any], estimated_tokens: int,
+                   actual_tokens: Optional[Callable[[Any], int]]) -> Any:
+        lane = self._get_lane(company_name, model_name)
+        for attempt in range(self.max_retries + 1):
+            await lane.acquire(estimated_tokens)
+            start_time = time.monotonic()
+            try:
+                result = await self.loop.run_in_executor(self.executor, fn)
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == self.max_retries:
+                    raise
+                lane.on_rate_limited()
+                await asyncio.sleep(min(60, 2 ** attempt + random.random()))
+                continue
+            finally:
+                await lane.release()
+            lane.on_success(time.monotonic() - start_time)
+            if actual_tokens:
+                lane.tokens.adjust(actual_tokens(result) - estimated_tokens)
+            return result
@@ -0,0 +1,55 @@
+import re
+from typing import Any, Collection, Dict, Type
+from langchain.pydantic_v1 import BaseModel
+
+# Descriptions that list the allowed values in prose are turned into a JSON schema enum
+ALLOWED_VALUES_PATTERN = re.compile(r"\s*Must be chosen from one of these values:\s*(.+)$", re.DOTALL)
+QUOTED_VALUE_PATTERN = re.compile(r"'([^']*)'")
+
+def _compact_property(schema: Dict[str, Any], definitions: Dict[str, Any], exclude: Collection[str] = ()) -> Dict[str, Any]:
+    if "$ref" in schema:
+        schema = {**definitions[schema["$ref"].split("/")[-1]], **{k: v for k, v in schema.items() if k != "$ref"}}
+    if "allOf" in schema and len(schema["allOf"]) == 1:
+        schema = {**_compact_property(schema["allOf"][0], definitions), **{k: v for k, v in schema.items() if k != "allOf"}}
+
+    compact: Dict[str, Any] = {}
+    if "type" in schema:
+        compact["type"] = schema["type"]
+    description = schema.get("description", "")
+    match = ALLOWED_VALUES_PATTERN.search(description)
+    if match:
+        compact["enum"] = QUOTED_VALUE_PATTERN.findall(match.group(1))
+        description = description[:match.start()]
+    description = description.strip().rstrip(".")
+    # Flag names such as features_has_sunroof already say what their description would
+    if description and schema.get("type") != "boolean":
+        compact["description"] = description
+    if "enum" in schema:
+        compact["enum"] = schema["enum"]
+    if "items" in schema:
+        compact["items"] = _compact_property(schema["items"], definitions, exclude)
+    if "properties" in schema:
+        compact["properties"] = {name: _compact_property(prop, definitions, exclude)
+                                 for name, prop in schema["properties"].items() if name not in exclude}
+        required = [name for name in schema.get("required", []) if name not in exclude]
+        if required:
+            compact["required"] = required
+    return compact
+
+def to_tool_schema(model: Type[BaseModel], exclude: Collection[str] = ()) -> Dict[str, Any]:
+    """
+    Build an OpenAI function definition for model, usable with bind_tools by any of
+    the supported providers. Titles, defaults and $refs are dropped, and value lists
+    written in the field descriptions become enums and boolean flags lose their
+    descriptions, which keeps the schema to a fraction of the tokens of
+    PydanticOutputParser's format instructions. Properties named in exclude are left
+    out at any depth, for fields that are already known.
+    """
+    schema = model.schema()
+    parameters = _compact_property(schema, schema.get("definitions", {}), exclude)
+    parameters.pop("description", None)
+    return {
+        "name": model.__name__,
+        "description": (model.__doc__ or "").strip(),
+        "parameters": parameters,
+    }
@@ -0,0 +1,147 @@
+import json
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Collection, Dict, List, Optional, Tuple
+from langchain_core.exceptions import OutputParserException
+from loguru import logger
+from shared.lib.llm_usage import LLMUsage
+from shared.lib.llm_tokens import get_context_window
+from lib.run_budget import RunBudget
+
+DEFAULT_ACCURACY_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'shared', 'data', 'evaluations', 'model_accuracy.json')
+# Sections this short, or with these titles, are simple enough for the cheapest model
+SIMPLE_SECTION_MAX_TOKENS = 400
+SIMPLE_SECTION_TITLES = {"PRECIO", "A FAVOR", "EN CONTRA", "COMPETIDORES"}
+# Evaluation accuracy (%) a model needs before launch extraction is routed to it
+MIN_EXTRACTION_ACCURACY = 85.0
+
+@dataclass(frozen=True)
+class Route:
+    company: str
+    model: str
+
+    @property
+    def name(self) -> str:
+        return f"{self.company}/{self.model}"
+
+# From cheapest to strongest; escalation moves one step up
+DEFAULT_ROUTES = [
+    Route("openai", "gpt-4o-mini"),
+    Route("openai", "gpt-3.5-turbo"),
+    Route("openai", "gpt-4o"),
+]
+DEFAULT_ROUTE = Route("openai", "gpt-3.5-turbo")
+
+class ModelRouter:
+    """
+    Picks the model for each LLM task from the size of its input, the kind of content
+    and the accuracy measured by model_performance_evaluator.py, and escalates to a
+    stronger model when the output does not parse or does not look right. Once the
+    run budget is mostly spent, everything goes to the cheapest model that fits.
+    """
+    def __init__(self, routes: Optional[List[Route]] = None, default_route: Route = DEFAULT_ROUTE,
+                 accuracy_path: Optional[str] = DEFAULT_ACCURACY_PATH, budget: Optional[RunBudget] = None):
+        self.routes = routes or DEFAULT_ROUTES
+        self.default_route = default_route
+        self.accuracy = self._load_accuracy(accuracy_path)
+        self.budget = budget
+        # (task, route name) -> latency and cost of every attempt, and the number of escalations from it
+        self.stats: Dict[Tuple[str, str], List[Tuple[float, float]]] = {}
+        self.escalations: Dict[Tuple[str, str], int] = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def fixed(cls, company_name: str, model_name: str) -> 'ModelRouter':
+        """Router that always uses the given model and never escalates."""
+        route = Route(company_name, model_name)
+        return cls(routes=[route], default_route=route, accuracy_path=None)
+
+    @staticmethod
+    def _load_accuracy(path: Optional[str]) -> Dict[str, Dict[str, float]]:
+        if not path or not os.path.exists(path):
+            return {}
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def _fits(self, route: Route, tokens: int) -> bool:
+        return get_context_window(route.model) >= tokens
+
+    def select(self, task: str, input_tokens: int, output_tokens: int = 0, section_titles: Collection[str] = ()) -> Route:
+        tokens = input_tokens + output_tokens
+        candidates = [route for route in self.routes if self._fits(route, tokens)]
+        if not candidates:
+            # Nothing fits: the largest context window, the caller splits the input anyway
+            return max(self.routes, key=lambda route: get_context_window(route.model))
+        if self.budget and self.budget.is_downgraded():
+            return candidates[0]
+        default = self.default_route if self.default_route in candidates else candidates[0]
+
+        if task == "section":
+            simple_titles = bool(section_titles) and all(title in SIMPLE_SECTION_TITLES for title in section_titles)
+            if input_tokens <= SIMPLE_SECTION_MAX_TOKENS or simple_titles:
+                return candidates[0]
+        elif task == "launch":
+            accuracy = self.accuracy.get(task, {})
+            accurate = [route for route in candidates if accuracy.get(route.name, 0) >= MIN_EXTRACTION_ACCURACY]
+            if accurate:
+                return accurate[0]
+        return default
+
+    def escalate(self, route: Route, tokens: int = 0) -> Optional[Route]:
+        if self.budget and self.budget.is_downgraded():
+            return None
+        index = self.routes.index(route) if route in self.routes else len(self.routes)
+        return next((stronger for stronger in self.routes[index + 1:] if self._fits(stronger, tokens)), None)
+
+    def run(self, task: str, action: str, input_tokens: int, call: Callable[[Route, LLMUsage], Any], usage: LLMUsage,
+            is_confident: Optional[Callable[[Any], bool]] = None, output_tokens: int = 0, section_titles: Collection[str] = ()) -> Any:
+        """
+        Run call on the selected route, retrying on stronger routes while its output fails
+        to parse or is_confident rejects it. Each attempt is recorded as a child of usage.
+        When no stronger route is left, the last parse error is raised or the last output returned.
+        """
+        route = self.select(task, input_tokens, output_tokens, section_titles)
+        while True:
+            attempt = LLMUsage(action=action, model_name=route.model)
+            start_time = time.time()
+            error = None
+            try:
+                output = call(route, attempt)
+                confident = is_confident is None or is_confident(output)
+            except (OutputParserException, ValueError) as e:
+                output, confident, error = None, False, e
+            if not attempt.usage:
+                attempt.time = time.time() - start_time
+            usage.add_usage(attempt)
+            self._record(task, route, time.time() - start_time, attempt.summarize()[2])
+            if confident:
+                return output
+
+            stronger = self.escalate(route, input_tokens + output_tokens)
+            if not stronger:
+                if error:
+                    raise error
+                return output
+            logger.info(f"Escalating {action} from {route.name} to {stronger.name}: {error or 'low confidence output'}")
+            with self.lock:
+                self.escalations[(task, route.name)] = self.escalations.get((task, route.name), 0) + 1
+            route = stronger
+
+    def _record(self, task: str, route: Route, latency: float, cost: float) -> None:
+        with self.lock:
+            self.stats.setdefault((task, route.name), []).append((latency, cost))
+
+    def get_summary(self) -> str:
+        lines = []
+        with self.lock:
+            for (task, route_name), attempts in sorted(self.stats.items()):
+                latencies = sorted(latency for latency, _ in attempts)
+                p95 = latencies[max(0, math.ceil(0.95 * len(latencies)) - 1)]
+                cost = sum(cost for _, cost in attempts)
+                escalations = self.escalations.get((task, route_name), 0)
+                lines.append(f"Route {task} -> {route_name}: {len(attempts)} calls, {escalations} escalated, "
+                             f"Cost: ${cost:.3f}, p95 latency: {p95:.2f}s")
+        return "\n".join(lines)
@@ -0,0 +1,152 @@
+import hashlib
+import re
+import threading
+import unicodedata
+from datetime import datetime, timedelta
+from typing import Any, Dict, Hashable, List, Optional, Set, Tuple
+import numpy as np
+
+# Universal hashing of 32 bit shingle hashes, as in the usual MinHash implementations
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+WORD_PATTERN = re.compile(r"\w+")
+# Texts with fewer words than this are never treated as duplicates: short sections and
+# chunks (a price line, a list of pros) differ in the few words that matter
+MIN_DUPLICATE_WORDS = 50
+# Items processed up to this long before the last one loaded are read again on the next load, as
+# transactions still open then may commit items with an earlier date_processed
+RELOAD_OVERLAP = timedelta(minutes=10)
+
+def _normalize(text: str) -> List[str]:
+    text = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode("ascii")
+    return WORD_PATTERN.findall(text.lower())
+
+def get_shingles(text: str, size: int = 5) -> Set[str]:
+    """Overlapping sequences of size words of the normalized text."""
+    words = _normalize(text)
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def get_new_paragraphs(text: str, original: str) -> str:
+    """Paragraphs of text that do not appear in original, ignoring case, accents and punctuation."""
+    original_paragraphs = {" ".join(_normalize(paragraph)) for paragraph in original.split("\n")}
+    return "\n".join(paragraph for paragraph in text.split("\n")
+                     if paragraph.strip() and " ".join(_normalize(paragraph)) not in original_paragraphs)
+
+class MinHasher:
+    def __init__(self, num_perm: int = 128, shingle_size: int = 5, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        generator = np.random.RandomState(seed)
+        self.a = generator.randint(1, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+        self.b = generator.randint(0, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        shingles = get_shingles(text, self.shingle_size)
+        if not shingles:
+            return None
+        hashes = np.array([int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "little")
+                           for shingle in shingles], dtype=np.uint64)
+        permuted = np.bitwise_and((np.outer(hashes, self.a) + self.b) % MERSENNE_PRIME, MAX_HASH)
+        return permuted.min(axis=0)
+
+def get_similarity(signature: np.ndarray, other: np.ndarray) -> float:
+    """Estimated Jaccard similarity of the shingles behind two signatures."""
+    return float(np.mean(signature == other))
+
+def get_lsh_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """
+    Number of bands and rows per band for LSH. Two texts share a bucket with high
+    probability above (1 / bands) ** (1 / rows); the largest such value not above
+    threshold is chosen, so candidates are found generously and checked afterwards.
+    """
+    options = [(bands, num_perm // bands) for bands in range(1, num_perm + 1) if num_perm % bands == 0]
+    below = [option for option in options if (1 / option[0]) ** (1 / option[1]) <= threshold]
+    return max(below, key=lambda option: (1 / option[0]) ** (1 / option[1])) if below else options[-1]
+
+class NearDuplicateIndex:
+    """
+    MinHash/LSH index of texts, to find earlier items whose content is nearly the
+    same (estimated Jaccard similarity of their word shingles at least threshold)
+    without comparing every pair. Safe to share between threads.
+    """
+    def __init__(self, threshold: float = 0.8, num_perm: int = 128, shingle_size: int = 5, min_words: int = MIN_DUPLICATE_WORDS):
+        self.threshold = threshold
+        self.min_words = min_words
+        self.hasher = MinHasher(num_perm, shingle_size)
+        self.bands, self.rows = get_lsh_bands(threshold, num_perm)
+        self.buckets: List[Dict[bytes, List[Hashable]]] = [{} for _ in range(self.bands)]
+        self.signatures: Dict[Hashable, np.ndarray] = {}
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def _get_signature(self, text: str) -> Optional[np.ndarray]:
+        if len(WORD_PATTERN.findall(text or "")) < self.min_words:
+            return None
+        return self.hasher.signature(text)
+
+    def _get_band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def add(self, key: Hashable, text: str) -> bool:
+        if key in self.signatures:
+            return True
+        signature = self._get_signature(text)
+        if signature is None:
+            return False
+        with self.lock:
+            self.signatures[key] = signature
+            for bucket, band_key in zip(self.buckets, self._get_band_keys(signature)):
+                bucket.setdefault(band_key, []).append(key)
+        return True
+
+    def find(self, text: str, exclude: Optional[Hashable] = None) -> Optional[Tuple[Hashable, float]]:
+        """Most similar indexed item at or above the threshold, as (key, similarity)."""
+        signature = self._get_signature(text)
+        if signature is None:
+            return None
+        with self.lock:
+            candidates = {key for bucket, band_key in zip(self.buckets, self._get_band_keys(signature))
+                          for key in bucket.get(band_key, ()) if key != exclude}
+            scored = [(key, get_similarity(signature, self.signatures[key])) for key in candidates]
+        scored = [match for match in scored if match[1] >= self.threshold]
+        return max(scored, key=lambda match: match[1]) if scored else None
+
+class ProcessedIndex:
+    """
+    NearDuplicateIndex of the items a processor has already processed, with what it
+    reuses of each (e.g. its analysis). It outlives the processors, which workers create
+    for every batch of jobs: each load only reads the items processed since the previous
+    one (see get_load_start), and the items processed meanwhile are added as they are.
+    """
+    def __init__(self, threshold: float):
+        self.index = NearDuplicateIndex(threshold)
+        self.payloads: Dict[Hashable, Any] = {}
+        # Latest date_processed of the items loaded
+        self.loaded_until: Optional[datetime] = None
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def get_load_start(self) -> Optional[datetime]:
+        """date_processed from which to load the processed items, None to load them all."""
+        return self.loaded_until - RELOAD_OVERLAP if self.loaded_until else None
+
+    def load(self, key: Hashable, text: str, date_processed: datetime, payload: Any = None) -> bool:
+        if self.loaded_until is None or date_processed > self.loaded_until:
+            self.loaded_until = date_processed
+        return self.add(key, text, payload)
+
+    def add(self, key: Hashable, text: str, payload: Any = None) -> bool:
+        # The payload is there before the item can be found
+        self.payloads[key] = payload
+        if not self.index.add(key, text):
+            del self.payloads[key]
+            return False
+        return True
+
+    def find(self, text: str, exclude: Optional[Hashable] = None) -> Optional[Tuple[Hashable, float]]:
+        return self.index.find(text, exclude)
@@ -1,16 +1,21 @@
 import json
 import os
 import queue
+import threading
 from typing import List, Dict, Any, Optional
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
 from lib.processor_result import ProcessorResult
-from lib.embeddings import AutobotEmbedding
+from lib.embeddings import AutobotEmbedding, get_embedding_model
+from lib.near_duplicates import NearDuplicateIndex
 from shared.utils import DBHelper
+from shared.lib.car_names import CarNameRecognizer
 from loguru import logger
 from concurrent.futures import ThreadPoolExecutor
 from pinecone import Pinecone
 
+# Chunks at least this similar to one embedded earlier in the run (boilerplate, reposts) reuse its embedding
+CHUNK_DUPLICATE_THRESHOLD = 0.9
+
 class PineconeUploader:
     def __init__(self, entity: str, company: str = "openai", model_name: str = "text-embedding-3-small", dimensions: int = 1536):
         self.entity = entity
@@ -18,16 +23,26 @@ class PineconeUploader:
         self.model_name = model_name
         self.dimensions = dimensions
         self.db = DBHelper()
-        self.embeddings = OpenAIEmbeddings(model=model_name)
-        self.output_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'shared', 'tmp', 'processed_embeddings')
-        self.uploaded_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'shared', 'tmp', 'uploaded_embeddings')
+        self.embeddings = get_embedding_model(company, model_name, dimensions)
+        # Embeddings of other providers (e.g. fake ones from offline runs) are kept apart from the real ones
+        tmp_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'shared', 'tmp')
+        if company != "openai":
+            tmp_dir = os.path.join(tmp_dir, company)
+        self.output_dir = os.path.join(tmp_dir, 'processed_embeddings')
+        self.uploaded_dir = os.path.join(tmp_dir, 'uploaded_embeddings')
         os.makedirs(self.output_dir, exist_ok=True)
         os.makedirs(self.uploaded_dir, exist_ok=True)
         self.results = None
         self.work_queue = queue.Queue()
+        self.chunk_index = NearDuplicateIndex(CHUNK_DUPLICATE_THRESHOLD)
+        self.chunk_embeddings: List[List[float]] = []
+        self.reused_embeddings = 0
+        self.recognizer: Optional[CarNameRecognizer] = None
+        self.lock = threading.Lock()
 
     def prepare(self, limit: Optional[int] = None, num_threads: int = 20) -> ProcessorResult:
         self.results = ProcessorResult(action="upload-prepare", entity=self.entity)
+        self.recognizer = CarNameRecognizer.from_db(self.db)
         items = self._get_items(limit)
         
         for item in items:
@@ -37,6 +52,8 @@ class PineconeUploader:
             for _ in range(num_threads):
                 executor.submit(self._worker)
 
+        if self.reused_embeddings:
+            logger.info(f"Reused the embeddings of near duplicate chunks for {self.reused_embeddings} chunks")
         logger.info(f"Prepare complete. {self.results.items_processed} {self.entity} processed.")
         return self.results
 
@@ -63,8 +80,33 @@ class PineconeUploader:
         )
         return text_splitter.split_text(text)
 
+    def _get_car_metadata(self, title: str) -> Dict[str, str]:
+        """Make and model mentioned in a title, so that the chatbot can filter by them."""
+        match = self.recognizer.find(title) if self.recognizer else None
+        if not match:
+            return {}
+        return {key: value for key, value in (("make", match.make), ("model", match.model)) if value}
+
     def _generate_embeddings(self, chunks: List[str]) -> List[List[float]]:
-        return self.embeddings.embed_documents(chunks)
+        embeddings: List[Optional[List[float]]] = [None] * len(chunks)
+        new_chunks = []
+        for i, chunk in enumerate(chunks):
+            match = self.chunk_index.find(chunk)
+            if match is None:
+                new_chunks.append(i)
+                continue
+            with self.lock:
+                embeddings[i] = self.chunk_embeddings[match[0]]
+                self.reused_embeddings += 1
+
+        if new_chunks:
+            for i, embedding in zip(new_chunks, self.embeddings.embed_documents([chunks[i] for i in new_chunks])):
+                embeddings[i] = embedding
+                with self.lock:
+                    key = len(self.chunk_embeddings)
+                    self.chunk_embeddings.append(embedding)
+                self.chunk_index.add(key, chunks[i])
+        return embeddings
 
     def upload(self, index_name: str = "") -> ProcessorResult:
         result = ProcessorResult(action="upload", entity=self.entity)
@@ -0,0 +1,79 @@
+import threading
+import time
+from typing import Optional
+from loguru import logger
+from shared.lib.llm_usage import LLMUsage
+
+class BudgetExceeded(Exception):
+    """Raised for provider calls attempted once the run budget is spent."""
+    pass
+
+class RunBudget:
+    """
+    Limits on the LLM spend of a run, in dollars, tokens and wall clock seconds.
+    Once downgrade_at of any limit is used, the model router sticks to the cheapest
+    model that fits and stops escalating. Once a limit is reached, LLMGateway refuses
+    further provider calls and the items left are kept pending for the next run.
+    """
+    def __init__(self, max_cost: Optional[float] = None, max_tokens: Optional[int] = None, max_seconds: Optional[float] = None,
+                 downgrade_at: float = 0.8):
+        self.max_cost = max_cost
+        self.max_tokens = max_tokens
+        self.max_seconds = max_seconds
+        self.downgrade_at = downgrade_at
+        self.start_time = time.time()
+        self.cost = 0.0
+        self.tokens = 0
+        self.downgraded = False
+        self.exhausted = False
+        self.lock = threading.Lock()
+
+    def record(self, usage: LLMUsage) -> None:
+        token_input, token_output, cost, _, _ = usage.summarize()
+        with self.lock:
+            self.cost += cost
+            self.tokens += token_input + token_output
+        self._update()
+
+    def check(self) -> None:
+        if self.is_exhausted():
+            raise BudgetExceeded(f"Run budget exhausted ({self.get_summary()})")
+
+    def is_downgraded(self) -> bool:
+        self._update()
+        return self.downgraded
+
+    def is_exhausted(self) -> bool:
+        self._update()
+        return self.exhausted
+
+    def _get_used_fraction(self) -> float:
+        fractions = [0.0]
+        if self.max_cost:
+            fractions.append(self.cost / self.max_cost)
+        if self.max_tokens:
+            fractions.append(self.tokens / self.max_tokens)
+        if self.max_seconds:
+            fractions.append((time.time() - self.start_time) / self.max_seconds)
+        return max(fractions)
+
+    def _update(self) -> None:
+        with self.lock:
+            used = self._get_used_fraction()
+            if used >= self.downgrade_at and not self.downgraded:
+                self.downgraded = True
+                logger.warning(f"{used:.0%} of the run budget used, routing to the cheapest models ({self._format()})")
+            if used >= 1 and not self.exhausted:
+                self.exhausted = True
+                logger.warning(f"Run budget exhausted, no further LLM calls; pending items are left for the next run ({self._format()})")
+
+    def get_summary(self) -> str:
+        with self.lock:
+            return self._format()
+
+    def _format(self) -> str:
+        # Called with self.lock held
+        limits = [f"${self.cost:.3f}" + (f" of ${self.max_cost:.2f}" if self.max_cost else ""),
+                  f"{self.tokens} tokens" + (f" of {self.max_tokens}" if self.max_tokens else ""),
+                  f"{time.time() - self.start_time:.0f}s" + (f" of {self.max_seconds:.0f}s" if self.max_seconds else "")]
+        return ", ".join(limits)
@@ -0,0 +1,143 @@
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+
+# Numeric car fields and their weights. "price" is the current price, or the launch price.
+NUMERIC_FEATURES: Dict[str, float] = {
+    "price": 4.0, "power": 2.0, "torque": 1.0, "length": 1.5, "width": 1.0, "height": 1.0, "wheelbase": 1.0,
+    "trunk_capacity": 0.5, "ground_clearance": 0.5, "weight": 1.0, "num_cylinders": 0.5, "battery_capacity": 1.0,
+    "range_kms": 0.5, "acceleration_0_100": 0.5, "max_speed": 0.5, "fuel_consumption": 0.5, "safety_num_airbags": 0.5,
+    "safety_ncap_rating": 0.5, "comfort_multimedia_system_screen_size": 0.25, "warranty_years": 0.25,
+}
+# Fields that grow by orders of magnitude, compared on a log scale
+LOG_FEATURES = {"price", "power", "torque", "battery_capacity", "range_kms", "trunk_capacity", "weight"}
+# Categorical fields, compared as equal or not
+CATEGORICAL_FEATURES: Dict[str, float] = {"body_type": 4.0, "engine_type": 2.0, "transmission_type": 1.0, "traction": 0.5}
+# Equipment flags, each with BOOLEAN_WEIGHT
+BOOLEAN_FEATURES = [
+    "comfort_has_leather_seats", "comfort_has_auto_climate_control", "comfort_has_interior_ambient_lighting",
+    "comfort_has_multimedia_system", "comfort_has_apple_carplay", "safety_has_abs_brakes", "safety_has_lane_keeping_assist",
+    "safety_has_forward_collision_warning", "safety_has_auto_emergency_brake", "safety_has_auto_high_beams",
+    "safety_has_auto_drowsiness_detection", "safety_has_blind_spot_monitor", "features_has_front_camera",
+    "features_has_rear_camera", "features_has_360_camera", "features_has_front_parking_sensors",
+    "features_has_rear_parking_sensors", "features_has_parking_assist", "features_has_digital_instrument_cluster",
+    "features_has_cruise_control", "features_has_adaptive_cruise_control", "features_has_tpms",
+    "features_has_led_headlights", "features_has_engine_ignition_button", "features_has_keyless_entry", "features_has_sunroof",
+]
+BOOLEAN_WEIGHT = 0.1
+# Cars are only compared with cars of the same body type, if known
+SEGMENT_FEATURE = "body_type"
+# Two cars are only compared when the features known for both weigh at least this much (the price and body type, say)
+MIN_SHARED_WEIGHT = 8.0
+
+@dataclass
+class SpecMatrix:
+    """
+    Standardized features of a list of cars, one row per car. Missing values are 0 in
+    values and have weight 0 in weights, so they do not count in the distances. coverage
+    is the weight of each known feature spread over its columns (the categories of a
+    categorical feature), so that it adds up to the weight of the features known.
+    """
+    values: np.ndarray
+    weights: np.ndarray
+    coverage: np.ndarray
+
+def _numeric_column(cars: List[Dict[str, Any]], feature: str) -> np.ndarray:
+    column = np.array([np.nan if car.get(feature) is None else float(car[feature]) for car in cars], dtype=np.float64)
+    if feature in LOG_FEATURES:
+        column[~(column > 0)] = np.nan
+        column = np.log(column)
+    return column
+
+def build_spec_matrix(cars: List[Dict[str, Any]]) -> SpecMatrix:
+    columns, weights, coverage = [], [], []
+    for feature, weight in NUMERIC_FEATURES.items():
+        column = _numeric_column(cars, feature)
+        known = ~np.isnan(column)
+        if known.any():
+            std = np.std(column[known])
+            column = (column - np.mean(column[known])) / (std if std > 0 else 1.0)
+        columns.append(np.where(known, column, 0.0))
+        weights.append(np.where(known, weight, 0.0))
+        coverage.append(weights[-1])
+
+    for feature, weight in CATEGORICAL_FEATURES.items():
+        categories = [str(car[feature]).strip().lower() if car.get(feature) else None for car in cars]
+        known = np.array([category is not None for category in categories])
+        # One column per category: two different categories differ in two columns, so each weighs half
+        values = sorted({category for category in categories if category is not None})
+        for category in values:
+            columns.append(np.array([category == value for value in categories], dtype=np.float64))
+            weights.append(np.where(known, weight / 2, 0.0))
+            coverage.append(np.where(known, weight / len(values), 0.0))
+
+    for feature in BOOLEAN_FEATURES:
+        known = np.array([car.get(feature) is not None for car in cars])
+        columns.append(np.array([bool(car.get(feature)) for car in cars], dtype=np.float64))
+        weights.append(np.where(known, BOOLEAN_WEIGHT, 0.0))
+        coverage.append(weights[-1])
+
+    return SpecMatrix(values=np.column_stack(columns).astype(np.float32), weights=np.column_stack(weights).astype(np.float32),
+                      coverage=np.column_stack(coverage).astype(np.float32))
+
+def get_segments(cars: List[Dict[str, Any]]) -> np.ndarray:
+    """Code of the body type of each car, -1 if unknown."""
+    body_types = [str(car[SEGMENT_FEATURE]).strip().lower() if car.get(SEGMENT_FEATURE) else None for car in cars]
+    codes = {body_type: code for code, body_type in enumerate(sorted({body_type for body_type in body_types if body_type}))}
+    return np.array([codes.get(body_type, -1) for body_type in body_types], dtype=np.int64)
+
+def nearest_neighbours(matrix: SpecMatrix, k: int, groups: Optional[np.ndarray] = None, segments: Optional[np.ndarray] = None,
+                       min_shared_weight: float = MIN_SHARED_WEIGHT, block_size: int = 128) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The k nearest cars of each car, as (indices, distances) arrays of shape (n, k), nearest first.
+    The distance is the root of the weighted mean squared difference of the features known for
+    both cars. Cars of the same group (e.g. the same car model) are not neighbours, and neither
+    are cars sharing less than min_shared_weight. With segments, cars are only compared with
+    the cars of their segment and those with an unknown one (-1), which may be compared with all.
+    Missing neighbours have index -1 and an infinite distance.
+    """
+    n = len(matrix.values)
+    indices = np.full((n, k), -1, dtype=np.int64)
+    distances = np.full((n, k), np.inf, dtype=np.float32)
+    groups = np.arange(n) if groups is None else groups
+    if segments is None:
+        partitions = [(np.arange(n), np.arange(n))]
+    else:
+        unknown = segments == -1
+        partitions = [(np.flatnonzero(segments == segment), np.flatnonzero((segments == segment) | unknown))
+                      for segment in np.unique(segments[~unknown])]
+        partitions.append((np.flatnonzero(unknown), np.arange(n)))
+    for rows, candidates in partitions:
+        # sum(w (x - y)^2) over the features known for both cars = (w x^2).m_y + w.y^2 - 2 (w x).y, where m_y is 1 if
+        # y is known, with missing values as 0: all pairs of a block of rows are computed with two matrix products
+        candidate_values = matrix.values[candidates]
+        candidate_present = (matrix.weights[candidates] > 0).astype(np.float32)
+        candidate_terms = np.hstack([candidate_present, candidate_values ** 2, candidate_values]).T.copy()
+        for start in range(0, len(rows), block_size):
+            block_rows = rows[start:start + block_size]
+            block_indices, block_distances = _nearest(matrix, block_rows, candidates, candidate_present, candidate_terms,
+                                                      k, groups, min_shared_weight)
+            indices[block_rows, :block_indices.shape[1]] = block_indices
+            distances[block_rows, :block_distances.shape[1]] = block_distances
+    return indices, distances
+
+def _nearest(matrix: SpecMatrix, rows: np.ndarray, candidates: np.ndarray, candidate_present: np.ndarray,
+             candidate_terms: np.ndarray, k: int, groups: np.ndarray, min_shared_weight: float) -> Tuple[np.ndarray, np.ndarray]:
+    k = min(k, len(candidates))
+    if k == 0 or len(rows) == 0:
+        return np.empty((len(rows), 0), dtype=np.int64), np.empty((len(rows), 0), dtype=np.float32)
+    weights, values = matrix.weights[rows], matrix.values[rows]
+    shared = matrix.coverage[rows] @ candidate_present.T
+    block = np.hstack([weights * values ** 2, weights, -2 * weights * values]) @ candidate_terms
+    # In place and without NaNs, as this runs over all pairs; the root is only taken of the nearest
+    np.maximum(block, 0, out=block)
+    block /= np.maximum(shared, min_shared_weight)
+    block[shared < min_shared_weight] = np.inf
+    block[groups[rows][:, None] == groups[candidates][None, :]] = np.inf
+
+    nearest = np.argpartition(block, k - 1, axis=1)[:, :k]
+    nearest_distances = np.take_along_axis(block, nearest, axis=1)
+    order = np.argsort(nearest_distances, axis=1, kind="stable")
+    nearest = np.take_along_axis(nearest, order, axis=1)
+    nearest_distances = np.sqrt(np.take_along_axis(nearest_distances, order, axis=1))
+    return np.where(np.isinf(nearest_distances), -1, candidates[nearest]), nearest_distances
@@ -0,0 +1,115 @@
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+# Number as written in the posts: "4.420" (thousands), "1,5" or "1.5" (decimals)
+NUMBER = r"(\d{1,3}(?:\.\d{3})+|\d+(?:[.,]\d+)?)"
+# What may separate the values of a spec that lists one per variant, e.g. "150 hp (1.5T) / 190 hp (2.0T)"
+VALUE_SEPARATOR = r"\s*(?:\([^)]*\))?\s*(?:/|,|;|\by\b|\bo\b|-)\s*"
+
+# Car field -> (label, unit, type). Labels and units are regexes matched case-insensitively.
+SPEC_PATTERNS: Dict[str, Tuple[str, str, type]] = {
+    "power": (r"potencia(?: m[aá]xima)?", r"(?:hp|cv|bhp)\b", int),
+    "torque": (r"(?:torque|par)(?: motor)?(?: m[aá]ximo)?", r"nm\b", int),
+    "length": (r"largo", r"mm\b", int),
+    "width": (r"ancho", r"mm\b", int),
+    "height": (r"alto", r"mm\b", int),
+    "wheelbase": (r"distancia entre ejes", r"mm\b", int),
+    "ground_clearance": (r"despeje(?: del suelo| al suelo)?", r"mm\b", int),
+    "trunk_capacity": (r"(?:capacidad (?:de|del) )?(?:ba[uú]l|maletero)", r"(?:litros|lts?)\b", int),
+    "fuel_capacity": (r"(?:tanque|dep[oó]sito)(?: de combustible)?", r"(?:litros|lts?)\b", int),
+    "weight": (r"peso(?: en orden de marcha)?", r"kg\b", int),
+    "max_speed": (r"velocidad m[aá]xima", r"km/h", int),
+    "acceleration_0_100": (r"(?:aceleraci[oó]n )?0[ -]?(?:a|-)[ -]?100(?: km/h)?", r"(?:s|seg|segundos)\b", float),
+    "fuel_consumption": (r"consumo(?: mixto| promedio| combinado)?", r"(?:l|litros)/100(?: ?km)?", float),
+    "battery_capacity": (r"bater[ií]a", r"kwh\b", float),
+    "range_kms": (r"autonom[ií]a", r"km\b", int),
+}
+# Values written without a label, e.g. "4 cilindros" or "6 airbags"
+COUNT_PATTERNS: Dict[str, str] = {
+    "num_cylinders": r"cilindros",
+    "num_valves": r"v[aá]lvulas",
+    "num_gears": r"(?:velocidades|marchas)",
+    "safety_num_airbags": r"(?:airbags|bolsas de aire)",
+}
+WARRANTY_PATTERN = re.compile(r"garant[ií]a:?\s*(\d+)\s*a[nñ]os(?:\s*(?:o|/|y)\s*" + NUMBER + r"\s*km)?", re.IGNORECASE)
+PRICE_PATTERN = re.compile(r"(?:US\$|U\$S|USD)\s*" + NUMBER, re.IGNORECASE)
+SPEC_SHEET_TITLE = re.compile(r"FICHA T[EÉ]CNICA:?", re.IGNORECASE)
+
+def parse_number(text: str, value_type: type = float) -> Any:
+    if re.fullmatch(r"\d{1,3}(?:\.\d{3})+", text):
+        value = float(text.replace(".", ""))
+    else:
+        value = float(text.replace(",", "."))
+    return round(value) if value_type is int else value
+
+@dataclass
+class SpecSheet:
+    """Car attributes read deterministically from a launch, shared by all its variants."""
+    values: Dict[str, Any] = field(default_factory=dict)
+    # Fields with conflicting values in the text, left to the LLM
+    ambiguous: List[str] = field(default_factory=list)
+    prices: List[int] = field(default_factory=list)
+    # Launch content without the spec sheet entries already extracted
+    remaining_content: str = ""
+
+def _find_value(text: str, label: str, unit: str, value_type: type) -> Tuple[Optional[Any], Optional[Tuple[int, int]], bool]:
+    """Return the value after label, its span and whether the text is ambiguous about it."""
+    value_pattern = NUMBER + r"\s*" + unit
+    matches = list(re.finditer(r"\b" + label + r"\s*:?\s*" + value_pattern, text, re.IGNORECASE))
+    if not matches:
+        return None, None, False
+    values = set()
+    for match in matches:
+        values.add(parse_number(match.group(1), value_type))
+        # Another value with the same unit listed right after this one means one value per variant
+        if re.match(VALUE_SEPARATOR + value_pattern, text[match.end():], re.IGNORECASE):
+            return None, None, True
+    if len(values) > 1:
+        return None, None, True
+    return values.pop(), matches[0].span(), False
+
+def extract_spec_sheet(content: str) -> SpecSheet:
+    """
+    Read the labelled numeric attributes of a launch from its "FICHA TÉCNICA" (or the
+    whole text when there is none), and counts, warranty and US$ prices from the whole text. Only values stated once, or always the same,
+    are kept; the spans they were read from are removed from remaining_content.
+    """
+    sheet = SpecSheet(remaining_content=content)
+    title = SPEC_SHEET_TITLE.search(content)
+    start = title.end() if title else 0
+    text = content[start:]
+    spans = []
+
+    for field_name, (label, unit, value_type) in SPEC_PATTERNS.items():
+        value, span, ambiguous = _find_value(text, label, unit, value_type)
+        if ambiguous:
+            sheet.ambiguous.append(field_name)
+        elif value is not None:
+            sheet.values[field_name] = value
+            spans.append(span)
+
+    for field_name, noun in COUNT_PATTERNS.items():
+        counts = {int(match.group(1)) for match in re.finditer(r"\b(\d{1,2})\s*" + noun + r"\b", content, re.IGNORECASE)}
+        if len(counts) == 1:
+            sheet.values[field_name] = counts.pop()
+        elif counts:
+            sheet.ambiguous.append(field_name)
+
+    warranties = {(match.group(1), match.group(2)) for match in WARRANTY_PATTERN.finditer(content)}
+    if len(warranties) == 1:
+        years, kms = warranties.pop()
+        sheet.values["warranty_years"] = int(years)
+        if kms:
+            sheet.values["warranty_kms"] = parse_number(kms, int)
+
+    # Prices can appear anywhere in the post; a single distinct price belongs to every variant
+    sheet.prices = sorted({parse_number(match.group(1), int) for match in PRICE_PATTERN.finditer(content)})
+    if len(sheet.prices) == 1:
+        sheet.values["launch_price"] = sheet.prices[0]
+
+    if title and spans:
+        for span_start, span_end in sorted(spans, reverse=True):
+            text = text[:span_start] + text[span_end:]
+        sheet.remaining_content = content[:start] + " " + " ".join(text.split())
+    return sheet
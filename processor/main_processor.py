@@ -36,12 +36,17 @@ def initialize_db():
                         car_sales,
                         car_models,
                         car_prices,
-                        sales_reports
+                        sales_reports,
+                        jobs,
+                        llm_batches,
+                        connect_state
                         RESTART IDENTITY""")
     db.execute_query("UPDATE posts SET date_parsed = NULL")
     logger.info("Database tables cleared.")
 
 def main():
+    from processor import add_processor_arguments, create_processor
+
     parser = argparse.ArgumentParser(description="Data processor for posts scraped from https://www.autoblog.com.uy")
     parser.add_argument(
         "-o", "--options",
@@ -74,6 +79,18 @@ def main():
         default=0,
         help="Number of items to process (0 for all available)"
     )
+    add_processor_arguments(parser)
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Estimate the tokens, cost and wall time of processing the pending launches and articles, without calling any model"
+    )
+    parser.add_argument(
+        "--batch",
+        choices=["submit", "collect", "wait"],
+        default=None,
+        help="Process launches and articles through the OpenAI Batch API at half price: submit the pending items, collect the finished batches, or wait for all open batches and collect them"
+    )
     parser.add_argument(
         "-s", "--special",
         required=False,
@@ -98,12 +115,15 @@ def main():
             logger.info("Database initialization canceled by the user.")
         return
 
-    from processor import Processor
     from lib.processor_result import ProcessorResult
     
-    processor = Processor()
+    processor = create_processor(args)
     if (args.special is not None):
         result = processor.special(args.special)
+    elif args.dry_run:
+        result = processor.estimate(entities=args.options, num_items=args.num_items)
+    elif args.batch is not None:
+        result = processor.run_batches(args.batch, entities=args.options, num_items=args.num_items)
     else:
         result = processor.process(actions=args.actions, entities=args.options, num_items=args.num_items)
 
@@ -0,0 +1,119 @@
+import argparse
+from loguru import logger
+from datetime import datetime
+import sys
+import os
+
+# Add the shared directory to sys.path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+shared_dir = os.path.join(parent_dir, "shared")
+sys.path.append(parent_dir)
+
+
+def initiate_logs(log_level = "INFO"):
+    # Configure loguru
+    current_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    log_file_name = f"{shared_dir}/logs/{current_time}_worker_{os.getpid()}.log"
+    logger.remove()  # Remove default handler
+    logger.add(sys.stderr, level=log_level)
+    logger.add(log_file_name, rotation="10 MB", level=log_level)
+
+def main():
+    from processor import STAGE_PENDING_QUERIES, add_processor_arguments, create_processor
+
+    parser = argparse.ArgumentParser(description="Queue worker for the autobot data processing pipeline")
+    parser.add_argument(
+        "-s", "--stages",
+        nargs="+",
+        choices=list(STAGE_PENDING_QUERIES),
+        default=list(STAGE_PENDING_QUERIES),
+        help="Specify which pipeline stages this worker runs"
+    )
+    parser.add_argument(
+        "--enqueue",
+        action="store_true",
+        help="Create jobs for all pending work of the selected stages, including the whole-data stages (sales, prices, connect, embed), before working"
+    )
+    parser.add_argument(
+        "--enqueue-only",
+        action="store_true",
+        help="Create the jobs and exit without running them"
+    )
+    parser.add_argument(
+        "--retry-dead",
+        action="store_true",
+        help="Move the dead jobs of the selected stages back to pending"
+    )
+    parser.add_argument(
+        "--status",
+        action="store_true",
+        help="Print the number of jobs per stage and status and exit"
+    )
+    parser.add_argument(
+        "-f", "--follow",
+        action="store_true",
+        help="Keep polling for new jobs instead of exiting when the queue is empty"
+    )
+    parser.add_argument(
+        "-b", "--batch-size",
+        type=int,
+        default=10,
+        help="Number of jobs claimed at once for the stages that work on single launches, articles or posts"
+    )
+    parser.add_argument(
+        "--lease",
+        type=int,
+        default=600,
+        help="Seconds a claimed job stays reserved without a heartbeat before other workers can take it"
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=3,
+        help="Attempts of a job before it is marked as dead"
+    )
+    add_processor_arguments(parser)
+    parser.add_argument(
+        "--log-level",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+        default="INFO",
+        help="Set the logging level"
+    )
+
+    args = parser.parse_args()
+
+    # Configure logging
+    initiate_logs(args.log_level)
+
+    from lib.job_queue import JobQueue
+    from worker import Worker
+
+    queue = JobQueue(lease_seconds=args.lease, max_attempts=args.max_attempts)
+    if args.status:
+        logger.info(f"Jobs:\n{queue.get_summary()}")
+        return
+
+    logger.info(f"Starting worker {queue.worker_id} with stages: {args.stages}")
+    processor = create_processor(args)
+    worker = Worker(processor, queue, args.stages, batch_size=args.batch_size, follow=args.follow)
+
+    if args.retry_dead:
+        for stage in worker.stages:
+            queue.retry_dead(stage)
+    if args.enqueue or args.enqueue_only:
+        worker.enqueue()
+    if args.enqueue_only:
+        return
+
+    result = worker.run()
+    logger.success("Worker finished. {} items processed.", result.items_processed)
+    if processor.router:
+        logger.info(processor.router.get_summary())
+    if processor.budget:
+        logger.info(f"Run budget used: {processor.budget.get_summary()}")
+    logger.info(f"Jobs:\n{queue.get_summary()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -24,6 +24,7 @@ from typing import Dict, Any
 from pathlib import Path
 from loguru import logger
 from processors import LaunchProcessor, Car
+from lib.model_router import DEFAULT_ACCURACY_PATH
 
 class ModelPerformanceTester:
     def __init__(self):
@@ -76,6 +77,17 @@ class ModelPerformanceTester:
         model_scores = {f"{model['company']}_{model['model']}": self._calculate_scores(model) 
                         for model in self.models}
         self._display_scores(model_scores)
+        self._save_accuracy({f"{model['company']}/{model['model']}": model_scores[f"{model['company']}_{model['model']}"]["overall_score"]
+                             for model in self.models})
+
+    def _save_accuracy(self, accuracy: Dict[str, float]):
+        """Save the overall score of each model, used by the model router to pick the launch extraction model."""
+        path = Path(DEFAULT_ACCURACY_PATH)
+        model_accuracy = json.loads(path.read_text()) if path.exists() else {}
+        model_accuracy.setdefault("launch", {}).update(accuracy)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(model_accuracy, indent=2))
+        logger.info(f"Model accuracy saved to {path}")
 
     def _calculate_scores(self, model: Dict[str, str]) -> Dict[str, Any]:
         """Calculate scores for a model's results."""
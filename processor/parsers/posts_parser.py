@@ -4,22 +4,37 @@ from bs4 import BeautifulSoup, Tag
 from datetime import datetime
 from loguru import logger
 import html
-import re
+import unicodedata
 
 VALID_SECTION_TITLES = [
     "EXTERIOR", "INTERIOR", "MOTOR", "SEGURIDAD", "EQUIPAMIENTO", "PRECIO", "FICHA TÉCNICA",
     "MOTORES, BATERÍA Y TRANSMISIÓN", "A FAVOR", "EN CONTRA", "CONCLUSIÓN", "COMPETIDORES"
 ]
 
+def _normalize_section_title(text: str) -> str:
+    # Uppercase, strip accents and a trailing colon, collapse whitespace
+    text = unicodedata.normalize("NFKD", text.upper())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(text.rstrip().rstrip(":").split())
+
+SECTION_TITLE_LOOKUP = {_normalize_section_title(title): title for title in VALID_SECTION_TITLES}
+# Lines with more words than the longest title are never normalized
+MAX_SECTION_TITLE_WORDS = max(len(title.split()) for title in VALID_SECTION_TITLES)
+
 class PostsParser:
-    def parse(self, entities="articles"):
+    def parse(self, entities="articles", post_ids=None):
         db = DBHelper()
         result = ProcessorResult(action="parse", entity=entities)
         
         if entities == "articles":
-            posts = db.execute_query("SELECT * FROM posts WHERE (type = 'contact' or type='trial') AND date_parsed IS NULL")
+            query = "SELECT * FROM posts WHERE (type = 'contact' or type='trial') AND date_parsed IS NULL"
         elif entities == "launches":
-            posts = db.execute_query("SELECT * FROM posts WHERE type = 'launch' AND date_parsed IS NULL")
+            query = "SELECT * FROM posts WHERE type = 'launch' AND date_parsed IS NULL"
+        # Restrict to the posts claimed by a worker
+        if post_ids is not None:
+            posts = db.execute_query(query + " AND id = ANY(%s)", (list(post_ids),))
+        else:
+            posts = db.execute_query(query)
         
         for post in posts:
             self._parse_post(post, entities)
@@ -56,43 +71,37 @@ class PostsParser:
         return True
     
     def _parse_sections(self, soup: BeautifulSoup):
-        for div in soup.find_all('div'):
-            div.insert_before(soup.new_string('\n'))
-        text_content = soup.get_text(separator='\n', strip=True)
-
         sections = []
-        current_section = None
-        
-        # Split the text into lines and process each line
-        lines = text_content.split('\n')
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
+        current_title = None
+        current_words = []
 
-            # Check if the line matches any keyword
-            matching_keyword = next((kw for kw in VALID_SECTION_TITLES if (kw.lower() == line.lower().strip()) or ((kw.lower() +":") == line.lower().strip()) ), None)
+        # Walk the text nodes once; every node (and every line inside one) is a candidate title
+        for text in soup.stripped_strings:
+            for line in text.split('\n'):
+                words = line.split()
+                if not words:
+                    continue
 
-            if matching_keyword:
-                # If we find a new section, save the previous one (if exists) and start a new one
-                if current_section:
-                    sections.append(current_section)
-                # Stop at the "FICHA TÉCNICA" section
-                if matching_keyword == "FICHA TÉCNICA":
-                    current_section = None
-                    break
-                current_section = {"title": matching_keyword, "content": ""}
-            elif current_section:
-                # If we're in a section, append the line to its content
-                current_section["content"] += line + " "
+                matching_title = None
+                if len(words) <= MAX_SECTION_TITLE_WORDS:
+                    matching_title = SECTION_TITLE_LOOKUP.get(_normalize_section_title(" ".join(words)))
 
-        # Add the last section if it exists
-        if current_section:
-            sections.append(current_section)
+                if matching_title:
+                    # If we find a new section, save the previous one (if exists) and start a new one
+                    if current_title:
+                        sections.append({"title": current_title, "content": " ".join(current_words)})
+                    current_title = None
+                    current_words = []
+                    # Stop at the "FICHA TÉCNICA" section
+                    if matching_title == "FICHA TÉCNICA":
+                        return sections
+                    current_title = matching_title
+                elif current_title:
+                    current_words.extend(words)
 
-        # Clean up the content: remove extra whitespace
-        for section in sections:
-            section["content"] = re.sub(r'\s+', ' ', section["content"]).strip()
+        # Add the last section if it exists
+        if current_title:
+            sections.append({"title": current_title, "content": " ".join(current_words)})
 
         return sections
 
@@ -144,6 +153,8 @@ class PostsParser:
         result = ProcessorResult(action="special", entity="reprocess_similar_launches")
         db = DBHelper()
         db.execute_query("TRUNCATE TABLE similar_launches")
+        # The similar cars of every car are looked up again on the next connect run
+        db.execute_query("UPDATE cars SET date_similar_connected = NULL")
         launches = db.execute_query("""
                                     SELECT l.id, p.html_content, l.title
                                     FROM launches l 
@@ -1,8 +1,73 @@
+import argparse
+from typing import List, Optional
 from shared.lib.llm_usage import LLMUsage
 from lib.processor_result import ProcessorResult
 from loguru import logger
+
+# Pipeline stages in execution order, as run by the workers. Stages with a query get a job for
+# every entity it returns (and not yet handled); the rest run over all the data as a single job.
+STAGE_PENDING_QUERIES = {
+    "parse_prices": None,
+    "parse_sales": None,
+    "parse_launches": "SELECT id FROM posts WHERE type = 'launch' AND date_parsed IS NULL",
+    "parse_articles": "SELECT id FROM posts WHERE (type = 'contact' OR type = 'trial') AND date_parsed IS NULL",
+    "process_sales": None,
+    # Entities waiting in an open Batch API batch are left to its ingestion
+    "process_launches": """SELECT id FROM launches WHERE date_processed IS NULL AND NOT EXISTS
+                           (SELECT 1 FROM llm_batches b WHERE b.entity = 'launches' AND b.status = 'submitted' AND launches.id = ANY(b.entity_ids))""",
+    "process_articles": """SELECT id FROM articles WHERE date_processed IS NULL AND NOT EXISTS
+                           (SELECT 1 FROM llm_batches b WHERE b.entity = 'articles' AND b.status = 'submitted' AND articles.id = ANY(b.entity_ids))""",
+    "connect": None,
+    "embed": None,
+}
     
 class Processor:
+    def __init__(self, llm_cache: str = "on", max_workers: int = 16, routing: str = "off", fake_llm: bool = False,
+                 max_cost: Optional[float] = None, max_tokens: Optional[int] = None, max_minutes: Optional[float] = None,
+                 downgrade_at: float = 0.8):
+        self.llm_cache = llm_cache
+        self.max_workers = max_workers
+        self.routing = routing
+        # Serve all chat and embedding models from the offline fake provider
+        self.fake_llm = fake_llm
+        self.budget = None
+        if max_cost or max_tokens or max_minutes:
+            from lib.run_budget import RunBudget
+            self.budget = RunBudget(max_cost=max_cost, max_tokens=max_tokens, max_seconds=max_minutes * 60 if max_minutes else None,
+                                    downgrade_at=downgrade_at)
+        self.gateway = None
+        self.router = None
+        # Near-duplicate indexes of the processed launches and sections, kept across the processors of a worker's batches
+        self.launch_index = None
+        self.section_index = None
+
+    def _get_gateway(self):
+        if self.gateway is None:
+            from lib.llm_cache import LLMCache
+            from lib.llm_gateway import LLMGateway
+            cache = LLMCache(cache_only=self.llm_cache == "only") if self.llm_cache != "off" else None
+            self.gateway = LLMGateway(cache=cache, provider="fake" if self.fake_llm else None, budget=self.budget)
+        return self.gateway
+
+    def _get_launch_index(self):
+        if self.launch_index is None:
+            from lib.near_duplicates import ProcessedIndex
+            from processors.launch_processor import DUPLICATE_THRESHOLD
+            self.launch_index = ProcessedIndex(DUPLICATE_THRESHOLD)
+        return self.launch_index
+
+    def _get_section_index(self):
+        if self.section_index is None:
+            from lib.near_duplicates import ProcessedIndex
+            from processors.articles_processor import LLMConfig
+            self.section_index = ProcessedIndex(LLMConfig.SECTION_DUPLICATE_THRESHOLD)
+        return self.section_index
+
+    def _get_router(self):
+        if self.router is None and self.routing == "on":
+            from lib.model_router import ModelRouter
+            self.router = ModelRouter(budget=self.budget)
+        return self.router
     
     def _parse(self, entities):
         from parsers import PriceParser, PostsParser, SalesParser
@@ -37,18 +102,49 @@ class Processor:
         
         if "launches" in entities:
             from processors import LaunchProcessor
-            processor = LaunchProcessor()
+            processor = LaunchProcessor(max_workers=self.max_workers, gateway=self._get_gateway(), router=self._get_router())
             processor_result = processor.process(num_launches=num_items)
             logger.info(processor_result.llm_usage.print_summary_per_model())
             results.append_result(processor_result)
         
         if "articles" in entities:
             from processors import ArticlesProcessor
-            processor = ArticlesProcessor()
+            processor = ArticlesProcessor(max_workers=self.max_workers, gateway=self._get_gateway(), router=self._get_router())
             processor_result = processor.process(num_articles=num_items)
             logger.info(processor_result.llm_usage.print_summary_per_model_action())
             results.append_result(processor_result)
+
+        if self.gateway and self.gateway.cache:
+            logger.info(self.gateway.cache.get_summary())
+        if self.router:
+            logger.info(self.router.get_summary())
+        if self.budget:
+            logger.info(f"Run budget used: {self.budget.get_summary()}")
         return results
+
+    def is_budget_exhausted(self) -> bool:
+        return bool(self.budget and self.budget.is_exhausted())
+
+    def estimate(self, entities, num_items: int = 0) -> ProcessorResult:
+        """Estimate the tokens, cost and wall time of processing the pending launches and articles, without calling any model."""
+        result = ProcessorResult(action="estimate", entity="", llm_usage=LLMUsage(node_title="Estimate"))
+        if "launches" in entities:
+            from processors import LaunchProcessor
+            processor = LaunchProcessor(gateway=self._get_gateway(), router=self._get_router())
+            result.append_result(processor.estimate(num_launches=num_items))
+        if "articles" in entities:
+            from processors import ArticlesProcessor
+            processor = ArticlesProcessor(gateway=self._get_gateway(), router=self._get_router())
+            result.append_result(processor.estimate(num_articles=num_items))
+
+        token_input, token_output, cost, time, calls = result.llm_usage.summarize()
+        logger.info(result.llm_usage.print_summary_per_model_action())
+        logger.info(f"Estimated for {result.items_processed} launches and articles: {calls} LLM calls, {token_input} input and "
+                    f"{token_output} output tokens, ${cost:.2f}, about {time / self.max_workers / 60:.1f} minutes with {self.max_workers} workers "
+                    f"(cached completions excluded, escalations and retries not included)")
+        if self.budget and self.budget.max_cost and cost > self.budget.max_cost:
+            logger.warning(f"The estimated cost exceeds the run budget of ${self.budget.max_cost:.2f}")
+        return result
         
     
     def _connect(self, entities):
@@ -63,6 +159,12 @@ class Processor:
             from connectors import PricesConnector
             connector = PricesConnector()
             results.append_result(connector.connect())
+
+        if "launches" in entities:
+            # Competitors by specs, once the prices above are up to date
+            from connectors import SimilarCarsConnector
+            connector = SimilarCarsConnector()
+            results.append_result(connector.connect())
             
         if "articles" in entities:
             from connectors import ArticlesConnector
@@ -74,19 +176,25 @@ class Processor:
     def _upload(self, entities, num_items: int = 0):
         results = ProcessorResult(action="upload", entity="")
         
+        uploader_args = {"company": "fake"} if self.fake_llm else {}
         if "articles" in entities:
             from uploaders import ArticleSectionUploader
-            uploader = ArticleSectionUploader()
+            uploader = ArticleSectionUploader(**uploader_args)
             result = uploader.prepare(num_items)
-            result.append_result(uploader.upload())
+            if not self.fake_llm:
+                result.append_result(uploader.upload())
             results.append_result(result)
     
         if "launches" in entities:
             from uploaders import LaunchUploader
-            uploader = LaunchUploader()
+            uploader = LaunchUploader(**uploader_args)
             result = uploader.prepare(num_items)
-            result.append_result(uploader.upload())
+            if not self.fake_llm:
+                result.append_result(uploader.upload())
             results.append_result(result)
+        
+        if self.fake_llm:
+            logger.info("Fake embeddings are not uploaded to Pinecone")
             
         return results
 
@@ -107,9 +215,128 @@ class Processor:
         return result
 
 
+    def run_batches(self, mode: str, entities, num_items: int = 0) -> ProcessorResult:
+        """
+        Process launches and articles through the OpenAI Batch API. "submit" sends the
+        pending items and returns, "collect" ingests the batches finished so far, and
+        "wait" polls until every open batch is finished and ingested.
+        """
+        from processors import LaunchProcessor, ArticlesProcessor
+        result = ProcessorResult(action=f"batch_{mode}", entity="")
+
+        if "launches" in entities:
+            processor = LaunchProcessor(gateway=self._get_gateway(), router=self._get_router())
+            if mode == "submit":
+                result.append_result(processor.submit_batch(num_launches=num_items))
+            else:
+                processor_result = processor.ingest_batches(wait=mode == "wait")
+                logger.info(processor_result.llm_usage.print_summary_per_model())
+                result.append_result(processor_result)
+
+        if "articles" in entities:
+            processor = ArticlesProcessor(gateway=self._get_gateway(), router=self._get_router())
+            if mode == "submit":
+                result.append_result(processor.submit_batch(num_articles=num_items))
+            else:
+                processor_result = processor.ingest_batches(wait=mode == "wait")
+                logger.info(processor_result.llm_usage.print_summary_per_model_action())
+                result.append_result(processor_result)
+        return result
+
     def special(self, special):
         if special == "reprocess_similar_launches":
             from parsers import PostsParser
             parser = PostsParser()
             parser.reprocess_launches()
-        
\ No newline at end of file
+
+    def run_stage(self, stage: str, entity_ids: List[int]) -> ProcessorResult:
+        """Run one worker stage. entity_ids restricts the stages that work on single entities."""
+        if stage == "parse_prices":
+            from parsers import PriceParser
+            return PriceParser().parse()
+        if stage == "parse_sales":
+            from parsers import SalesParser
+            return SalesParser().parse()
+        if stage == "parse_launches":
+            from parsers import PostsParser
+            return PostsParser().parse(entities="launches", post_ids=entity_ids)
+        if stage == "parse_articles":
+            from parsers import PostsParser
+            return PostsParser().parse(entities="articles", post_ids=entity_ids)
+        if stage == "process_sales":
+            return self._process(["sales"])
+        if stage == "process_launches":
+            from processors import LaunchProcessor
+            processor = LaunchProcessor(max_workers=self.max_workers, gateway=self._get_gateway(), router=self._get_router(),
+                                        launch_index=self._get_launch_index())
+            result = processor.process(launch_ids=entity_ids)
+            logger.info(result.llm_usage.print_summary_per_model())
+            return result
+        if stage == "process_articles":
+            from processors import ArticlesProcessor
+            processor = ArticlesProcessor(max_workers=self.max_workers, gateway=self._get_gateway(), router=self._get_router(),
+                                          section_index=self._get_section_index())
+            result = processor.process(article_ids=entity_ids)
+            logger.info(result.llm_usage.print_summary_per_model_action())
+            return result
+        if stage == "connect":
+            return self._connect(["launches", "prices", "articles"])
+        if stage == "embed":
+            return self._upload(["articles", "launches"])
+        raise ValueError(f"Unknown stage {stage}")
+
+
+def add_processor_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the options of the LLM processing, shared by the processor and worker CLIs."""
+    parser.add_argument(
+        "-w", "--max-workers",
+        type=int,
+        default=16,
+        help="Number of launches and articles processed concurrently; LLM requests in flight adapt to each model's rate limits"
+    )
+    parser.add_argument(
+        "--llm-cache",
+        choices=["on", "only", "off"],
+        default="on",
+        help="Use the on-disk LLM response cache, replay from it only (no provider calls), or bypass it"
+    )
+    parser.add_argument(
+        "--fake-llm",
+        action="store_true",
+        help="Use deterministic offline fake chat and embedding models instead of the providers (for benchmarking; see FAKE_LLM_* environment variables)"
+    )
+    parser.add_argument(
+        "--routing",
+        choices=["on", "off"],
+        default="off",
+        help="Route each launch, article and section to a model by size, content and evaluated accuracy, escalating on bad output; off (the default) uses gpt-3.5-turbo for everything"
+    )
+    parser.add_argument(
+        "--max-cost",
+        type=float,
+        default=None,
+        help="Dollars the run may spend on LLM calls; once reached, no further calls are made and the remaining items are left pending"
+    )
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        default=None,
+        help="Input and output LLM tokens the run may use, with the same effect as --max-cost"
+    )
+    parser.add_argument(
+        "--max-minutes",
+        type=float,
+        default=None,
+        help="Wall clock minutes after which the run makes no further LLM calls"
+    )
+    parser.add_argument(
+        "--downgrade-at",
+        type=float,
+        default=0.8,
+        help="Fraction of any budget limit after which every call goes to the cheapest model and nothing is escalated"
+    )
+
+def create_processor(args: argparse.Namespace) -> Processor:
+    """Processor configured from the options added by add_processor_arguments."""
+    return Processor(llm_cache=args.llm_cache, max_workers=args.max_workers, routing=args.routing, fake_llm=args.fake_llm,
+                     max_cost=args.max_cost, max_tokens=args.max_tokens, max_minutes=args.max_minutes, downgrade_at=args.downgrade_at)
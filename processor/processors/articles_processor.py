@@ -1,17 +1,26 @@
+import concurrent.futures
 import json
+import threading
 import time
 from typing import Dict, Any, List, Tuple, Optional
 from datetime import datetime
 from langchain.prompts import ChatPromptTemplate
 from langchain.output_parsers import PydanticOutputParser
-from langchain.pydantic_v1 import BaseModel, Field
-from langchain_core.language_models.base import BaseLanguageModel
-from langchain_community.callbacks.manager import get_openai_callback
+from langchain.pydantic_v1 import BaseModel, Field, ValidationError
+from langchain_core.exceptions import OutputParserException
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.utils.json import parse_json_markdown
 from shared.utils import DBHelper
 from lib.processor_result import ProcessorResult
+from lib.llm_cache import LLMCache
+from lib.llm_gateway import InputBudgetError, LLMGateway
+from lib.model_router import ModelRouter
+from lib.llm_batch import BatchRequest, BatchResult, LLMBatches
+from lib.run_budget import BudgetExceeded
+from lib.near_duplicates import ProcessedIndex
 from loguru import logger
 from shared.lib.llm_usage import LLMUsage
-import tiktoken
+from shared.lib.llm_tokens import count_tokens, encode, decode, split_tokens
 
 class ArticleAnalysis(BaseModel):
     summary: str = Field(description="Summary of the author's impression of the car being evaluated, up to 100 words in Spanish")
@@ -27,116 +36,499 @@ class SectionAnalysis(BaseModel):
     # sentiment_evidence: str = Field(description="A sentence extracted from the text that best supports the sentiment. The sentence should be present in the content.")
     # sentiment_emotions: List[str] = Field(description="3 emotions expressed in the section")
 
+class SectionAnalysisItem(SectionAnalysis):
+    section_id: int = Field(description="Id of the analyzed section, exactly as given in the input")
+
+class SectionsAnalysis(BaseModel):
+    """Analysis of every section of an article."""
+    sections: List[SectionAnalysisItem]
+
+class SectionsAnalysisParser:
+    """Parses a batched section analysis, keeping every section that validates."""
+    def __init__(self):
+        self.parser = PydanticOutputParser(pydantic_object=SectionsAnalysis)
+
+    def get_format_instructions(self) -> str:
+        return self.parser.get_format_instructions()
+
+    def parse(self, text: str) -> Dict[int, SectionAnalysisItem]:
+        json_object = parse_json_markdown(text)
+        analyses = {}
+        for item in json_object.get("sections", []) if isinstance(json_object, dict) else []:
+            try:
+                analysis = SectionAnalysisItem.parse_obj(item)
+                analyses[analysis.section_id] = analysis
+            except ValidationError:
+                continue
+        if not analyses:
+            raise OutputParserException(f"No valid section analysis found in completion: {text}")
+        return analyses
+
 class LLMConfig:
     DEFAULT_COMPANY = "openai"
     DEFAULT_MODEL = "gpt-3.5-turbo"
     DEFAULT_TEMPERATURE = "0"
+    # Upper bound for the content of the sections sent together in a batched call
+    SECTION_BATCH_MAX_CHARS = 24000
+    # Completion tokens reserved when planning an article analysis and a chunk summary
+    ARTICLE_OUTPUT_TOKENS = 1024
+    CHUNK_SUMMARY_OUTPUT_TOKENS = 512
+    # Completion tokens of a typical article and section analysis, for cost estimates
+    ESTIMATED_ARTICLE_OUTPUT_TOKENS = 500
+    ESTIMATED_SECTION_OUTPUT_TOKENS = 100
+    # Sections at least this similar to an analyzed one (boilerplate repeated across reviews) reuse its analysis
+    SECTION_DUPLICATE_THRESHOLD = 0.9
 
 class ArticlesProcessor:
-    def __init__(self):
+    def __init__(self, max_workers: int = 4, write_batch_size: int = 20, batch_sections: bool = True, gateway: Optional[LLMGateway] = None,
+                 router: Optional[ModelRouter] = None, batches: Optional[LLMBatches] = None, section_index: Optional[ProcessedIndex] = None):
         self.db = DBHelper()
+        self.gateway = gateway or LLMGateway(cache=LLMCache())
+        self.batches = batches or LLMBatches(self.gateway)
+        # Without a router every call goes to the model passed to process()
+        self.router = router
         self.article_parser = PydanticOutputParser(pydantic_object=ArticleAnalysis)
         self.section_parser = PydanticOutputParser(pydantic_object=SectionAnalysis)
+        self.sections_parser = SectionsAnalysisParser()
+        self.batch_sections = batch_sections
         self.llm_usage = LLMUsage(node_title="ArticlesProcessor")
-        self.tokenizer = tiktoken.encoding_for_model("gpt-3.5-turbo")
+        self.max_workers = max_workers
+        # Articles and sections run in separate pools of max_workers threads each; how many of their LLM calls
+        # are in flight at once is up to the scheduler's adaptive lane of each model
+        self.section_executor = None
+        self.write_batch_size = write_batch_size
+        # Rows to write: an analyzed article, if any, and analyzed sections, written in the same transaction
+        self.pending_updates: List[Tuple[Optional[tuple], List[tuple]]] = []
+        # Articles written since the last process() or ingest, as articles only count as processed once written
+        self.num_saved = 0
+        # Analyzed sections, to reuse their analysis for near duplicates; brought up to date by process()
+        self.section_index = section_index if section_index is not None else ProcessedIndex(LLMConfig.SECTION_DUPLICATE_THRESHOLD)
+        self.lock = threading.Lock()
 
     def process(self, company_name: str = LLMConfig.DEFAULT_COMPANY, 
                 model_name: str = LLMConfig.DEFAULT_MODEL, 
-                num_articles: int = 0) -> ProcessorResult:
+                num_articles: int = 0,
+                article_ids: Optional[List[int]] = None) -> ProcessorResult:
         result = ProcessorResult(action="process", entity="articles")
         self.llm_usage = LLMUsage(node_title="ArticlesProcessor")
-        llm = self._get_llm(company_name, model_name)
-        articles = self._get_unprocessed_articles(num_articles)
+        articles = self._get_unprocessed_articles(num_articles, article_ids)
+        router = self.router or ModelRouter.fixed(company_name, model_name)
+        self._load_section_index()
+        self.num_saved = 0
         
-        for article in articles:
-            try:
-                logger.info(f"Processing article: {article['id']} - {article['title']}")
-                processed, usage = self._process_article(article, llm, company_name, model_name)
-                self.llm_usage.add_usage(usage)
-                if processed:
-                    section_usage = self._process_article_sections(article['id'], llm, company_name, model_name)
-                    self.llm_usage.add_usage(section_usage)
-                    result.items_processed += 1
-            except Exception as e:
-                logger.error(f"Error processing article {article['id']}: {str(e)}")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as section_executor, \
+             concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            self.section_executor = section_executor
+            futures = {executor.submit(self._process_article_and_sections, article, router): article for article in articles}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"Error processing article {futures[future]['id']}: {str(e)}")
+        self._flush_updates()
+        result.items_processed += self.num_saved
         
         result.llm_usage.add_usage(self.llm_usage)
         return result
 
-    def _get_llm(self, company_name: str, model_name: str) -> BaseLanguageModel:
-        if company_name == "openai":
-            from langchain_openai import ChatOpenAI
-            return ChatOpenAI(model=model_name, temperature=LLMConfig.DEFAULT_TEMPERATURE)
-        elif company_name == "groq":
-            from langchain_groq import ChatGroq
-            return ChatGroq(model=model_name, temperature=LLMConfig.DEFAULT_TEMPERATURE)
-        elif company_name == "anthropic":
-            from langchain_anthropic import ChatAnthropic
-            return ChatAnthropic(model=model_name, temperature=LLMConfig.DEFAULT_TEMPERATURE)
-        else:
-            raise ValueError(f"LLM provider {company_name} not supported")
-
-    def _get_unprocessed_articles(self, limit: int = 0) -> List[Dict[str, Any]]:
-        query = """
+    def _process_article_and_sections(self, article: Dict[str, Any], router: ModelRouter) -> bool:
+        """
+        Analyze an article and its sections. The article is only saved together with all of its
+        sections; if any is left unanalyzed (out of budget, or an error), only the analyzed sections
+        are saved and the article stays unprocessed, so the next run retries the rest.
+        """
+        logger.info(f"Processing article: {article['id']} - {article['title']}")
+        analysis, usage = self._process_article(article, router)
+        self.llm_usage.add_usage(usage)
+        if analysis is None:
+            return False
+        section_usage, section_rows, complete = self._process_article_sections(article['id'], router)
+        self.llm_usage.add_usage(section_usage)
+        if not complete:
+            logger.warning(f"Article {article['id']} has sections left unanalyzed, leaving it unprocessed for the next run")
+        self._save_updates(self._make_article_row(article['id'], analysis.dict()) if complete else None, section_rows)
+        return complete
+
+    def submit_batch(self, company_name: str = LLMConfig.DEFAULT_COMPANY, model_name: str = LLMConfig.DEFAULT_MODEL,
+                     num_articles: int = 0, article_ids: Optional[List[int]] = None) -> ProcessorResult:
+        """
+        Submit the analysis of the unprocessed articles and their sections to the Batch API.
+        Articles too long for a single call are left for an interactive run, which condenses them.
+        """
+        result = ProcessorResult(action="submit_batch", entity="articles")
+        router = self.router or ModelRouter.fixed(company_name, model_name)
+        requests = []
+        for article in self._get_unprocessed_articles(num_articles, article_ids):
+            sections = self._get_article_sections(article['id'])
+            section_batches = self._batch_sections(sections) if sections else []
+            request = self._make_article_batch_request(article, len(section_batches), router)
+            if not request:
+                logger.info(f"Article {article['id']} does not fit a single call, leaving it for an interactive run")
+                continue
+            requests.append(request)
+            for index, batch in enumerate(section_batches):
+                requests.append(self._make_sections_batch_request(article['id'], index, batch, router))
+        result.items_processed = self.batches.submit("articles", requests)
+        return result
+
+    def _make_article_batch_request(self, article: Dict[str, Any], num_section_requests: int, router: ModelRouter) -> Optional[BatchRequest]:
+        comments = article['comments'] or ""
+        input_tokens = count_tokens(article['content'], LLMConfig.DEFAULT_MODEL) + count_tokens(comments, LLMConfig.DEFAULT_MODEL)
+        route = router.select("article", input_tokens, LLMConfig.ARTICLE_OUTPUT_TOKENS)
+        prompt = self._create_article_prompt()
+        input_data = self._prepare_input(article['content'], comments, is_article=True)
+        try:
+            budget = self.gateway.get_input_budget(prompt, self._prepare_input("", "", is_article=True), route.model, LLMConfig.ARTICLE_OUTPUT_TOKENS)
+        except InputBudgetError:
+            return None
+        if count_tokens(article['content'], route.model) + count_tokens(comments, route.model) > budget:
+            return None
+        return self.gateway.make_batch_request(f"article-{article['id']}", prompt, input_data, route.company, route.model,
+                                               LLMConfig.DEFAULT_TEMPERATURE,
+                                               metadata={"entity_ids": [article['id']], "action": "process_article",
+                                                         "num_section_requests": num_section_requests})
+
+    def _make_sections_batch_request(self, article_id: int, index: int, sections: List[Dict[str, Any]], router: ModelRouter) -> BatchRequest:
+        input_data = self._prepare_sections_input(sections)
+        route = router.select("section", count_tokens(input_data["sections"], LLMConfig.DEFAULT_MODEL),
+                              section_titles=[section['title'] for section in sections])
+        return self.gateway.make_batch_request(f"sections-{article_id}-{index}", self._create_sections_batch_prompt(), input_data,
+                                               route.company, route.model, LLMConfig.DEFAULT_TEMPERATURE,
+                                               metadata={"entity_ids": [article_id], "action": "process_article_sections_batch",
+                                                         "section_ids": [section['id'] for section in sections]})
+
+    def ingest_batches(self, wait: bool = False) -> ProcessorResult:
+        """
+        Save the analyses of the finished article batches. An article is only saved together
+        with all of its sections: if any of its requests failed, or its output does not parse
+        or look right, nothing of it is saved, and it stays unprocessed for an interactive run.
+        """
+        result = ProcessorResult(action="ingest_batch", entity="articles")
+        self.batches.collect("articles", lambda batch_results: self._ingest_batch_results(batch_results, result), wait)
+        return result
+
+    def _ingest_batch_results(self, batch_results: List[BatchResult], result: ProcessorResult):
+        self.num_saved = 0
+        results_by_article: Dict[int, List[BatchResult]] = {}
+        for batch_result in batch_results:
+            result.llm_usage.add_usage(batch_result.usage)
+            results_by_article.setdefault(batch_result.metadata["entity_ids"][0], []).append(batch_result)
+        for article_id, article_results in results_by_article.items():
+            analyses = self._read_article_batch_results(article_id, article_results)
+            if analyses is None:
+                continue
+            analysis, section_analyses = analyses
+            self._save_updates(self._make_article_row(article_id, analysis.dict()),
+                               [self._make_section_row(section_id, section_analysis.dict())
+                                for section_id, section_analysis in section_analyses.items()])
+        self._flush_updates()
+        result.items_processed += self.num_saved
+
+    def _read_article_batch_results(self, article_id: int, article_results: List[BatchResult]) -> Optional[Tuple[ArticleAnalysis, Dict[int, SectionAnalysisItem]]]:
+        """The analysis of an article and of each of its sections, or None unless all of its requests succeeded."""
+        analysis, num_section_requests, expected_section_requests = None, 0, 0
+        section_analyses: Dict[int, SectionAnalysisItem] = {}
+        for batch_result in article_results:
+            if batch_result.error:
+                logger.error(f"Batch request {batch_result.custom_id} for article {article_id} failed: {batch_result.error}")
+                return None
+            try:
+                if "section_ids" in batch_result.metadata:
+                    parsed = self.gateway.parse_batch_result(batch_result, self.sections_parser)
+                    missing = [section_id for section_id in batch_result.metadata["section_ids"] if section_id not in parsed]
+                    if missing:
+                        logger.error(f"Batch output {batch_result.custom_id} for article {article_id} has no analysis of sections {missing}")
+                        return None
+                    section_analyses.update({section_id: parsed[section_id] for section_id in batch_result.metadata["section_ids"]})
+                    num_section_requests += 1
+                else:
+                    analysis = self.gateway.parse_batch_result(batch_result, self.article_parser)
+                    expected_section_requests = batch_result.metadata.get("num_section_requests", 0)
+            except (OutputParserException, ValueError) as e:
+                logger.error(f"Error parsing the batch output {batch_result.custom_id} for article {article_id}: {str(e)}")
+                return None
+        if analysis is None:
+            logger.error(f"Batch results of article {article_id} have no article analysis, leaving it for an interactive run")
+            return None
+        if not self._is_confident_analysis(analysis):
+            logger.warning(f"Batch analysis of article {article_id} looks wrong, leaving it for an interactive run")
+            return None
+        if num_section_requests < expected_section_requests:
+            logger.error(f"Batch results of article {article_id} miss {expected_section_requests - num_section_requests} "
+                         f"sections requests, leaving it for an interactive run")
+            return None
+        return analysis, section_analyses
+
+    def estimate(self, company_name: str = LLMConfig.DEFAULT_COMPANY, model_name: str = LLMConfig.DEFAULT_MODEL,
+                 num_articles: int = 0, article_ids: Optional[List[int]] = None) -> ProcessorResult:
+        """Estimated usage of processing the unprocessed articles and their sections, without calling any model."""
+        result = ProcessorResult(action="estimate", entity="articles")
+        router = self.router or ModelRouter.fixed(company_name, model_name)
+        for article in self._get_unprocessed_articles(num_articles, article_ids):
+            try:
+                self._estimate_article(article, router, result.llm_usage)
+            except InputBudgetError as e:
+                logger.warning(f"Article {article['id']} cannot be estimated: {str(e)}")
+                continue
+            self._estimate_article_sections(self._get_article_sections(article['id']), router, result.llm_usage)
+            result.items_processed += 1
+        return result
+
+    def _estimate_article(self, article: Dict[str, Any], router: ModelRouter, usage: LLMUsage):
+        content, comments = article['content'], article['comments'] or ""
+        input_tokens = count_tokens(content, LLMConfig.DEFAULT_MODEL) + count_tokens(comments, LLMConfig.DEFAULT_MODEL)
+        route = router.select("article", input_tokens, LLMConfig.ARTICLE_OUTPUT_TOKENS)
+        prompt = self._create_article_prompt()
+        budget = self.gateway.get_input_budget(prompt, self._prepare_input("", "", is_article=True), route.model, LLMConfig.ARTICLE_OUTPUT_TOKENS)
+        content_tokens = encode(content, route.model)
+        comments_tokens = encode(comments, route.model)
+        if len(content_tokens) + len(comments_tokens) > budget:
+            # Same split as _fit_article_input: chunk summaries, then the analysis of a full budget
+            comments_budget = min(len(comments_tokens), budget // 3)
+            content_budget = budget - comments_budget
+            for tokens, target_tokens in ((content_tokens, content_budget), (comments_tokens, comments_budget)):
+                if len(tokens) > target_tokens:
+                    self._estimate_condense(tokens, target_tokens, route.company, route.model, usage)
+            content = decode(content_tokens[:content_budget], route.model)
+            comments = decode(comments_tokens[:comments_budget], route.model)
+        usage.add_usage(self.gateway.estimate(prompt, self._prepare_input(content, comments, is_article=True), route.company, route.model,
+                                              LLMConfig.ESTIMATED_ARTICLE_OUTPUT_TOKENS, "process_article", LLMConfig.DEFAULT_TEMPERATURE))
+
+    def _estimate_condense(self, tokens: List[int], target_tokens: int, company_name: str, model_name: str, usage: LLMUsage):
+        prompt = self._create_chunk_summary_prompt()
+        chunk_budget = self.gateway.get_input_budget(prompt, {"content": "", "max_words": 0}, model_name, LLMConfig.CHUNK_SUMMARY_OUTPUT_TOKENS)
+        chunks = split_tokens(tokens, chunk_budget, model_name)
+        max_words = max(50, min(350, int(target_tokens / len(chunks) * 0.6)))
+        for chunk in chunks:
+            usage.add_usage(self.gateway.estimate(prompt, {"content": chunk, "max_words": max_words}, company_name, model_name,
+                                                  int(max_words / 0.75), "summarize_article_chunk", LLMConfig.DEFAULT_TEMPERATURE))
+
+    def _estimate_article_sections(self, sections: List[Dict[str, Any]], router: ModelRouter, usage: LLMUsage):
+        if self.batch_sections and len(sections) > 1:
+            for batch in self._batch_sections(sections):
+                input_data = self._prepare_sections_input(batch)
+                route = router.select("section", count_tokens(input_data["sections"], LLMConfig.DEFAULT_MODEL),
+                                      section_titles=[section['title'] for section in batch])
+                usage.add_usage(self.gateway.estimate(self._create_sections_batch_prompt(), input_data, route.company, route.model,
+                                                      LLMConfig.ESTIMATED_SECTION_OUTPUT_TOKENS * len(batch),
+                                                      "process_article_sections_batch", LLMConfig.DEFAULT_TEMPERATURE))
+            return
+        for section in sections:
+            route = router.select("section", count_tokens(section['content'], LLMConfig.DEFAULT_MODEL), section_titles=[section['title']])
+            usage.add_usage(self.gateway.estimate(self._create_section_prompt(), self._prepare_input(section['content'], None, is_article=False),
+                                                  route.company, route.model, LLMConfig.ESTIMATED_SECTION_OUTPUT_TOKENS,
+                                                  "process_article_section", LLMConfig.DEFAULT_TEMPERATURE))
+
+    def _get_unprocessed_articles(self, limit: int = 0, article_ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+        query = f"""
             SELECT id, title, content, comments
             FROM articles
-            WHERE date_processed IS NULL
+            WHERE date_processed IS NULL AND (%(ids)s IS NULL OR id = ANY(%(ids)s))
+              AND {LLMBatches.get_open_filter("articles", "articles.id")}
             ORDER BY id ASC
         """
         if limit > 0:
             query += f" LIMIT {limit}"
-        return self.db.execute_query(query)
+        return self.db.execute_query(query, {"ids": article_ids})
 
-    def _process_article(self, article: Dict[str, Any], llm: BaseLanguageModel, 
-                         company_name: str, model_name: str) -> Tuple[bool, LLMUsage]:
-        usage = LLMUsage(action="process_article", model_name=model_name)
-        start_time = time.time()
+    def _process_article(self, article: Dict[str, Any], router: ModelRouter) -> Tuple[Optional[ArticleAnalysis], LLMUsage]:
+        usage = LLMUsage(node_title="process_article")
         
         try:
-            prompt = self._create_article_prompt()
-            chain = prompt | llm | self.article_parser
-            
-            output = self._invoke_chain(chain, article['content'], article['comments'], company_name, model_name, usage, is_article=True)
-            usage.time = time.time() - start_time
+            input_tokens = count_tokens(article['content'], LLMConfig.DEFAULT_MODEL) + count_tokens(article['comments'] or "", LLMConfig.DEFAULT_MODEL)
+            output = router.run("article", "process_article", input_tokens,
+                                lambda route, attempt_usage: self._analyze_article(article, route.company, route.model, attempt_usage),
+                                usage, is_confident=self._is_confident_analysis, output_tokens=LLMConfig.ARTICLE_OUTPUT_TOKENS)
             logger.info(usage.get_summary())
-            
-            self._update_article(article['id'], output.dict())
-            logger.info(f"Article processed: {article['id']}")
-            
-            return True, usage
+            logger.info(f"Article analyzed: {article['id']}")
+            return output, usage
+        except BudgetExceeded:
+            return None, usage
         except Exception as e:
             logger.error(f"Error processing article {article['id']}: {str(e)}")
-            usage.time = time.time() - start_time
-            return False, usage
+            return None, usage
+
+    def _analyze_article(self, article: Dict[str, Any], company_name: str, model_name: str, usage: LLMUsage) -> ArticleAnalysis:
+        analysis_usage = LLMUsage(action="process_article", model_name=model_name)
+        start_time = time.time()
+        try:
+            content, comments = self._fit_article_input(article, company_name, model_name, usage)
+            prompt = self._create_article_prompt()
+            return self._invoke_chain(prompt, self.article_parser, content, comments, company_name, model_name, analysis_usage, is_article=True)
+        finally:
+            analysis_usage.time = time.time() - start_time
+            usage.add_usage(analysis_usage)
+
+    @staticmethod
+    def _is_confident_analysis(analysis) -> bool:
+        # Sentiment scores outside -1..1 or an empty summary mean the model misread the task
+        scores = [analysis.sentiment_score] + ([analysis.comments_sentiment_score] if isinstance(analysis, ArticleAnalysis) else [])
+        return bool(analysis.summary.strip()) and all(-1 <= score <= 1 for score in scores)
+
+    def _fit_article_input(self, article: Dict[str, Any], company_name: str, model_name: str, usage: LLMUsage) -> Tuple[str, str]:
+        """
+        Count the article tokens once against the model's context window. Content or
+        comments that do not fit are condensed through chunk summaries (map) before
+        the article analysis (reduce).
+        """
+        budget = self.gateway.get_input_budget(self._create_article_prompt(), self._prepare_input("", "", is_article=True),
+                                               model_name, LLMConfig.ARTICLE_OUTPUT_TOKENS)
+        content, comments = article['content'], article['comments'] or ""
+        content_tokens = encode(content, model_name)
+        comments_tokens = encode(comments, model_name)
+        if len(content_tokens) + len(comments_tokens) <= budget:
+            return content, comments
+
+        # Comments get at most a third of the budget, the content the rest
+        comments_budget = min(len(comments_tokens), budget // 3)
+        content_budget = budget - comments_budget
+        logger.info(f"Article {article['id']} has {len(content_tokens)} content and {len(comments_tokens)} comment tokens for a budget of {budget}, condensing")
+        if len(content_tokens) > content_budget:
+            content = self._condense(content_tokens, content_budget, company_name, model_name, usage)
+        if len(comments_tokens) > comments_budget:
+            comments = self._condense(comments_tokens, comments_budget, company_name, model_name, usage)
+        return content, comments
+
+    def _condense(self, tokens: List[int], target_tokens: int, company_name: str, model_name: str, usage: LLMUsage) -> str:
+        prompt = self._create_chunk_summary_prompt()
+        chunk_budget = self.gateway.get_input_budget(prompt, {"content": "", "max_words": 0}, model_name, LLMConfig.CHUNK_SUMMARY_OUTPUT_TOKENS)
+        chunks = split_tokens(tokens, chunk_budget, model_name)
+        # Roughly 0.75 words per token, kept within the completion tokens reserved for each summary
+        max_words = max(50, min(350, int(target_tokens / len(chunks) * 0.6)))
+        
+        summaries = []
+        for chunk in chunks:
+            chunk_usage = LLMUsage(action="summarize_article_chunk", model_name=model_name)
+            start_time = time.time()
+            summaries.append(self.gateway.invoke(prompt, StrOutputParser(), {"content": chunk, "max_words": max_words},
+                                                 company_name, model_name, chunk_usage, LLMConfig.DEFAULT_TEMPERATURE))
+            chunk_usage.time = time.time() - start_time
+            usage.add_usage(chunk_usage)
+        
+        # Summaries may overshoot their word limit; never send more than the budget
+        return decode(encode("\n\n".join(summaries), model_name)[:target_tokens], model_name)
+
+    def _load_section_index(self):
+        # Only the sections analyzed since the last load, as the index is kept across processors
+        for section in self._get_analyzed_sections(self.section_index.get_load_start()):
+            self.section_index.load(section['id'], section['content'], section['date_processed'], self._get_reused_analysis(section))
+        logger.debug(f"{len(self.section_index)} analyzed sections indexed for near duplicates")
+
+    def _remember_section(self, section: Dict[str, Any], analysis: Dict[str, Any]):
+        self.section_index.add(section['id'], section['content'], self._get_reused_analysis(analysis))
+
+    @staticmethod
+    def _get_reused_analysis(analysis: Dict[str, Any]) -> Dict[str, Any]:
+        return {"summary": analysis['summary'], "sentiment_score": analysis['sentiment_score']}
 
-    def _process_article_sections(self, article_id: int, llm: BaseLanguageModel, 
-                                  company_name: str, model_name: str) -> LLMUsage:
-        sections = self._get_article_sections(article_id)
-        usage = LLMUsage(node_title="process_article_sections", model_name=model_name)
+    def _reuse_duplicate_sections(self, sections: List[Dict[str, Any]]) -> Tuple[List[tuple], List[Dict[str, Any]]]:
+        """
+        The rows of the sections that nearly duplicate an analyzed one, with its analysis,
+        and the sections left to analyze. Duplicates among sections analyzed concurrently
+        are not detected.
+        """
+        rows, remaining = [], []
+        for section in sections:
+            match = self.section_index.find(section['content'], exclude=section['id'])
+            if match is None:
+                remaining.append(section)
+                continue
+            rows.append(self._make_section_row(section['id'], self.section_index.payloads[match[0]], duplicate_of_id=match[0]))
+        if rows:
+            logger.info(f"Reused the analysis of near duplicate sections for {len(rows)}/{len(sections)} sections")
+        return rows, remaining
+
+    def _process_article_sections(self, article_id: int, router: ModelRouter) -> Tuple[LLMUsage, List[tuple], bool]:
+        """The rows of the analyzed sections of an article, and whether all of them were analyzed."""
+        rows, sections = self._reuse_duplicate_sections(self._get_article_sections(article_id))
+        usage = LLMUsage(node_title="process_article_sections")
         if sections:
             logger.info(f"Processing {len(sections)} sections")
         
+        if self.batch_sections and len(sections) > 1:
+            batch_futures = [self.section_executor.submit(self._process_section_batch, batch, router)
+                             for batch in self._batch_sections(sections)]
+            sections = []
+            for future in batch_futures:
+                batch_usage, batch_rows, missing_sections = future.result()
+                usage.add_usage(batch_usage)
+                rows.extend(batch_rows)
+                sections.extend(missing_sections)
+            if sections:
+                logger.warning(f"{len(sections)} sections missing from the batched analysis of article {article_id}, falling back to per-section calls")
+        
+        futures = [self.section_executor.submit(self._process_article_section, section, router) for section in sections]
+        complete = True
+        for future in futures:
+            section_usage, row = future.result()
+            usage.add_usage(section_usage)
+            if row is None:
+                complete = False
+            else:
+                rows.append(row)
+        return usage, rows, complete
+
+    def _batch_sections(self, sections: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        batches = [[]]
+        batch_chars = 0
         for section in sections:
-            section_usage = LLMUsage(action="process_article_section", model_name=model_name)
-            start_time = time.time()
+            if batches[-1] and batch_chars + len(section['content']) > LLMConfig.SECTION_BATCH_MAX_CHARS:
+                batches.append([])
+                batch_chars = 0
+            batches[-1].append(section)
+            batch_chars += len(section['content'])
+        return batches
+
+    def _process_section_batch(self, sections: List[Dict[str, Any]], router: ModelRouter) -> Tuple[LLMUsage, List[tuple], List[Dict[str, Any]]]:
+        """Analyze several sections in one call. Returns the rows of the analyzed sections and the sections that still need a call of their own."""
+        usage = LLMUsage(node_title="process_article_sections_batch")
+        rows, missing_sections = [], []
+        
+        try:
+            input_data = self._prepare_sections_input(sections)
+            analyses = router.run("section", "process_article_sections_batch", count_tokens(input_data["sections"], LLMConfig.DEFAULT_MODEL),
+                                  lambda route, attempt_usage: self._invoke_sections_batch(input_data, route.company, route.model, attempt_usage),
+                                  usage, section_titles=[section['title'] for section in sections])
+            for section in sections:
+                analysis = analyses.get(section['id'])
+                if analysis:
+                    rows.append(self._make_section_row(section['id'], analysis.dict()))
+                    self._remember_section(section, analysis.dict())
+                else:
+                    missing_sections.append(section)
+            logger.info(f"Sections processed in batch: {len(sections) - len(missing_sections)}/{len(sections)}")
+        except BudgetExceeded:
+            return usage, [], sections
+        except Exception as e:
+            logger.error(f"Error processing article sections {[section['id'] for section in sections]} in batch: {str(e)}")
+            rows, missing_sections = [], sections
+        
+        logger.info(usage.get_summary())
+        return usage, rows, missing_sections
+
+    def _invoke_sections_batch(self, input_data: Dict[str, Any], company_name: str, model_name: str, usage: LLMUsage) -> Dict[int, SectionAnalysisItem]:
+        return self.gateway.invoke(self._create_sections_batch_prompt(), self.sections_parser, input_data,
+                                   company_name, model_name, usage, LLMConfig.DEFAULT_TEMPERATURE)
+
+    def _process_article_section(self, section: Dict[str, Any], router: ModelRouter) -> Tuple[LLMUsage, Optional[tuple]]:
+        section_usage = LLMUsage(node_title="process_article_section")
+        
+        try:
+            prompt = self._create_section_prompt()
+            output = router.run("section", "process_article_section", count_tokens(section['content'], LLMConfig.DEFAULT_MODEL),
+                                lambda route, attempt_usage: self._invoke_chain(prompt, self.section_parser, section['content'], None,
+                                                                                route.company, route.model, attempt_usage, is_article=False),
+                                section_usage, is_confident=self._is_confident_analysis, section_titles=[section['title']])
             
-            try:
-                prompt = self._create_section_prompt()
-                chain = prompt | llm | self.section_parser
-                
-                output = self._invoke_chain(chain, section['content'], None, company_name, model_name, section_usage, is_article=False)
-                
-                self._update_article_section(section['id'], output.dict())
-                logger.info(f"Section processed: {section['title']}")
-                
-                section_usage.time = time.time() - start_time
-                logger.info(section_usage.get_summary())
-            except Exception as e:
-                logger.error(f"Error processing article section {section['id']}: {str(e)}")
-                section_usage.time = time.time() - start_time
-                
-            usage.add_usage(section_usage)
-        return usage
+            self._remember_section(section, output.dict())
+            logger.info(f"Section processed: {section['title']}")
+            logger.info(section_usage.get_summary())
+            return section_usage, self._make_section_row(section['id'], output.dict())
+        except BudgetExceeded:
+            return section_usage, None
+        except Exception as e:
+            logger.error(f"Error processing article section {section['id']}: {str(e)}")
+            return section_usage, None
 
     def _create_article_prompt(self) -> ChatPromptTemplate:
         return ChatPromptTemplate.from_messages([
@@ -150,63 +542,36 @@ class ArticlesProcessor:
             ("human", "{content}")
         ])
 
-    def _invoke_chain(self, chain, content: str, comments: Optional[str], company_name: str, model_name: str, usage: LLMUsage, is_article: bool, is_truncated: bool = False):
-        try:
-            input_data = self._prepare_input(content, comments, is_article)
-            
-            if company_name == "openai":
-                with get_openai_callback() as cb:
-                    output = chain.invoke(input_data)
-                    usage.token_input = cb.prompt_tokens
-                    usage.token_output = cb.completion_tokens
-                    usage.cost = cb.total_cost
-            else:
-                output = chain.invoke(input_data)
-                usage.set_estimated_token_usage_and_cost(company_name, model_name, content + " " + (comments or ""), str(output))
-            
-            return output
-        except Exception as e:
-            if "context_length_exceeded" in str(e) and not is_truncated:
-                truncated_input = self._truncate_input(input_data, model_name)
-                return self._invoke_chain(chain, truncated_input["content"], truncated_input.get("comments"), company_name, model_name, usage, is_article, is_truncated=True)
-            else:
-                raise
+    def _create_sections_batch_prompt(self) -> ChatPromptTemplate:
+        return ChatPromptTemplate.from_messages([
+            ("system", "Each of the following sections of a car review starts with its id and title. Analyze every section separately and provide a summary and sentiment analysis in Spanish for each one, identified by its section id. {format_instructions}"),
+            ("human", "{sections}")
+        ])
+
+    def _create_chunk_summary_prompt(self) -> ChatPromptTemplate:
+        return ChatPromptTemplate.from_messages([
+            ("system", "Summarize the following excerpt in Spanish in at most {max_words} words, keeping the author's opinions, the key facts and the most representative sentences."),
+            ("human", "{content}")
+        ])
+
+    def _invoke_chain(self, prompt: ChatPromptTemplate, parser: PydanticOutputParser, content: str, comments: Optional[str], company_name: str, model_name: str, usage: LLMUsage, is_article: bool):
+        input_data = self._prepare_input(content, comments, is_article)
+        return self.gateway.invoke(prompt, parser, input_data, company_name, model_name, usage, LLMConfig.DEFAULT_TEMPERATURE)
 
     def _prepare_input(self, content: str, comments: Optional[str], is_article: bool) -> Dict[str, Any]:
         input_dict = {
             "content": content,
             "format_instructions": self.article_parser.get_format_instructions() if is_article else self.section_parser.get_format_instructions()
         }
-        if comments and is_article:
-            input_dict["comments"] = comments
+        if is_article:
+            input_dict["comments"] = comments or ""
         return input_dict
 
-    def _truncate_input(self, input_data: Dict[str, Any], model_name: str) -> Dict[str, Any]:
-        max_tokens = 14000  # Leave some buffer for the model's response
-        current_tokens = len(self.tokenizer.encode(input_data["content"] + input_data.get("comments", "")))
-        
-        if current_tokens > max_tokens:
-            content_tokens = len(self.tokenizer.encode(input_data["content"]))
-            comments_tokens = len(self.tokenizer.encode(input_data.get("comments", "")))
-            
-            # Determine how much to truncate from content and comments
-            total_excess = current_tokens - max_tokens
-            content_excess = min(total_excess, int(total_excess * (content_tokens / current_tokens)))
-            comments_excess = total_excess - content_excess
-            
-            # Truncate content
-            if content_excess > 0:
-                content_token_ids = self.tokenizer.encode(input_data["content"])
-                truncated_content_tokens = content_token_ids[:-(content_excess + 1)]  # +1 to be safe
-                input_data["content"] = self.tokenizer.decode(truncated_content_tokens)
-            
-            # Truncate comments if present
-            if "comments" in input_data and comments_excess > 0:
-                comments_token_ids = self.tokenizer.encode(input_data["comments"])
-                truncated_comments_tokens = comments_token_ids[:-(comments_excess + 1)]  # +1 to be safe
-                input_data["comments"] = self.tokenizer.decode(truncated_comments_tokens)
-        
-        return input_data
+    def _prepare_sections_input(self, sections: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return {
+            "sections": "\n\n".join(f"[id={section['id']}] {section['title']}\n{section['content']}" for section in sections),
+            "format_instructions": self.sections_parser.get_format_instructions()
+        }
 
     def _get_article_sections(self, article_id: int) -> List[Dict[str, Any]]:
         return self.db.execute_query("""
@@ -215,24 +580,105 @@ class ArticlesProcessor:
             WHERE article_id = %s AND date_processed IS NULL
         """, (article_id,))
 
-    def _update_article(self, article_id: int, analysis: Dict[str, Any]):
-        self.db.update('articles', {'id': article_id}, {
-            'summary': analysis['summary'],
-            'sentiment_score': analysis['sentiment_score'],
-            'sentiment_evidence': json.dumps(analysis['sentiment_evidence'], ensure_ascii=False),
-            'sentiment_emotions': json.dumps(analysis['sentiment_emotions'], ensure_ascii=False),
-            'comments_sentiment_score': analysis['comments_sentiment_score'],
-            'comments_summary': analysis['comments_summary'],
-            'date_processed': datetime.now()
-        })
-
-    def _update_article_section(self, section_id: int, analysis: Dict[str, Any]):
-        self.db.update('article_sections', {'id': section_id}, {
-            'summary': analysis['summary'],
-            'sentiment_score': analysis['sentiment_score'],
-            # 'sentiment_evidence': json.dumps(analysis['sentiment_evidence'], ensure_ascii=False),
-            # 'sentiment_emotions': json.dumps(analysis['sentiment_emotions'], ensure_ascii=False),
-            'date_processed': datetime.now()
-        })
-
-    
\ No newline at end of file
+    def _get_analyzed_sections(self, since: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        return self.db.execute_query("""
+            SELECT id, content, summary, sentiment_score, date_processed
+            FROM article_sections
+            WHERE date_processed IS NOT NULL AND summary IS NOT NULL
+              AND (%(since)s::timestamp IS NULL OR date_processed >= %(since)s::timestamp)
+            ORDER BY id ASC
+        """, {"since": since})
+
+    @staticmethod
+    def _make_article_row(article_id: int, analysis: Dict[str, Any]) -> tuple:
+        return (
+            article_id,
+            analysis['summary'],
+            analysis['sentiment_score'],
+            json.dumps(analysis['sentiment_evidence'], ensure_ascii=False),
+            json.dumps(analysis['sentiment_emotions'], ensure_ascii=False),
+            analysis['comments_sentiment_score'],
+            analysis['comments_summary'],
+            datetime.now()
+        )
+
+    @staticmethod
+    def _make_section_row(section_id: int, analysis: Dict[str, Any], duplicate_of_id: Optional[int] = None) -> tuple:
+        return (
+            section_id,
+            analysis['summary'],
+            analysis['sentiment_score'],
+            duplicate_of_id,
+            datetime.now()
+        )
+
+    def _save_updates(self, article_row: Optional[tuple], section_rows: List[tuple]):
+        if article_row is None and not section_rows:
+            return
+        with self.lock:
+            self.pending_updates.append((article_row, section_rows))
+            if sum(1 for row, _ in self.pending_updates if row) >= self.write_batch_size:
+                self._write_pending_updates()
+
+    def _flush_updates(self):
+        """Write the pending updates. Those that cannot be written are logged and stay unprocessed for a later run."""
+        with self.lock:
+            self._write_pending_updates()
+            if self.pending_updates:
+                logger.error(f"{', '.join(self._describe_update(update) for update in self.pending_updates)} could not be saved, "
+                             f"they stay unprocessed")
+                self.pending_updates = []
+
+    def _write_pending_updates(self):
+        # Called with self.lock held. Updates leave the buffer, and their articles count as saved, only once
+        # committed. If a batch fails, its updates are written one by one, so that one bad row does not hold
+        # back the rest; those that still fail stay in the buffer for the next write.
+        if not self.pending_updates:
+            return
+        try:
+            self._write_updates(self.pending_updates)
+            self.num_saved += sum(1 for row, _ in self.pending_updates if row)
+            self.pending_updates = []
+            return
+        except Exception as e:
+            logger.error(f"Error saving {len(self.pending_updates)} article updates, saving them one by one: {str(e)}")
+        failed = []
+        for update in self.pending_updates:
+            try:
+                self._write_updates([update])
+                self.num_saved += 1 if update[0] else 0
+            except Exception as e:
+                logger.error(f"Error saving {self._describe_update(update)}: {str(e)}")
+                failed.append(update)
+        self.pending_updates = failed
+
+    @staticmethod
+    def _describe_update(update: Tuple[Optional[tuple], List[tuple]]) -> str:
+        article_row, section_rows = update
+        sections = f"sections {[row[0] for row in section_rows]}" if section_rows else ""
+        if article_row:
+            return f"article {article_row[0]}" + (f" with {sections}" if sections else "")
+        return sections
+
+    def _write_updates(self, updates: List[Tuple[Optional[tuple], List[tuple]]]):
+        articles = [article_row for article_row, _ in updates if article_row]
+        sections = [section_row for _, section_rows in updates for section_row in section_rows]
+        with self.db.get_cursor() as cur:
+            self.db.execute_values("""
+                UPDATE articles AS a
+                SET summary = v.summary, sentiment_score = v.sentiment_score,
+                    sentiment_evidence = v.sentiment_evidence, sentiment_emotions = v.sentiment_emotions,
+                    comments_sentiment_score = v.comments_sentiment_score, comments_summary = v.comments_summary,
+                    date_processed = v.date_processed
+                FROM (VALUES %s) AS v(id, summary, sentiment_score, sentiment_evidence, sentiment_emotions,
+                                      comments_sentiment_score, comments_summary, date_processed)
+                WHERE a.id = v.id
+            """, articles, template="(%s::int, %s::text, %s::real, %s::text, %s::text, %s::real, %s::text, %s::timestamp)", cur=cur)
+            self.db.execute_values("""
+                UPDATE article_sections AS s
+                SET summary = v.summary, sentiment_score = v.sentiment_score, duplicate_of_id = v.duplicate_of_id,
+                    date_processed = v.date_processed
+                FROM (VALUES %s) AS v(id, summary, sentiment_score, duplicate_of_id, date_processed)
+                WHERE s.id = v.id
+            """, sections, template="(%s::int, %s::text, %s::real, %s::int, %s::timestamp)", cur=cur)
+        logger.info(f"Saved {len(articles)} articles and {len(sections)} article sections")
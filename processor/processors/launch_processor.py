@@ -2,16 +2,28 @@ import concurrent.futures
 import json
 import time
 import threading
+from datetime import datetime
 from typing import Dict, Any, List, Optional, Tuple
-from langchain_community.callbacks.manager import get_openai_callback
 from langchain.prompts import ChatPromptTemplate
 from langchain.output_parsers import PydanticOutputParser
-from langchain.pydantic_v1 import BaseModel, Field
+from langchain.pydantic_v1 import BaseModel, Field, ValidationError
+from langchain_core.exceptions import OutputParserException
 from langchain_core.language_models.base import BaseLanguageModel
+from langchain_core.utils.json import parse_json_markdown
+from psycopg2 import sql
 from shared.utils import DBHelper
 from lib.processor_result import ProcessorResult
+from lib.llm_cache import LLMCache
+from lib.llm_gateway import LLMGateway, InputBudgetError, DEFAULT_COMPANY, DEFAULT_MODEL, DEFAULT_TEMPERATURE
+from lib.llm_batch import BatchRequest, BatchResult, LLMBatches
+from lib.llm_schema import to_tool_schema
+from lib.spec_sheet import PRICE_PATTERN, SpecSheet, extract_spec_sheet
+from lib.model_router import ModelRouter
+from lib.run_budget import BudgetExceeded
+from lib.near_duplicates import ProcessedIndex, get_new_paragraphs
 from loguru import logger
 from shared.lib.llm_usage import LLMUsage
+from shared.lib.llm_tokens import count_tokens, encode, split_tokens
 
 class Car(BaseModel):
     launch_price: int = Field(description="Launch price of the car in USD")
@@ -81,101 +93,173 @@ class Car(BaseModel):
 class Cars(BaseModel):
     """Identifying information about all cars in a text."""
     cars: List[Car]
-    
-DEFAULT_COMPANY = "openai"
-DEFAULT_MODEL = "gpt-3.5-turbo"
 
-class LLM:
-    def __init__(self, model: str, company: str, temperature: str = "0", llm = None):
-        self.model = model
-        self.company = company
-        self.temperature = temperature
-        self.llm = llm
+class SpecSheetCarsParser:
+    """Parses the cars returned by the LLM, filling in the attributes already read from the spec sheet."""
+    def __init__(self, parser: PydanticOutputParser, spec_sheet: SpecSheet):
+        self.parser = parser
+        self.spec_sheet = spec_sheet
+
+    def parse(self, text: str) -> Cars:
+        json_object = parse_json_markdown(text)
+        if not isinstance(json_object, dict):
+            raise OutputParserException(f"Expected a JSON object with the cars, got: {text}")
+        for car in json_object.get("cars", []):
+            for attribute, value in self.spec_sheet.values.items():
+                if car.get(attribute) is None:
+                    car[attribute] = value
+        return self.parser.parse(json.dumps(json_object, ensure_ascii=False))
+
+# Completion tokens reserved when planning an extraction, enough for several variants
+EXTRACTION_OUTPUT_TOKENS = 4096
+# Completion tokens of a typical extraction (about three variants), for cost estimates
+ESTIMATED_EXTRACTION_OUTPUT_TOKENS = 1500
+# Overlap between the chunks of a launch too long for a single call
+CHUNK_OVERLAP_TOKENS = 200
+# Launches at least this similar to an earlier one (revised or reposted launches) reuse its cars
+# and only send the paragraphs that changed
+DUPLICATE_THRESHOLD = 0.8
+# Above this share of changed text a near duplicate is extracted in full, as merging would save little
+MAX_CHANGED_SHARE = 0.5
 
 class LaunchProcessor:
-    def __init__(self, max_workers=1):
+    def __init__(self, max_workers=1, write_batch_size: int = 10, gateway: Optional[LLMGateway] = None, router: Optional[ModelRouter] = None,
+                 batches: Optional[LLMBatches] = None, launch_index: Optional[ProcessedIndex] = None):
         self.db = DBHelper()
         self.parser = PydanticOutputParser(pydantic_object=Cars)
-        self.llms = []
+        self.tool_schema = to_tool_schema(Cars)
+        self.gateway = gateway or LLMGateway(cache=LLMCache())
+        self.batches = batches or LLMBatches(self.gateway)
+        # Without a router every launch goes to the model passed to process()
+        self.router = router
         self.max_workers = max_workers
         self.lock = threading.Lock()
+        self.write_batch_size = write_batch_size
+        self.pending_launches: List[Tuple[int, List[Car], Optional[int]]] = []
+        # Processed launches, to find near duplicates; brought up to date by process()
+        self.launch_index = launch_index if launch_index is not None else ProcessedIndex(DUPLICATE_THRESHOLD)
+        # Launches written since the last process() or ingest, as launches only count as processed once written
+        self.num_saved = 0
         self.llm_usage = LLMUsage(node_title="LaunchProcessor")
 
     def get_llm(self, company_name: str = DEFAULT_COMPANY, model_name: str = DEFAULT_MODEL, temperature: str = "0", max_retries=2) -> BaseLanguageModel:
-        for llm in self.llms:
-            if llm.company == company_name and llm.model == model_name:
-                return llm.llm
-        
-        if (company_name == "openai"):
-            from langchain_openai import ChatOpenAI
-            llm = ChatOpenAI(model=model_name, temperature=temperature, max_retries=max_retries)
-        elif company_name == "groq":
-            from langchain_groq import ChatGroq
-            llm = ChatGroq(model=model_name, temperature=temperature, max_retries=max_retries)
-        elif company_name == "anthropic":
-            from langchain_anthropic import ChatAnthropic
-            llm = ChatAnthropic(model=model_name, temperature=temperature, max_retries=max_retries)
-        else:
-            raise ValueError(f"LLM provider {company_name} not supported")
-        
-        self.llms.append(LLM(model=model_name, company=company_name, temperature=temperature, llm=llm))
-        return llm
+        return self.gateway.get_llm(company_name, model_name, temperature, max_retries)
 
-    def process(self, company_name: str = DEFAULT_COMPANY, model_name: str = DEFAULT_MODEL, num_launches: int = 0) -> ProcessorResult:
+    def process(self, company_name: str = DEFAULT_COMPANY, model_name: str = DEFAULT_MODEL, num_launches: int = 0,
+                launch_ids: Optional[List[int]] = None) -> ProcessorResult:
         result = ProcessorResult(action="process", entity="launches")
-        llm = self.get_llm(company_name, model_name)
-        launches = self._get_unprocessed_launches(num_launches)
+        launches = self._get_unprocessed_launches(num_launches, launch_ids)
+        router = self.router or ModelRouter.fixed(company_name, model_name)
+        self.num_saved = 0
         
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            futures = [executor.submit(self._process_launch, launch, llm, company_name, model_name) for launch in launches]
-            for future in concurrent.futures.as_completed(futures):
-                try:
-                    processed, usage = future.result()
-                    if processed:
-                        with self.lock:
-                            result.items_processed += 1
-                            result.llm_usage.add_usage(usage)
-                except Exception as e:
-                    logger.error(f"Error processing launch: {str(e)}")
+        # Near duplicates of a launch pending in this run wait until it is saved
+        for wave in self._plan_duplicates(launches):
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [executor.submit(self._process_launch, launch, router, original) for launch, original in wave]
+                for future in concurrent.futures.as_completed(futures):
+                    try:
+                        processed, usage = future.result()
+                        if processed:
+                            with self.lock:
+                                result.llm_usage.add_usage(usage)
+                    except Exception as e:
+                        logger.error(f"Error processing launch: {str(e)}")
+            self._flush_launches()
         
+        result.items_processed += self.num_saved
         return result
 
-    def _process_launch(self, launch: Dict[str, Any], llm: BaseLanguageModel, company_name: str, model_name: str) -> Tuple[bool, LLMUsage]:
-        usage = LLMUsage(action="extract_launch_attributes", model_name=model_name)
-        start_time = time.time()
+    def _plan_duplicates(self, launches: List[Dict[str, Any]]) -> List[List[Tuple[Dict[str, Any], Optional[Dict[str, Any]]]]]:
+        """
+        Pair each launch with the earlier launch it nearly duplicates, if any, and split
+        them in two waves: the launches to extract, and the duplicates of those.
+        """
+        # Only the launches processed since the last load, as the index is kept across processors
+        for launch in self._get_processed_launches(self.launch_index.get_load_start()):
+            self.launch_index.load(launch['id'], launch['content'], launch['date_processed'])
+
+        pending = {launch['id']: launch for launch in launches}
+        first_wave, second_wave = [], []
+        for launch in launches:
+            match = self.launch_index.find(launch['content'], exclude=launch['id'])
+            if match is None:
+                self.launch_index.add(launch['id'], launch['content'])
+                first_wave.append((launch, None))
+            elif match[0] in pending:
+                second_wave.append((launch, pending[match[0]]))
+            else:
+                first_wave.append((launch, self._get_launch_by_id(match[0])))
+        num_duplicates = sum(1 for _, original in first_wave + second_wave if original is not None)
+        if num_duplicates:
+            logger.info(f"{num_duplicates} of {len(launches)} launches are near duplicates of earlier launches")
+        return [wave for wave in (first_wave, second_wave) if wave]
+
+    def _process_launch(self, launch: Dict[str, Any], router: ModelRouter, original: Optional[Dict[str, Any]] = None) -> Tuple[bool, LLMUsage]:
+        usage = LLMUsage(node_title="process_launch")
         
         try:
+            if original is not None:
+                cars = self._process_duplicate(launch, original, router, usage)
+                if cars is not None:
+                    self._save_launch(launch['id'], cars, duplicate_of_id=original['id'])
+                    logger.info(f"Launch processed: {launch['id']}")
+                    return True, usage
             logger.info(f"Processing launch {launch['id']} - {launch['title']}...")
-            if company_name == "openai":
-                with get_openai_callback() as cb:
-                    car_attributes = self._extract_car_attributes(launch['content'], llm)
-                usage.token_input = cb.prompt_tokens
-                usage.token_output = cb.completion_tokens
-                usage.cost = cb.total_cost
-            else:
-                car_attributes = self._extract_car_attributes(launch['content'], llm)
-                usage.set_estimated_token_usage_and_cost(company_name, model_name, launch['content'], json.dumps(car_attributes))
-            
-            if car_attributes.cars:
-                for car in car_attributes.cars:
-                    self._save_car_attributes(launch['id'], car.dict())
-            self._mark_launch_as_processed(launch['id'])
+            has_price = PRICE_PATTERN.search(launch['content']) is not None
+            car_attributes = router.run("launch", "extract_launch_attributes", count_tokens(launch['content'], DEFAULT_MODEL),
+                                        lambda route, attempt_usage: self._extract_car_attributes(launch['content'], route.company, route.model, attempt_usage),
+                                        usage, is_confident=lambda output: self._is_confident(output, has_price),
+                                        output_tokens=EXTRACTION_OUTPUT_TOKENS)
+            self._save_launch(launch['id'], car_attributes.cars)
             logger.info(f"Launch processed: {launch['id']}")
-            
-            usage.time = time.time() - start_time
             return True, usage
+        except BudgetExceeded:
+            return False, usage
         except Exception as e:
             logger.error(f"Error processing launch {launch['id']}: {str(e)}")
-            usage.time = time.time() - start_time
             return False, usage
 
+    def _process_duplicate(self, launch: Dict[str, Any], original: Dict[str, Any], router: ModelRouter, usage: LLMUsage) -> Optional[List[Car]]:
+        """
+        Cars of a near duplicate launch: those of the original, updated with what is
+        extracted from the changed paragraphs. None if it has to be extracted in full.
+        """
+        original_cars = self._get_launch_cars(original['id'])
+        if not original_cars:
+            return None
+        changes = get_new_paragraphs(launch['content'], original['content'])
+        if not changes:
+            logger.info(f"Launch {launch['id']} repeats launch {original['id']}, reusing its cars")
+            return original_cars
+        if len(changes) > MAX_CHANGED_SHARE * len(launch['content']):
+            return None
+
+        logger.info(f"Launch {launch['id']} is a near duplicate of launch {original['id']}, extracting only the changed paragraphs")
+        content = f"{launch['title']}\n{changes}"
+        try:
+            car_attributes = router.run("launch", "extract_launch_attributes_changes", count_tokens(content, DEFAULT_MODEL),
+                                        lambda route, attempt_usage: self._extract_car_attributes(content, route.company, route.model, attempt_usage),
+                                        usage, output_tokens=EXTRACTION_OUTPUT_TOKENS)
+        except BudgetExceeded:
+            raise
+        except Exception as e:
+            logger.warning(f"Error extracting the changes of launch {launch['id']}, extracting it in full: {str(e)}")
+            return None
+        # The changes come first, so their values win over the original's
+        return self._merge_cars([car_attributes, Cars(cars=original_cars)]).cars
+
+    @staticmethod
+    def _is_confident(car_attributes: Cars, has_price: bool = True) -> bool:
+        # Every launch has at least one variant with a name, and a price when the post states one
+        return bool(car_attributes.cars) and all(car.full_model_name and car.variant and (car.launch_price > 0 or not has_price)
+                                                 for car in car_attributes.cars)
+
     def test_process(self, launch_ids: List[int], model_name: str, company_name: str) -> Dict[int, Dict[str, Any]]:
         logger.info(f"\nModel {company_name} - {model_name} with launches {launch_ids}\n====================")
-        llm = self.get_llm(company_name, model_name)
         results = {}
         
         with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            futures = {executor.submit(self._test_process_launch, launch_id, llm): launch_id for launch_id in launch_ids}
+            futures = {executor.submit(self._test_process_launch, launch_id, company_name, model_name): launch_id for launch_id in launch_ids}
             for future in concurrent.futures.as_completed(futures):
                 launch_id = futures[future]
                 try:
@@ -186,26 +270,130 @@ class LaunchProcessor:
         
         return results
 
-    def _test_process_launch(self, launch_id: int, llm: BaseLanguageModel) -> Dict[str, Any]:
+    def _test_process_launch(self, launch_id: int, company_name: str, model_name: str) -> Dict[str, Any]:
         launch = self._get_launch_by_id(launch_id)
         if launch:
             logger.info(f"Processing launch {launch_id}...")
-            car_attributes = self._extract_car_attributes(launch['content'], llm)
+            usage = LLMUsage(action="extract_launch_attributes", model_name=model_name)
+            car_attributes = self._extract_car_attributes(launch['content'], company_name, model_name, usage)
             return car_attributes.dict()
         else:
             return {"error": "Launch not found"}
 
-    def _get_unprocessed_launches(self, limit: int = 0) -> List[Dict[str, Any]]:
-        query = """
+    def submit_batch(self, company_name: str = DEFAULT_COMPANY, model_name: str = DEFAULT_MODEL, num_launches: int = 0,
+                     launch_ids: Optional[List[int]] = None) -> ProcessorResult:
+        """
+        Submit the extraction of the unprocessed launches to the Batch API. Launches too
+        long for a single call are left for an interactive run.
+        """
+        result = ProcessorResult(action="submit_batch", entity="launches")
+        router = self.router or ModelRouter.fixed(company_name, model_name)
+        requests = []
+        for launch in self._get_unprocessed_launches(num_launches, launch_ids):
+            route = router.select("launch", count_tokens(launch['content'], DEFAULT_MODEL), EXTRACTION_OUTPUT_TOKENS)
+            request = self._make_batch_request(launch, route.company, route.model)
+            if request:
+                requests.append(request)
+            else:
+                logger.info(f"Launch {launch['id']} does not fit a single call, leaving it for an interactive run")
+        result.items_processed = self.batches.submit("launches", requests)
+        return result
+
+    def _make_batch_request(self, launch: Dict[str, Any], company_name: str, model_name: str) -> Optional[BatchRequest]:
+        try:
+            parser, tool_schema, chunks = self._plan_extraction(launch['content'], model_name)
+        except InputBudgetError:
+            return None
+        if len(chunks) > 1:
+            return None
+        # The spec sheet values are kept with the request, to fill in the cars when the results are ingested
+        return self.gateway.make_batch_request(f"launch-{launch['id']}", self._create_extraction_prompt(), {"content": chunks[0]},
+                                               company_name, model_name, DEFAULT_TEMPERATURE, tool_schema,
+                                               metadata={"entity_ids": [launch['id']], "action": "extract_launch_attributes",
+                                                         "spec_values": parser.spec_sheet.values, "has_price": bool(parser.spec_sheet.prices)})
+
+    def ingest_batches(self, wait: bool = False) -> ProcessorResult:
+        """
+        Save the cars of the finished launch batches. Launches whose request failed or
+        whose output does not parse or look right stay unprocessed for an interactive run.
+        """
+        result = ProcessorResult(action="ingest_batch", entity="launches")
+        self.batches.collect("launches", lambda batch_results: self._ingest_batch_results(batch_results, result), wait)
+        return result
+
+    def _ingest_batch_results(self, batch_results: List[BatchResult], result: ProcessorResult):
+        self.num_saved = 0
+        for batch_result in batch_results:
+            launch_id = batch_result.metadata["entity_ids"][0]
+            result.llm_usage.add_usage(batch_result.usage)
+            if batch_result.error:
+                logger.error(f"Batch request for launch {launch_id} failed: {batch_result.error}")
+                continue
+            try:
+                parser = SpecSheetCarsParser(self.parser, SpecSheet(values=batch_result.metadata.get("spec_values", {})))
+                car_attributes = self.gateway.parse_batch_result(batch_result, parser)
+            except (OutputParserException, ValueError) as e:
+                logger.error(f"Error parsing the batch output for launch {launch_id}: {str(e)}")
+                continue
+            if not self._is_confident(car_attributes, batch_result.metadata.get("has_price", True)):
+                logger.warning(f"Batch output for launch {launch_id} looks wrong, leaving it for an interactive run")
+                continue
+            self._save_launch(launch_id, car_attributes.cars)
+        self._flush_launches()
+        result.items_processed += self.num_saved
+
+    def estimate(self, company_name: str = DEFAULT_COMPANY, model_name: str = DEFAULT_MODEL, num_launches: int = 0,
+                 launch_ids: Optional[List[int]] = None) -> ProcessorResult:
+        """Estimated usage of processing the unprocessed launches, without calling any model."""
+        result = ProcessorResult(action="estimate", entity="launches")
+        router = self.router or ModelRouter.fixed(company_name, model_name)
+        prompt_template = self._create_extraction_prompt()
+        for launch in self._get_unprocessed_launches(num_launches, launch_ids):
+            route = router.select("launch", count_tokens(launch['content'], DEFAULT_MODEL), EXTRACTION_OUTPUT_TOKENS)
+            try:
+                _, tool_schema, chunks = self._plan_extraction(launch['content'], route.model)
+            except InputBudgetError as e:
+                logger.warning(f"Launch {launch['id']} cannot be estimated on {route.model}: {str(e)}")
+                continue
+            action = "extract_launch_attributes" if len(chunks) == 1 else "extract_launch_attributes_chunk"
+            for chunk in chunks:
+                result.llm_usage.add_usage(self.gateway.estimate(prompt_template, {"content": chunk}, route.company, route.model,
+                                                                 ESTIMATED_EXTRACTION_OUTPUT_TOKENS, action, tool_schema=tool_schema))
+            result.items_processed += 1
+        return result
+
+    def _get_unprocessed_launches(self, limit: int = 0, launch_ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+        query = f"""
             SELECT id, title, content
             FROM launches
-            WHERE date_processed IS NULL
+            WHERE date_processed IS NULL AND (%(ids)s IS NULL OR id = ANY(%(ids)s))
+              AND {LLMBatches.get_open_filter("launches", "launches.id")}
             ORDER BY id ASC
         """
         if limit > 0:
             query += f" LIMIT {limit}"
         
-        return self.db.execute_query(query)
+        return self.db.execute_query(query, {"ids": launch_ids})
+
+    def _get_processed_launches(self, since: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        return self.db.execute_query("""
+            SELECT id, content, date_processed
+            FROM launches
+            WHERE date_processed IS NOT NULL AND EXISTS (SELECT 1 FROM cars WHERE cars.launch_id = launches.id)
+              AND (%(since)s::timestamp IS NULL OR date_processed >= %(since)s::timestamp)
+            ORDER BY id ASC
+        """, {"since": since})
+
+    def _get_launch_cars(self, launch_id: int) -> List[Car]:
+        columns = list(Car.__fields__)
+        rows = self.db.execute_query(sql.SQL("SELECT {} FROM cars WHERE launch_id = %s ORDER BY id").format(
+            sql.SQL(", ").join(map(sql.Identifier, columns))
+        ), (launch_id,))
+        try:
+            return [Car(**row) for row in rows]
+        except ValidationError as e:
+            logger.warning(f"Cars of launch {launch_id} cannot be reused: {str(e)}")
+            return []
 
     def _get_launch_by_id(self, launch_id: int) -> Dict[str, Any]:
         launches = self.db.execute_query("""
@@ -215,23 +403,117 @@ class LaunchProcessor:
         """, (launch_id,))
         return launches[0] if launches else None
 
-    def _extract_car_attributes(self, content: str, llm: BaseLanguageModel) -> Dict[str, Any]:
-        prompt_template = ChatPromptTemplate.from_messages(
+    def _create_extraction_prompt(self) -> ChatPromptTemplate:
+        # The instructions and the tool schema never change, so they form a prefix the providers can cache
+        return ChatPromptTemplate.from_messages(
             [
-                ("system", """Extract information about all car variants mentioned in the given text. For each variant, provide a list of attributes as specified below. If an attribute is not mentioned for a specific variant, you can omit it. If any information that should be an integer is provided as a decimal, round to the nearest integer. The information should be retrieved in Spanish. 
-                 
-                 Format instructions:{format_instructions}"""),
+                ("system", """Extract information about all car variants mentioned in the given text and report them with the Cars tool. If an attribute is not mentioned for a specific variant, you can omit it. If any information that should be an integer is provided as a decimal, round to the nearest integer. The information should be retrieved in Spanish. Separate prices for M/T and A/T versions indicate separate car versions with manual and automatic transmissions. A fully combustion engine is 'Combustión' regardless of whether it has turbo or not."""),
                 ("human", "{content}")
             ]
         )
-        
-        chain = prompt_template | llm | self.parser
-        output = chain.invoke({"content":content, "format_instructions": self.parser.get_format_instructions()})
-        return output
 
-    def _save_car_attributes(self, launch_id: int, attributes: Dict[str, Any]):
-        attributes['launch_id'] = launch_id
-        self.db.insert('cars', attributes)
+    def _plan_extraction(self, content: str, model_name: str) -> Tuple[SpecSheetCarsParser, Dict[str, Any], List[str]]:
+        """Parser, tool schema and the contents to send (the chunks, if too long for one call) of an extraction."""
+        # Attributes stated unambiguously in the spec sheet are read with rules; the LLM only gets the rest
+        spec_sheet = extract_spec_sheet(content)
+        parser = SpecSheetCarsParser(self.parser, spec_sheet)
+        tool_schema = to_tool_schema(Cars, exclude=spec_sheet.values.keys()) if spec_sheet.values else self.tool_schema
+        content = spec_sheet.remaining_content
+        if spec_sheet.values:
+            logger.debug(f"Spec sheet provided {len(spec_sheet.values)} attributes, ambiguous: {spec_sheet.ambiguous}")
+
+        budget = self.gateway.get_input_budget(self._create_extraction_prompt(), {"content": ""}, model_name, EXTRACTION_OUTPUT_TOKENS, tool_schema)
+        tokens = encode(content, model_name)
+        if len(tokens) <= budget:
+            return parser, tool_schema, [content]
+        return parser, tool_schema, split_tokens(tokens, budget, model_name, overlap=CHUNK_OVERLAP_TOKENS)
+
+    def _extract_car_attributes(self, content: str, company_name: str, model_name: str, usage: LLMUsage) -> Cars:
+        parser, tool_schema, chunks = self._plan_extraction(content, model_name)
+        prompt_template = self._create_extraction_prompt()
+        if len(chunks) == 1:
+            return self.gateway.invoke(prompt_template, parser, {"content": chunks[0]},
+                                       company_name, model_name, usage, tool_schema=tool_schema)
+
+        # Too long for one call: extract from each chunk and merge the variants found
+        logger.info(f"Launch content is too long for {model_name}, extracting from {len(chunks)} chunks")
+        extractions = []
+        for chunk in chunks:
+            chunk_usage = LLMUsage(action="extract_launch_attributes_chunk", model_name=model_name)
+            start_time = time.time()
+            extractions.append(self.gateway.invoke(prompt_template, parser, {"content": chunk},
+                                                   company_name, model_name, chunk_usage, tool_schema=tool_schema))
+            chunk_usage.time = time.time() - start_time
+            usage.add_usage(chunk_usage)
+        return self._merge_cars(extractions)
+
+    @staticmethod
+    def _merge_cars(extractions: List[Cars]) -> Cars:
+        """Merge the variants extracted from several chunks, filling the attributes each chunk missed."""
+        merged: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for extraction in extractions:
+            for car in extraction.cars:
+                key = (car.full_model_name.strip().lower(), car.variant.strip().lower())
+                attributes = car.dict()
+                if key not in merged:
+                    merged[key] = attributes
+                    continue
+                for attribute, value in attributes.items():
+                    if merged[key].get(attribute) in (None, False, 0, "") and value not in (None, False, 0, ""):
+                        merged[key][attribute] = value
+        return Cars(cars=[Car(**attributes) for attributes in merged.values()])
+
+    def _save_launch(self, launch_id: int, cars: List[Car], duplicate_of_id: Optional[int] = None):
+        with self.lock:
+            self.pending_launches.append((launch_id, cars, duplicate_of_id))
+            if len(self.pending_launches) >= self.write_batch_size:
+                self._write_pending_launches()
+
+    def _flush_launches(self):
+        """Write the pending launches. Those that cannot be written are logged and stay unprocessed for a later run."""
+        with self.lock:
+            self._write_pending_launches()
+            if self.pending_launches:
+                logger.error(f"Launches {[launch_id for launch_id, _, _ in self.pending_launches]} could not be saved, they stay unprocessed")
+                self.pending_launches = []
+
+    def _write_pending_launches(self):
+        # Called with self.lock held. Launches leave the buffer, and count as saved, only once committed.
+        # If a batch fails, its launches are written one by one, so that one bad launch does not hold back
+        # the rest; those that still fail stay in the buffer for the next write.
+        if not self.pending_launches:
+            return
+        try:
+            self._write_launches(self.pending_launches)
+            self.num_saved += len(self.pending_launches)
+            self.pending_launches = []
+            return
+        except Exception as e:
+            logger.error(f"Error saving {len(self.pending_launches)} launches, saving them one by one: {str(e)}")
+        failed = []
+        for launch in self.pending_launches:
+            try:
+                self._write_launches([launch])
+                self.num_saved += 1
+            except Exception as e:
+                logger.error(f"Error saving launch {launch[0]}: {str(e)}")
+                failed.append(launch)
+        self.pending_launches = failed
 
-    def _mark_launch_as_processed(self, launch_id: int):
-        self.db.update('launches', {'id': launch_id}, {'date_processed': 'NOW()'})
\ No newline at end of file
+    def _write_launches(self, launches: List[Tuple[int, List[Car], Optional[int]]]):
+        # The cars of each launch and its date_processed are written in the same transaction, and cars
+        # left by an earlier run are replaced, so a launch is never stored twice.
+        launch_ids = [launch_id for launch_id, _, _ in launches]
+        columns = ["launch_id"] + list(Car.__fields__)
+        rows = [(launch_id, *car.dict().values()) for launch_id, cars, _ in launches for car in cars]
+        with self.db.get_cursor() as cur:
+            cur.execute("DELETE FROM cars WHERE launch_id = ANY(%s)", (launch_ids,))
+            self.db.execute_values(sql.SQL("INSERT INTO cars ({}) VALUES %s").format(
+                sql.SQL(", ").join(map(sql.Identifier, columns))
+            ), rows, cur=cur)
+            self.db.execute_values("""
+                UPDATE launches SET date_processed = NOW(), duplicate_of_id = v.duplicate_of_id
+                FROM (VALUES %s) AS v(id, duplicate_of_id)
+                WHERE launches.id = v.id
+            """, [(launch_id, duplicate_of_id) for launch_id, _, duplicate_of_id in launches], template="(%s, %s::integer)", cur=cur)
+        logger.info(f"Saved {len(rows)} cars from {len(launches)} launches")
@@ -0,0 +1,28 @@
+import unittest
+import sys
+import os
+
+# Add the processor directory (for lib, connectors and processors) and the repository root (for shared) to the Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_dir)
+sys.path.append(os.path.dirname(current_dir))
+
+if __name__ == '__main__':
+    # Get the directory containing the tests
+    test_dir = os.path.join(current_dir, 'tests')
+
+    # Discover all tests in the tests directory
+    test_suite = unittest.defaultTestLoader.discover(
+        start_dir=test_dir,
+        pattern='test*.py',
+        top_level_dir=current_dir
+    )
+
+    # Create a test runner
+    runner = unittest.TextTestRunner(verbosity=2)
+
+    # Run the tests
+    result = runner.run(test_suite)
+
+    # Exit with a non-zero code if there were failures
+    sys.exit(not result.wasSuccessful())
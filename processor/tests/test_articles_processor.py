@@ -0,0 +1,165 @@
+import concurrent.futures
+import json
+import unittest
+from contextlib import contextmanager
+from unittest import mock
+from lib.llm_batch import BatchResult
+from lib.run_budget import BudgetExceeded
+from processors.articles_processor import ArticleAnalysis, ArticlesProcessor, SectionAnalysis, SectionAnalysisItem
+
+ARTICLE_ANALYSIS = {"summary": "Un buen auto", "sentiment_score": 0.5, "sentiment_evidence": ["Muy bueno"],
+                    "sentiment_emotions": ["alegría", "sorpresa", "confianza"], "comments_sentiment_score": 0.2,
+                    "comments_summary": "Les gusta"}
+
+class FakeDB:
+    """Records the rows of each committed write; a transaction with any row of bad_ids fails."""
+    def __init__(self, bad_ids=(), sections=()):
+        self.bad_ids = set(bad_ids)
+        self.sections = list(sections)
+        self.written = []
+
+    def execute_query(self, query, params=None):
+        if "FROM article_sections" in query and "article_id" in query:
+            return self.sections
+        return []
+
+    @contextmanager
+    def get_cursor(self):
+        cur = []
+        yield cur
+        self.written += cur
+
+    def execute_values(self, query, rows, template=None, fetch=False, page_size=100, cur=None):
+        if self.bad_ids & {row[0] for row in rows}:
+            raise ValueError("invalid input syntax")
+        cur.append((query.split()[1], rows))
+        return []
+
+    def get_written(self, table: str):
+        return [row[0] for written_table, rows in self.written if written_table == table for row in rows]
+
+def article_result(article_id: int, num_section_requests: int, error: str = None) -> BatchResult:
+    return BatchResult(custom_id=f"article-{article_id}", completion=json.dumps(ARTICLE_ANALYSIS), error=error,
+                       metadata={"entity_ids": [article_id], "action": "process_article", "num_section_requests": num_section_requests})
+
+def sections_result(article_id: int, index: int, section_ids, analyzed_ids=None) -> BatchResult:
+    sections = [{"section_id": section_id, "summary": "Bien", "sentiment_score": 0.1}
+                for section_id in (section_ids if analyzed_ids is None else analyzed_ids)]
+    return BatchResult(custom_id=f"sections-{article_id}-{index}", completion=json.dumps({"sections": sections}),
+                       metadata={"entity_ids": [article_id], "action": "process_article_sections_batch", "section_ids": section_ids})
+
+class TestArticlesBatchIngestion(unittest.TestCase):
+    def setUp(self):
+        self.db = FakeDB()
+        gateway = mock.Mock()
+        gateway.parse_batch_result.side_effect = lambda result, parser: parser.parse(result.completion)
+        with mock.patch("processors.articles_processor.DBHelper", return_value=self.db):
+            self.processor = ArticlesProcessor(gateway=gateway, batches=mock.Mock())
+
+    def ingest(self, batch_results):
+        result = mock.Mock(items_processed=0)
+        self.processor._ingest_batch_results(batch_results, result)
+        return result.items_processed, self.db.get_written("articles"), self.db.get_written("article_sections")
+
+    def test_article_with_all_sections(self):
+        self.assertEqual(self.ingest([sections_result(1, 0, [10, 11]), article_result(1, 2), sections_result(1, 1, [12])]),
+                         (1, [1], [10, 11, 12]))
+
+    def test_failed_sections_request(self):
+        failed = sections_result(1, 1, [12])
+        failed.error = "500: server error"
+        self.assertEqual(self.ingest([article_result(1, 2), sections_result(1, 0, [10, 11]), failed]), (0, [], []))
+
+    def test_missing_sections(self):
+        # A sections request that never came back, and one whose output leaves out a section
+        self.assertEqual(self.ingest([article_result(1, 2), sections_result(1, 0, [10, 11])]), (0, [], []))
+        self.assertEqual(self.ingest([article_result(2, 1), sections_result(2, 0, [20, 21], analyzed_ids=[20])]), (0, [], []))
+
+    def test_failed_article_request(self):
+        self.assertEqual(self.ingest([article_result(1, 1, error="500: server error"), sections_result(1, 0, [10]),
+                                      article_result(2, 0)]), (1, [2], []))
+
+class TestArticleWrites(unittest.TestCase):
+    def create_processor(self, bad_ids=()):
+        db = FakeDB(bad_ids)
+        with mock.patch("processors.articles_processor.DBHelper", return_value=db):
+            return ArticlesProcessor(write_batch_size=2, gateway=mock.Mock(), batches=mock.Mock()), db
+
+    def save(self, processor, article_id, section_ids=()):
+        processor._save_updates(processor._make_article_row(article_id, ARTICLE_ANALYSIS),
+                                [processor._make_section_row(section_id, {"summary": "Bien", "sentiment_score": 0.1}) for section_id in section_ids])
+
+    def test_batched_writes(self):
+        processor, db = self.create_processor()
+        self.save(processor, 1, [10])
+        processor._save_updates(None, [processor._make_section_row(20, {"summary": "Bien", "sentiment_score": 0.1})])
+        self.assertEqual(db.written, [])
+        self.save(processor, 3)
+        self.assertEqual((db.get_written("articles"), db.get_written("article_sections"), processor.num_saved), ([1, 3], [10, 20], 2))
+        self.assertEqual(processor.pending_updates, [])
+
+    def test_failed_write(self):
+        processor, db = self.create_processor(bad_ids=[11])
+        # The article whose section fails is kept for the next write, without holding back the others
+        self.save(processor, 1, [10, 11])
+        self.save(processor, 2, [20])
+        self.assertEqual((db.get_written("articles"), db.get_written("article_sections"), processor.num_saved), ([2], [20], 1))
+        self.assertEqual([article_row[0] for article_row, _ in processor.pending_updates], [1])
+        # Saved only together with its sections, and dropped after the last write of the run
+        self.save(processor, 3)
+        processor._flush_updates()
+        self.assertEqual((db.get_written("articles"), db.get_written("article_sections"), processor.num_saved), ([2, 3], [20], 2))
+        self.assertEqual(processor.pending_updates, [])
+
+class FakeRouter:
+    """Answers every section in the batched call except the failed ones, which fail on their own call too."""
+    def __init__(self, failed_ids=(), budget_exceeded=False):
+        self.failed_ids = set(failed_ids)
+        self.budget_exceeded = budget_exceeded
+        self.actions = []
+
+    def run(self, task, action, input_tokens, call, usage, **kwargs):
+        self.actions.append(action)
+        if action == "process_article":
+            return ArticleAnalysis(**ARTICLE_ANALYSIS)
+        if self.budget_exceeded:
+            raise BudgetExceeded("Run budget exhausted")
+        section_ids = [int(title.split()[-1]) for title in kwargs["section_titles"]]
+        if action == "process_article_sections_batch":
+            return {section_id: SectionAnalysisItem(section_id=section_id, summary="Bien", sentiment_score=0.1)
+                    for section_id in section_ids if section_id not in self.failed_ids}
+        if section_ids[0] in self.failed_ids:
+            raise ValueError("Invalid json output")
+        return SectionAnalysis(summary="Bien", sentiment_score=0.1)
+
+class TestArticleSections(unittest.TestCase):
+    def process(self, router: FakeRouter, section_ids=(10, 11, 12)):
+        self.db = FakeDB(sections=[{"id": section_id, "title": f"Sección {section_id}", "content": f"Contenido de la sección {section_id}"}
+                                   for section_id in section_ids])
+        with mock.patch("processors.articles_processor.DBHelper", return_value=self.db):
+            processor = ArticlesProcessor(gateway=mock.Mock(), batches=mock.Mock())
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as processor.section_executor, \
+             mock.patch("processors.articles_processor.count_tokens", lambda text, model_name: len(text.split())):
+            processed = processor._process_article_and_sections({"id": 1, "title": "Prueba", "content": "Muy bueno", "comments": None}, router)
+        processor._flush_updates()
+        return processed, processor.num_saved, self.db.get_written("articles"), self.db.get_written("article_sections")
+
+    def test_all_sections_analyzed(self):
+        self.assertEqual(self.process(FakeRouter()), (True, 1, [1], [10, 11, 12]))
+
+    def test_budget_exceeded(self):
+        # Neither the batched call nor the fallback analyzes any section: the article is retried on the next run
+        router = FakeRouter(budget_exceeded=True)
+        self.assertEqual(self.process(router), (False, 0, [], []))
+        self.assertEqual(router.actions, ["process_article", "process_article_sections_batch"] + ["process_article_section"] * 3)
+
+    def test_failed_section(self):
+        # The analyzed sections are saved, the article only once its last section is
+        self.assertEqual(self.process(FakeRouter(failed_ids=[11])), (False, 0, [], [10, 12]))
+
+    def test_single_section(self):
+        self.assertEqual(self.process(FakeRouter(), section_ids=[10]), (True, 1, [1], [10]))
+        self.assertEqual(self.process(FakeRouter(failed_ids=[10]), section_ids=[10]), (False, 0, [], []))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import os
+import unittest
+import psycopg2
+from dotenv import load_dotenv
+from shared.utils import DBHelper
+from lib.job_queue import JobQueue
+
+STAGE = "test_job_queue"
+
+class TestJobQueue(unittest.TestCase):
+    """Runs against the database of the .env file, in jobs of a stage of its own."""
+    @classmethod
+    def setUpClass(cls):
+        load_dotenv()
+        if not os.getenv("DB_NAME"):
+            raise unittest.SkipTest("Create a .env file with test database credentials to test the job queue")
+        try:
+            cls.db = DBHelper()
+        except psycopg2.OperationalError as e:
+            raise unittest.SkipTest(f"Test database not available: {str(e)}")
+
+    def setUp(self):
+        self.db.execute_query("DELETE FROM jobs WHERE stage = %s", (STAGE,))
+        self.addCleanup(self.db.execute_query, "DELETE FROM jobs WHERE stage = %s", (STAGE,))
+
+    def create_queue(self, worker_id: str, max_attempts: int = 3) -> JobQueue:
+        queue = JobQueue(worker_id=worker_id, lease_seconds=600, max_attempts=max_attempts)
+        queue.enqueue(STAGE, "SELECT generate_series(1, 5) AS id")
+        return queue
+
+    def get_job(self, entity_id: int):
+        return self.db.execute_query("SELECT status, attempts, worker_id FROM jobs WHERE stage = %s AND entity_id = %s",
+                                     (STAGE, entity_id))[0]
+
+    def expire_leases(self):
+        self.db.execute_query("UPDATE jobs SET lease_expires_at = NOW() - INTERVAL '1 second' WHERE stage = %s AND status = 'running'",
+                              (STAGE,))
+
+    def test_enqueue_once(self):
+        queue = self.create_queue("a")
+        self.assertEqual(queue.enqueue(STAGE, "SELECT generate_series(1, 6) AS id"), 1)
+        # Done jobs are reopened when their entity is pending again
+        queue.complete(queue.claim(STAGE, 1))
+        self.assertEqual(queue.enqueue(STAGE, "SELECT 1 AS id"), 1)
+        self.assertEqual(self.get_job(1)["status"], "pending")
+
+    def test_claim_in_order_skipping_locked(self):
+        first, second = self.create_queue("a"), self.create_queue("b")
+        self.assertEqual([job.entity_id for job in first.claim(STAGE, 2)], [1, 2])
+        self.assertEqual([job.entity_id for job in second.claim(STAGE, 2)], [3, 4])
+        # A job locked by another transaction is skipped rather than waited for
+        conn = self.db._pool.getconn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT id FROM jobs WHERE stage = %s AND entity_id = 5 FOR UPDATE", (STAGE,))
+                self.assertEqual(first.claim(STAGE, 2), [])
+            conn.rollback()
+        finally:
+            self.db._pool.putconn(conn)
+        self.assertEqual([job.entity_id for job in first.claim(STAGE, 2)], [5])
+        self.assertEqual(first.claim(STAGE, 2), [])
+
+    def test_take_over_expired_lease(self):
+        first, second = self.create_queue("a"), self.create_queue("b")
+        jobs = first.claim(STAGE, 1)
+        self.assertEqual([job.entity_id for job in second.claim(STAGE, 1)], [2])
+        self.expire_leases()
+        taken = [job for job in second.claim(STAGE, 5) if job.entity_id in (1, 2)]
+        self.assertEqual([(job.entity_id, job.attempts) for job in taken], [(1, 2), (2, 2)])
+        # The worker that lost the lease can no longer complete its job
+        first.complete(jobs)
+        self.assertEqual(self.get_job(1), {"status": "running", "attempts": 2, "worker_id": "b"})
+
+    def test_expired_lease_without_attempts_left(self):
+        queue = self.create_queue("a", max_attempts=1)
+        queue.claim(STAGE, 1)
+        self.expire_leases()
+        self.assertNotIn(1, [job.entity_id for job in queue.claim(STAGE, 5)])
+        self.assertEqual(self.get_job(1)["status"], "dead")
+
+    def test_fail_until_dead(self):
+        queue = self.create_queue("a", max_attempts=2)
+        queue.fail(queue.claim(STAGE, 1), "Error")
+        self.assertEqual(self.get_job(1), {"status": "pending", "attempts": 1, "worker_id": "a"})
+        jobs = queue.claim(STAGE, 1)
+        self.assertEqual([(job.entity_id, job.attempts) for job in jobs], [(1, 2)])
+        queue.fail(jobs, "Error")
+        self.assertEqual(self.get_job(1)["status"], "dead")
+        self.assertEqual(queue.claim(STAGE, 1)[0].entity_id, 2)
+
+    def test_release_does_not_count(self):
+        queue = self.create_queue("a")
+        queue.release(queue.claim(STAGE, 1))
+        self.assertEqual(self.get_job(1), {"status": "pending", "attempts": 0, "worker_id": None})
+
+    def test_retry_dead(self):
+        queue = self.create_queue("a", max_attempts=1)
+        queue.fail(queue.claim(STAGE, 2), "Error")
+        self.assertEqual(queue.retry_dead("other_stage"), 0)
+        self.assertEqual(queue.retry_dead(STAGE), 2)
+        self.assertEqual(self.get_job(1)["status"], "pending")
+        self.assertEqual([(job.entity_id, job.attempts) for job in queue.claim(STAGE, 1)], [(1, 1)])
+        self.assertEqual(queue.get_counts()[STAGE], {"pending": 4, "running": 1})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import unittest
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from unittest import mock
+from lib.near_duplicates import ProcessedIndex, RELOAD_OVERLAP
+from lib.model_router import ModelRouter
+from processors.launch_processor import DUPLICATE_THRESHOLD, LaunchProcessor, Car, Cars
+
+class FakeCursor:
+    def __init__(self):
+        self.launch_ids = []
+
+    def execute(self, query, params=None):
+        pass
+
+class FakeDB:
+    """Commits the launches written in a transaction, which fails if it includes any of bad_ids."""
+    def __init__(self, bad_ids=(), processed=()):
+        self.bad_ids = set(bad_ids)
+        self.saved = []
+        # Processed launches, and the date from which each load read them
+        self.processed = list(processed)
+        self.loads = []
+
+    def execute_query(self, query, params=None):
+        if "date_processed IS NOT NULL" in query:
+            self.loads.append(params["since"])
+            return [launch for launch in self.processed if params["since"] is None or launch["date_processed"] >= params["since"]]
+        if "WHERE id = %s" in query:
+            return [launch for launch in self.processed if launch["id"] == params[0]]
+        return []
+
+    @contextmanager
+    def get_cursor(self):
+        cur = FakeCursor()
+        yield cur
+        self.saved += cur.launch_ids
+
+    def execute_values(self, query, rows, template=None, fetch=False, page_size=100, cur=None):
+        if "UPDATE launches" in query:
+            launch_ids = [launch_id for launch_id, _ in rows]
+            if self.bad_ids & set(launch_ids):
+                raise ValueError("invalid input syntax")
+            cur.launch_ids += launch_ids
+        return []
+
+class TestLaunchWrites(unittest.TestCase):
+    def create_processor(self, bad_ids=()):
+        db = FakeDB(bad_ids)
+        with mock.patch("processors.launch_processor.DBHelper", return_value=db):
+            return LaunchProcessor(write_batch_size=3, gateway=mock.Mock(), batches=mock.Mock()), db
+
+    def save(self, processor, launch_ids):
+        for launch_id in launch_ids:
+            processor._save_launch(launch_id, [Car(full_model_name="Renault Kwid", variant="Zen", launch_price=15990,
+                                                  body_type="Hatchback", origin_country="Brasil")])
+
+    def test_batched_writes(self):
+        processor, db = self.create_processor()
+        self.save(processor, [1, 2, 3, 4])
+        self.assertEqual((db.saved, processor.num_saved), ([1, 2, 3], 3))
+        processor._flush_launches()
+        self.assertEqual((db.saved, processor.num_saved, processor.pending_launches), ([1, 2, 3, 4], 4, []))
+
+    def test_failed_write(self):
+        processor, db = self.create_processor(bad_ids=[2])
+        # The launch that fails is kept for the next write, without holding back the others
+        self.save(processor, [1, 2, 3])
+        self.assertEqual((db.saved, processor.num_saved), ([1, 3], 2))
+        self.assertEqual([launch_id for launch_id, _, _ in processor.pending_launches], [2])
+        self.save(processor, [4])
+        processor._flush_launches()
+        self.assertEqual((db.saved, processor.num_saved, processor.pending_launches), ([1, 3, 4], 3, []))
+
+class TestLaunchConfidence(unittest.TestCase):
+    def extract(self, content: str, launch_price: int):
+        with mock.patch("processors.launch_processor.DBHelper", return_value=FakeDB()):
+            processor = LaunchProcessor(gateway=mock.Mock(), batches=mock.Mock())
+        cars = Cars(cars=[Car(full_model_name="Renault Kwid", variant="Zen", launch_price=launch_price,
+                              body_type="Hatchback", origin_country="Brasil")])
+        models = []
+
+        def extract_car_attributes(content, company_name, model_name, usage):
+            models.append(model_name)
+            return cars
+
+        processor._extract_car_attributes = extract_car_attributes
+        # Counted in words, as the tokenizer's encodings are downloaded on first use
+        with mock.patch("processors.launch_processor.count_tokens", lambda text, model_name: len(text.split())):
+            processed, _ = processor._process_launch({"id": 1, "title": "Renault Kwid", "content": content},
+                                                     ModelRouter(accuracy_path=None))
+        self.assertTrue(processed)
+        return models
+
+    def test_missing_price(self):
+        # Without a price in the post, a car without price is not a reason to escalate
+        self.assertEqual(self.extract("Llega el nuevo Renault Kwid, con precio a confirmar", 0), ["gpt-3.5-turbo"])
+        self.assertEqual(self.extract("Llega el nuevo Renault Kwid a US$ 15.990", 0), ["gpt-3.5-turbo", "gpt-4o"])
+        self.assertEqual(self.extract("Llega el nuevo Renault Kwid a US$ 15.990", 15990), ["gpt-3.5-turbo"])
+
+    def test_is_confident(self):
+        car = Car(full_model_name="Renault Kwid", variant="Zen", launch_price=0, body_type="Hatchback", origin_country="Brasil")
+        self.assertFalse(LaunchProcessor._is_confident(Cars(cars=[car])))
+        self.assertTrue(LaunchProcessor._is_confident(Cars(cars=[car]), has_price=False))
+        self.assertFalse(LaunchProcessor._is_confident(Cars(cars=[]), has_price=False))
+        car.variant = ""
+        self.assertFalse(LaunchProcessor._is_confident(Cars(cars=[car]), has_price=False))
+
+def make_launch(launch_id: int, text: str, days_ago: int = 0):
+    return {"id": launch_id, "title": f"Launch {launch_id}", "content": " ".join(f"{text} palabra{i}" for i in range(100)),
+            "date_processed": datetime(2024, 5, 1) - timedelta(days=days_ago)}
+
+class TestLaunchDuplicates(unittest.TestCase):
+    def test_index_kept_across_processors(self):
+        db = FakeDB(processed=[make_launch(1, "kwid", days_ago=2), make_launch(2, "gol", days_ago=1)])
+        index = ProcessedIndex(DUPLICATE_THRESHOLD)
+        with mock.patch("processors.launch_processor.DBHelper", return_value=db):
+            first = LaunchProcessor(gateway=mock.Mock(), batches=mock.Mock(), launch_index=index)
+            second = LaunchProcessor(gateway=mock.Mock(), batches=mock.Mock(), launch_index=index)
+
+        waves = first._plan_duplicates([make_launch(3, "kwid"), make_launch(4, "onix")])
+        self.assertEqual([(launch["id"], original and original["id"]) for launch, original in waves[0]], [(3, 1), (4, None)])
+        # A later processor sharing the index only reads the launches processed since the previous load
+        db.processed += [make_launch(4, "onix"), make_launch(5, "208")]
+        waves = second._plan_duplicates([make_launch(6, "onix"), make_launch(7, "208")])
+        self.assertEqual(db.loads, [None, datetime(2024, 4, 30) - RELOAD_OVERLAP])
+        self.assertEqual([(launch["id"], original and original["id"]) for launch, original in waves[0]], [(6, 4), (7, 5)])
+        self.assertEqual(len(index), 4)
+
+if __name__ == '__main__':
+    unittest.main()
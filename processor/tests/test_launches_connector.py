@@ -0,0 +1,26 @@
+import unittest
+from connectors.launches_connector import LaunchesConnector
+
+# Normalized names of car models, as the trigram matcher returns them
+CAR_MODELS = [(1, "chery tiggo 4"), (2, "chery tiggo 4 pro"), (3, "chery tiggo 8 pro"), (4, "volkswagen t cross"), (5, "renault kwid")]
+
+class TestLaunchesConnector(unittest.TestCase):
+    def select(self, full_model_name: str, car_model_ids):
+        candidates = [(car_model_id, name, 1.0) for car_model_id, name in CAR_MODELS if car_model_id in car_model_ids]
+        return LaunchesConnector._select_car_model(full_model_name, candidates)
+
+    def test_car_model_within_name(self):
+        self.assertEqual(self.select("Volkswagen T-Cross 200 TSI Highline", {4}), 4)
+        self.assertEqual(self.select("Renault Kwid Outsider", {5}), 5)
+
+    def test_longest_car_model(self):
+        self.assertEqual(self.select("Chery Tiggo 4 Pro 1.5T", {1, 2, 3}), 2)
+        self.assertEqual(self.select("Chery Tiggo 4 1.5", {1, 2, 3}), 1)
+
+    def test_similar_car_model(self):
+        self.assertIsNone(self.select("Chery Tiggo 5", {1, 2}))
+        self.assertIsNone(self.select("Chery Tiggo 7 Pro", {2, 3}))
+        self.assertIsNone(self.select("Renault Kwi", {5}))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import itertools
+import os
+import tempfile
+import unittest
+from unittest import mock
+from langchain_core.prompts import ChatPromptTemplate
+from lib.llm_cache import LLMCache, LLMCacheMiss
+
+def make_prompt(system: str = "Summarize in Spanish") -> ChatPromptTemplate:
+    return ChatPromptTemplate.from_messages([("system", system), ("human", "{content}")])
+
+class TestLLMCache(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "completions.sqlite")
+        # A clock that always moves forward, so the least recently used entry is never a tie
+        clock = mock.patch("lib.llm_cache.time.time", side_effect=itertools.count(1000.0))
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def create_cache(self, **kwargs) -> LLMCache:
+        cache = LLMCache(path=self.path, **kwargs)
+        self.addCleanup(cache.conn.close)
+        return cache
+
+    def test_key_stability(self):
+        cache = self.create_cache()
+        key = cache.make_key("openai", "gpt-4o-mini", "0", make_prompt(), {"content": "Hola", "format_instructions": "JSON"})
+        # The same request in another process, with its input built in another order
+        other = self.create_cache()
+        self.assertEqual(other.make_key("openai", "gpt-4o-mini", "0", make_prompt(), {"format_instructions": "JSON", "content": "Hola"}), key)
+        different = [
+            cache.make_key("fake", "gpt-4o-mini", "0", make_prompt(), {"content": "Hola", "format_instructions": "JSON"}),
+            cache.make_key("openai", "gpt-4o", "0", make_prompt(), {"content": "Hola", "format_instructions": "JSON"}),
+            cache.make_key("openai", "gpt-4o-mini", "0.5", make_prompt(), {"content": "Hola", "format_instructions": "JSON"}),
+            cache.make_key("openai", "gpt-4o-mini", "0", make_prompt("Summarize in English"), {"content": "Hola", "format_instructions": "JSON"}),
+            cache.make_key("openai", "gpt-4o-mini", "0", make_prompt(), {"content": "Chau", "format_instructions": "JSON"}),
+            cache.make_key("openai", "gpt-4o-mini", "0", make_prompt(), {"content": "Hola", "format_instructions": "JSON"},
+                           tool_schema={"name": "extract_cars"}),
+        ]
+        self.assertEqual(len(set(different + [key])), len(different) + 1)
+
+    def test_get_and_put(self):
+        cache = self.create_cache()
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", "openai", "gpt-4o-mini", "completion", token_input=10, token_output=5, cost=0.01)
+        cached = cache.get("a")
+        self.assertEqual((cached.completion, cached.token_input, cached.token_output, cached.cost), ("completion", 10, 5, 0.01))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        # Replacing an entry does not count its size twice, and the size is read back on open
+        cache.put("a", "openai", "gpt-4o-mini", "other completion")
+        self.assertEqual(cache.size, len("other completion"))
+        self.assertEqual(self.create_cache().size, len("other completion"))
+
+    def test_lru_eviction(self):
+        cache = self.create_cache()
+        cache.max_size = 1000
+        for key in "abc":
+            cache.put(key, "openai", "gpt-4o-mini", key * 300)
+        # Reading "a" makes "b" the least recently used entry
+        cache.get("a")
+        cache.put("d", "openai", "gpt-4o-mini", "d" * 300)
+        self.assertEqual([key for key in "abcd" if cache.contains(key)], ["a", "c", "d"])
+        self.assertEqual(cache.size, 900)
+        # Evicted down to 90% of the budget, not just below it
+        cache.put("e", "openai", "gpt-4o-mini", "e" * 500)
+        self.assertEqual([key for key in "abcde" if cache.contains(key)], ["d", "e"])
+        self.assertLessEqual(cache.size, 900)
+
+    def test_cache_only_miss(self):
+        self.create_cache().put("a", "openai", "gpt-4o-mini", "completion")
+        cache = self.create_cache(cache_only=True)
+        self.assertEqual(cache.get("a").completion, "completion")
+        with self.assertRaises(LLMCacheMiss):
+            cache.get("b")
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        # contains() checks without raising or counting
+        self.assertFalse(cache.contains("b"))
+        self.assertEqual(cache.misses, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import concurrent.futures
+import unittest
+from unittest import mock
+from langchain_core.messages import HumanMessage
+from langchain_core.prompts import ChatPromptTemplate
+from lib.llm_gateway import InputBudgetError, LLMGateway, MESSAGE_OVERHEAD_TOKENS
+from lib.llm_scheduler import DEFAULT_RATE_LIMITS, LLMScheduler
+from shared.lib.llm_usage import LLMUsage
+
+def count_words(text: str, model_name: str = "") -> int:
+    return len(text.split())
+
+class TestInputBudget(unittest.TestCase):
+    def setUp(self):
+        self.gateway = LLMGateway(scheduler=mock.Mock())
+        self.prompt = ChatPromptTemplate.from_messages([("system", "Summarize in {max_words} words"), ("human", "{content}")])
+        patcher = mock.patch("lib.llm_gateway.count_tokens", count_words)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_budget(self):
+        budget = self.gateway.get_input_budget(self.prompt, {"content": "", "max_words": 100}, "llama3-8b-8192", 1000)
+        self.assertEqual(budget, 8192 - 4 - 2 * MESSAGE_OVERHEAD_TOKENS - 1000)
+
+    def test_no_room_for_input(self):
+        with self.assertRaises(InputBudgetError):
+            self.gateway.get_input_budget(self.prompt, {"content": "", "max_words": 100}, "llama3-8b-8192", 8192)
+        # A ValueError, so that ModelRouter.run escalates to a stronger model
+        self.assertTrue(issubclass(InputBudgetError, ValueError))
+
+class TestFakeProvider(unittest.TestCase):
+    def test_scheduled_in_fake_lane(self):
+        scheduler = mock.Mock()
+        future = concurrent.futures.Future()
+        future.set_result("completion")
+        scheduler.submit.return_value = future
+        gateway = LLMGateway(scheduler=scheduler, provider="fake")
+        with mock.patch("lib.llm_gateway.count_tokens", count_words):
+            self.assertEqual(gateway._complete([HumanMessage(content="Hola")], "openai", "gpt-4o-mini", "0", LLMUsage()), "completion")
+        self.assertEqual(scheduler.submit.call_args.args[:2], ("fake", "gpt-4o-mini"))
+
+    def test_fake_lane_limits(self):
+        lane = LLMScheduler()._get_lane("fake", "gpt-4o")
+        requests_per_minute, tokens_per_minute = DEFAULT_RATE_LIMITS["openai"]["gpt-4o"]
+        self.assertGreater(lane.requests.rate_per_minute, 100 * requests_per_minute)
+        self.assertGreater(lane.tokens.rate_per_minute, 100 * tokens_per_minute)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import asyncio
+import time
+import unittest
+from unittest import mock
+import httpx
+import openai
+from lib.llm_scheduler import DEFAULT_RATE_LIMITS, LLMScheduler, ModelLane, TokenBucket, is_rate_limit_error
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+class TestIsRateLimitError(unittest.TestCase):
+    def test_provider_errors(self):
+        response = httpx.Response(429, request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+        self.assertTrue(is_rate_limit_error(openai.RateLimitError("Rate limit reached", response=response, body=None)))
+        error = Exception("Server error")
+        error.status_code = 429
+        self.assertTrue(is_rate_limit_error(error))
+
+    def test_wrapped_error(self):
+        error = Exception("Server error")
+        error.status_code = 429
+        try:
+            try:
+                raise error
+            except Exception as e:
+                raise ValueError("Could not invoke the model") from e
+        except ValueError as e:
+            self.assertTrue(is_rate_limit_error(e))
+
+    def test_other_errors(self):
+        self.assertFalse(is_rate_limit_error(ValueError("Expected 429 tokens, got 430")))
+        self.assertFalse(is_rate_limit_error(Exception("rate limit of the parser")))
+
+class TestTokenBucket(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch("lib.llm_scheduler.time.monotonic", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_refill(self):
+        bucket = TokenBucket(60)
+        asyncio.run(bucket.acquire(60))
+        self.assertEqual(bucket.available, 0)
+        self.clock.now += 30
+        asyncio.run(bucket.acquire(10))
+        self.assertAlmostEqual(bucket.available, 20)
+        # Never above one minute worth of capacity
+        self.clock.now += 600
+        bucket.adjust(0)
+        self.assertAlmostEqual(bucket.available, 60)
+
+    def test_adjust(self):
+        bucket = TokenBucket(60)
+        asyncio.run(bucket.acquire(50))
+        bucket.adjust(30)
+        self.assertAlmostEqual(bucket.available, -20)
+
+    def test_set_rate(self):
+        bucket = TokenBucket(60)
+        bucket.set_rate(30)
+        self.assertEqual((bucket.rate_per_minute, bucket.capacity, bucket.available), (30, 30, 30))
+        bucket.set_rate(1000)
+        self.assertEqual(bucket.rate_per_minute, 60)
+        bucket.set_rate(0)
+        self.assertEqual(bucket.rate_per_minute, 1)
+
+class TestTokenBucketWait(unittest.TestCase):
+    def test_acquire_waits_for_refill(self):
+        bucket = TokenBucket(60000)
+        asyncio.run(bucket.acquire(60000))
+        start = time.monotonic()
+        asyncio.run(bucket.acquire(100))
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+class TestModelLane(unittest.TestCase):
+    def create_lane(self) -> ModelLane:
+        return ModelLane("openai", "gpt-4o-mini", 600, 60000, initial_concurrency=4, max_concurrency=8)
+
+    def test_additive_increase(self):
+        lane = self.create_lane()
+        for _ in range(100):
+            lane.on_success(1.0)
+        self.assertEqual(lane.concurrency, 8)
+
+    def test_backs_off_when_queued(self):
+        lane = self.create_lane()
+        lane.on_success(1.0)
+        concurrency = lane.concurrency
+        # Latency well above the fastest seen means the provider is queueing
+        for _ in range(5):
+            lane.on_success(10.0)
+        self.assertLess(lane.concurrency, concurrency)
+
+    def test_rate_limited(self):
+        lane = self.create_lane()
+        lane.on_rate_limited()
+        self.assertEqual(lane.concurrency, 2)
+        self.assertAlmostEqual(lane.requests.rate_per_minute, 480)
+        self.assertAlmostEqual(lane.tokens.rate_per_minute, 48000)
+        for _ in range(100):
+            lane.on_success(1.0)
+        # Rates recover up to the configured limits
+        self.assertEqual((lane.requests.rate_per_minute, lane.tokens.rate_per_minute), (600, 60000))
+
+    def test_concurrency_limit(self):
+        async def run():
+            lane = ModelLane("openai", "gpt-4o-mini", 600, 60000, initial_concurrency=2)
+            await lane.acquire(10)
+            await lane.acquire(10)
+            third = asyncio.ensure_future(lane.acquire(10))
+            await asyncio.sleep(0.01)
+            self.assertFalse(third.done())
+            await lane.release()
+            await asyncio.wait_for(third, 1)
+            self.assertEqual(lane.in_flight, 2)
+        asyncio.run(run())
+
+class TestLLMScheduler(unittest.TestCase):
+    def test_shared_instance(self):
+        scheduler = LLMScheduler.get_instance()
+        self.assertIs(LLMScheduler.get_instance(), scheduler)
+        self.assertEqual(scheduler.rate_limits, DEFAULT_RATE_LIMITS)
+        # A scheduler constructed with its own limits keeps them, instead of silently sharing the instance
+        limited = LLMScheduler(rate_limits={"openai": {"*": (10, 1000)}}, max_retries=1)
+        self.assertIsNot(limited, scheduler)
+        self.assertEqual((limited.max_retries, scheduler.max_retries), (1, 5))
+        lane = limited._get_lane("openai", "gpt-4o-mini")
+        self.assertEqual((lane.requests.rate_per_minute, lane.tokens.rate_per_minute), (10, 1000))
+
+    def test_submit(self):
+        scheduler = LLMScheduler(rate_limits={"openai": {"*": (600, 60000)}})
+        self.assertEqual(scheduler.submit("openai", "gpt-4o-mini", lambda: "completion", 10, lambda result: 20).result(timeout=5), "completion")
+        future = scheduler.submit("openai", "gpt-4o-mini", lambda: 1 / 0, 10)
+        with self.assertRaises(ZeroDivisionError):
+            future.result(timeout=5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import json
+import os
+import tempfile
+import unittest
+from langchain_core.exceptions import OutputParserException
+from lib.model_router import DEFAULT_ROUTES, ModelRouter, Route
+from lib.run_budget import BudgetExceeded, RunBudget
+from shared.lib.llm_usage import LLMUsage
+
+MINI, TURBO, GPT4O = DEFAULT_ROUTES
+
+class TestModelRouter(unittest.TestCase):
+    def create_router(self, accuracy=None, budget=None) -> ModelRouter:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "model_accuracy.json")
+        with open(path, "w") as f:
+            json.dump(accuracy or {}, f)
+        return ModelRouter(accuracy_path=path, budget=budget)
+
+    def test_select_sections(self):
+        router = self.create_router()
+        self.assertEqual(router.select("section", 300), MINI)
+        self.assertEqual(router.select("section", 2000, section_titles=["PRECIO", "A FAVOR"]), MINI)
+        self.assertEqual(router.select("section", 2000, section_titles=["PRECIO", "MOTOR"]), TURBO)
+        self.assertEqual(router.select("article", 300), TURBO)
+
+    def test_select_by_context_window(self):
+        router = self.create_router()
+        # gpt-3.5-turbo only has 16385 tokens
+        self.assertEqual(router.select("article", 16000, 1024), MINI)
+        # Nothing fits: the largest context window
+        self.assertEqual(router.select("article", 500000), MINI)
+
+    def test_select_launch_by_accuracy(self):
+        router = self.create_router({"launch": {"openai/gpt-4o-mini": 80.0, "openai/gpt-3.5-turbo": 90.0, "openai/gpt-4o": 95.0}})
+        self.assertEqual(router.select("launch", 2000), TURBO)
+        router = self.create_router({"launch": {"openai/gpt-4o-mini": 85.0}})
+        self.assertEqual(router.select("launch", 2000), MINI)
+        # Without evaluations, the default model
+        self.assertEqual(self.create_router().select("launch", 2000), TURBO)
+
+    def test_downgraded(self):
+        budget = RunBudget(max_cost=1.0, downgrade_at=0.5)
+        router = self.create_router(budget=budget)
+        budget.record(LLMUsage(action="process_article", model_name="gpt-4o", cost=0.6))
+        self.assertEqual(router.select("article", 300), MINI)
+        self.assertIsNone(router.escalate(MINI))
+
+    def test_escalate(self):
+        router = self.create_router()
+        self.assertEqual(router.escalate(MINI), TURBO)
+        self.assertEqual(router.escalate(MINI, 20000), GPT4O)
+        self.assertIsNone(router.escalate(GPT4O))
+        self.assertIsNone(ModelRouter.fixed("openai", "gpt-4o-mini").escalate(Route("openai", "gpt-4o-mini")))
+
+    def test_run_escalates_on_parse_errors(self):
+        router = self.create_router()
+        routes = []
+
+        def call(route: Route, usage: LLMUsage):
+            routes.append(route)
+            if route != GPT4O:
+                raise OutputParserException("Invalid json output")
+            return "output"
+
+        usage = LLMUsage(node_title="process_article")
+        self.assertEqual(router.run("article", "process_article", 300, call, usage), "output")
+        self.assertEqual(routes, [TURBO, GPT4O])
+        # Every attempt is recorded
+        self.assertEqual([child.model_name for child in usage.usage], ["gpt-3.5-turbo", "gpt-4o"])
+        self.assertEqual(router.escalations, {("article", TURBO.name): 1})
+
+    def test_run_escalates_on_low_confidence(self):
+        router = self.create_router()
+        outputs = {MINI: "", TURBO: "", GPT4O: ""}
+        result = router.run("section", "process_article_section", 300, lambda route, usage: outputs[route] or route.model,
+                            LLMUsage(), is_confident=lambda output: output == "gpt-4o")
+        self.assertEqual(result, "gpt-4o")
+        # Not confident of the strongest either: its output is returned as it is
+        self.assertEqual(router.run("section", "process_article_section", 300, lambda route, usage: route.model,
+                                    LLMUsage(), is_confident=lambda output: False), "gpt-4o")
+
+    def test_run_raises_last_parse_error(self):
+        router = self.create_router()
+
+        def call(route: Route, usage: LLMUsage):
+            raise OutputParserException(f"Invalid output of {route.model}")
+
+        with self.assertRaisesRegex(OutputParserException, "Invalid output of gpt-4o(?!-)"):
+            router.run("article", "process_article", 300, call, LLMUsage())
+        # Other errors are not escalated
+        with self.assertRaises(BudgetExceeded):
+            router.run("article", "process_article", 300, lambda route, usage: (_ for _ in ()).throw(BudgetExceeded("Spent")), LLMUsage())
+        self.assertEqual(router.escalations, {("article", TURBO.name): 1})
+
+if __name__ == '__main__':
+    unittest.main()
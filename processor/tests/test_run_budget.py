@@ -0,0 +1,54 @@
+import unittest
+from unittest import mock
+from lib.run_budget import BudgetExceeded, RunBudget
+from shared.lib.llm_usage import LLMUsage
+
+def make_call(cost: float = 0.0, tokens: int = 0) -> LLMUsage:
+    return LLMUsage(action="process_article", model_name="gpt-4o-mini", token_input=tokens, token_output=0, cost=cost, time=1.0)
+
+class TestRunBudget(unittest.TestCase):
+    def test_cost_thresholds(self):
+        budget = RunBudget(max_cost=1.0, downgrade_at=0.8)
+        budget.record(make_call(cost=0.79))
+        self.assertFalse(budget.is_downgraded())
+        budget.record(make_call(cost=0.01))
+        self.assertTrue(budget.is_downgraded())
+        self.assertFalse(budget.is_exhausted())
+        budget.check()
+        budget.record(make_call(cost=0.2))
+        self.assertTrue(budget.is_exhausted())
+        with self.assertRaises(BudgetExceeded):
+            budget.check()
+
+    def test_nested_usage(self):
+        budget = RunBudget(max_tokens=1000)
+        usage = LLMUsage(node_title="process_article")
+        usage.add_usage(make_call(tokens=600))
+        usage.add_usage(make_call(tokens=300))
+        budget.record(usage)
+        self.assertEqual((budget.is_downgraded(), budget.is_exhausted()), (True, False))
+        budget.record(make_call(tokens=100))
+        self.assertTrue(budget.is_exhausted())
+
+    def test_wall_clock(self):
+        with mock.patch("lib.run_budget.time.time", return_value=1000.0):
+            budget = RunBudget(max_seconds=100, downgrade_at=0.5)
+        for now, downgraded, exhausted in ((1049.0, False, False), (1050.0, True, False), (1100.0, True, True)):
+            with mock.patch("lib.run_budget.time.time", return_value=now):
+                self.assertEqual((budget.is_downgraded(), budget.is_exhausted()), (downgraded, exhausted), now)
+
+    def test_most_used_limit(self):
+        # The limit closest to being reached decides
+        budget = RunBudget(max_cost=10.0, max_tokens=100, downgrade_at=0.5)
+        budget.record(make_call(cost=1.0, tokens=60))
+        self.assertTrue(budget.is_downgraded())
+        self.assertEqual(budget.get_summary().split(", ")[:2], ["$1.000 of $10.00", "60 tokens of 100"])
+
+    def test_without_limits(self):
+        budget = RunBudget()
+        budget.record(make_call(cost=1000.0, tokens=10 ** 9))
+        self.assertEqual((budget.is_downgraded(), budget.is_exhausted()), (False, False))
+        budget.check()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+from unittest import mock
+from processors.sales_processor import SalesProcessor
+
+class FakeDB:
+    """Unclassified sales with the given names, no aliases or car models yet, and a record of the rows written."""
+    def __init__(self, sale_names):
+        self.sale_names = sale_names
+        self.written = []
+
+    def execute_query(self, query, params=None):
+        if "FROM unclassified_car_sales" in query:
+            return [{"model": name} for name in self.sale_names]
+        return []
+
+    def execute_values(self, query, rows, template=None, fetch=False, page_size=100, cur=None):
+        self.written.append((" ".join(query.split()), rows))
+        return []
+
+class TestSalesProcessor(unittest.TestCase):
+    def setUp(self):
+        self.db = FakeDB(["VW Gol", "CITROEN C3", "Chery Tiggo 4 Pro 1.5", "Haval Jolion"])
+        with mock.patch("processors.sales_processor.DBHelper", return_value=self.db):
+            self.processor = SalesProcessor()
+
+    def test_parse_alias_and_accents(self):
+        models = self.processor._extract_car_models()
+        self.assertEqual([(car_model.make, car_model.model) for car_model in models.values()],
+                         [("Volkswagen", "Gol"), ("Citroën", "C3"), ("Chery", "Tiggo 4"), ("Haval", "Jolion")])
+
+    def test_sales_classified_as_parsed(self):
+        models = self.processor._extract_car_models()
+        cur = mock.MagicMock(rowcount=0)
+        cur.fetchall.return_value = []
+        self.processor._save_car_models(list(models.values()), cur)
+        self.processor._classify_sales(models, cur)
+        saved = next(rows for query, rows in self.db.written if query.startswith("INSERT INTO car_models"))
+        matched = next(rows for query, rows in self.db.written if query.startswith("INSERT INTO sale_matches"))
+        # Each sale is matched to exactly the car model created from its name
+        self.assertEqual([(make, model) for _, make, model in matched], saved)
+        self.assertEqual(matched[0], ("VW Gol", "Volkswagen", "Gol"))
+        self.assertEqual(matched[1], ("CITROEN C3", "Citroën", "C3"))
+
+if __name__ == '__main__':
+    unittest.main()
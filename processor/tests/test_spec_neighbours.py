@@ -0,0 +1,97 @@
+import random
+import unittest
+import numpy as np
+from lib.spec_neighbours import (NUMERIC_FEATURES, CATEGORICAL_FEATURES, BOOLEAN_FEATURES, build_spec_matrix, get_segments,
+                                 nearest_neighbours)
+
+CATEGORIES = {"body_type": ["SUV", "Sedán", "Hatchback"], "engine_type": ["Nafta", "Diésel", "Eléctrico"],
+              "transmission_type": ["Manual", "Automática"], "traction": ["4x2", "4x4"]}
+
+def make_cars(n: int, seed: int):
+    rng = random.Random(seed)
+    cars = []
+    for _ in range(n):
+        car = {feature: rng.uniform(1, 1000) for feature in NUMERIC_FEATURES if rng.random() < 0.6}
+        car.update({feature: rng.choice(values) for feature, values in CATEGORIES.items() if rng.random() < 0.7})
+        car.update({feature: rng.random() < 0.5 for feature in BOOLEAN_FEATURES if rng.random() < 0.5})
+        cars.append(car)
+    return cars
+
+def brute_force_distances(matrix, groups, segments, min_shared_weight):
+    """Distance of every pair, one pair at a time, inf when the pair may not be neighbours."""
+    n = len(matrix.values)
+    distances = np.full((n, n), np.inf)
+    for i in range(n):
+        for j in range(n):
+            if groups[i] == groups[j] or (segments[i] != -1 and segments[j] not in (segments[i], -1)):
+                continue
+            present = matrix.weights[j] > 0
+            shared = matrix.coverage[i][present].sum()
+            if shared < min_shared_weight:
+                continue
+            both = (matrix.weights[i] > 0) & present
+            squares = matrix.weights[i][both] * (matrix.values[i][both].astype(np.float64) - matrix.values[j][both]) ** 2
+            distances[i, j] = np.sqrt(squares.sum() / shared)
+    return distances
+
+class TestNearestNeighbours(unittest.TestCase):
+    def check(self, cars, k, groups=None, segments=None, min_shared_weight=8.0):
+        matrix = build_spec_matrix(cars)
+        indices, distances = nearest_neighbours(matrix, k, groups=groups, segments=segments,
+                                                min_shared_weight=min_shared_weight, block_size=7)
+        n = len(cars)
+        expected = brute_force_distances(matrix, np.arange(n) if groups is None else groups,
+                                         np.full(n, -1) if segments is None else segments, min_shared_weight)
+        self.assertEqual(indices.shape, (n, k))
+        for i in range(n):
+            nearest = np.concatenate([np.sort(expected[i]), np.full(k, np.inf)])[:k]
+            found = indices[i] >= 0
+            # Padded with -1 and inf past the cars that may be neighbours
+            np.testing.assert_array_equal(found, np.isfinite(nearest))
+            self.assertTrue(np.all(np.isinf(distances[i][~found])))
+            np.testing.assert_allclose(distances[i][found], nearest[np.isfinite(nearest)], rtol=1e-3, atol=1e-3)
+            # Ties may be returned in any order, but each index must be at its distance
+            np.testing.assert_allclose(expected[i, indices[i][found]], distances[i][found], rtol=1e-3, atol=1e-3)
+            self.assertEqual(len(set(indices[i][found])), found.sum())
+        return indices, distances
+
+    def test_masked_distances(self):
+        cars = make_cars(60, seed=1)
+        self.check(cars, 5, min_shared_weight=3.0)
+        self.check(cars, 5)
+
+    def test_groups(self):
+        cars = make_cars(40, seed=2)
+        groups = np.arange(40) // 4
+        indices, _ = self.check(cars, 6, groups=groups, min_shared_weight=3.0)
+        for i, row in enumerate(indices):
+            self.assertTrue(all(groups[j] != groups[i] for j in row if j >= 0))
+
+    def test_segments(self):
+        cars = make_cars(50, seed=3)
+        segments = get_segments(cars)
+        self.assertIn(-1, segments)
+        indices, _ = self.check(cars, 5, segments=segments, min_shared_weight=3.0)
+        for i, row in enumerate(indices):
+            if segments[i] != -1:
+                self.assertTrue(all(segments[j] in (segments[i], -1) for j in row if j >= 0))
+
+    def test_padding(self):
+        # More neighbours asked for than there are cars, and a car sharing too little with any other
+        cars = make_cars(6, seed=4) + [{"features_has_sunroof": True}]
+        indices, distances = self.check(cars, 10, min_shared_weight=3.0)
+        np.testing.assert_array_equal(indices[-1], -1)
+        self.assertTrue(np.all(np.isinf(distances[-1])))
+        self.assertTrue(np.all(indices[:, 6:] == -1))
+
+    def test_known_distance(self):
+        cars = [{"power": 100, "body_type": "SUV"}, {"power": 200, "body_type": "SUV"}, {"power": 200, "body_type": "Sedán"}]
+        indices, distances = self.check(cars, 2, min_shared_weight=1.0)
+        # Standardized log powers are -sqrt(2) and 1/sqrt(2); the body types match or differ in both columns
+        difference = 3 / np.sqrt(2)
+        self.assertEqual(list(indices[0]), [1, 2])
+        np.testing.assert_allclose(distances[0], [np.sqrt(2.0 * difference ** 2 / 6.0),
+                                                  np.sqrt((2.0 * difference ** 2 + 4.0) / 6.0)], rtol=1e-5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+from lib.spec_sheet import extract_spec_sheet, parse_number
+
+class TestSpecSheet(unittest.TestCase):
+    def test_parse_number(self):
+        self.assertEqual(parse_number("4.420", int), 4420)
+        self.assertEqual(parse_number("1,5"), 1.5)
+        self.assertEqual(parse_number("1.5"), 1.5)
+        self.assertEqual(parse_number("9,8", int), 10)
+
+    def test_power_and_torque_units(self):
+        for content, power, torque in (("Potencia: 150 hp. Torque: 250 Nm.", 150, 250),
+                                       ("Potencia máxima 116 CV y par motor máximo de 200 nm", 116, None),
+                                       ("Potencia: 120 bhp. Par máximo: 180 Nm", 120, 180)):
+            sheet = extract_spec_sheet(content)
+            self.assertEqual(sheet.values.get("power"), power, content)
+            self.assertEqual(sheet.values.get("torque"), torque, content)
+        # Units of other fields, or none at all, are not read as power or torque
+        sheet = extract_spec_sheet("Potencia: 110 kW. Torque: 250 km/h. Potencia 150")
+        self.assertNotIn("power", sheet.values)
+        self.assertNotIn("torque", sheet.values)
+
+    def test_multi_engine_values(self):
+        sheet = extract_spec_sheet("FICHA TÉCNICA: Potencia: 150 hp (1.5T) / 190 hp (2.0T). Torque: 250 Nm. Largo: 4.420 mm")
+        self.assertIn("power", sheet.ambiguous)
+        self.assertNotIn("power", sheet.values)
+        self.assertEqual(sheet.values["torque"], 250)
+        self.assertEqual(sheet.values["length"], 4420)
+        for content in ("Potencia: 150 hp o 190 hp", "Potencia: 150 hp, 190 hp", "Potencia: 150 hp - 190 hp"):
+            self.assertIn("power", extract_spec_sheet(content).ambiguous, content)
+        # The same value stated twice is not ambiguous, different ones are
+        self.assertEqual(extract_spec_sheet("Potencia: 150 hp. Más tarde: potencia 150 hp").values["power"], 150)
+        sheet = extract_spec_sheet("Versión nafta, potencia: 150 hp. Versión diésel, potencia: 190 hp")
+        self.assertIn("power", sheet.ambiguous)
+        self.assertNotIn("power", sheet.values)
+
+    def test_counts(self):
+        sheet = extract_spec_sheet("Motor de 4 cilindros y 16 válvulas, caja de 6 velocidades, 6 airbags")
+        self.assertEqual(sheet.values["num_cylinders"], 4)
+        self.assertEqual(sheet.values["num_valves"], 16)
+        self.assertEqual(sheet.values["num_gears"], 6)
+        self.assertEqual(sheet.values["safety_num_airbags"], 6)
+        sheet = extract_spec_sheet("Manual de 5 marchas o automática de 6 marchas")
+        self.assertIn("num_gears", sheet.ambiguous)
+
+    def test_warranty(self):
+        sheet = extract_spec_sheet("Garantía: 5 años o 100.000 km")
+        self.assertEqual(sheet.values["warranty_years"], 5)
+        self.assertEqual(sheet.values["warranty_kms"], 100000)
+        sheet = extract_spec_sheet("Cuenta con garantía 3 años")
+        self.assertEqual(sheet.values["warranty_years"], 3)
+        self.assertNotIn("warranty_kms", sheet.values)
+        # Different warranties per version are left to the LLM
+        sheet = extract_spec_sheet("Garantía 3 años o 100.000 km, y garantía 8 años para la batería")
+        self.assertNotIn("warranty_years", sheet.values)
+
+    def test_prices(self):
+        sheet = extract_spec_sheet("Precio: US$ 24.990. Disponible desde hoy a USD 24.990")
+        self.assertEqual(sheet.prices, [24990])
+        self.assertEqual(sheet.values["launch_price"], 24990)
+        sheet = extract_spec_sheet("Comfort: U$S 21.990, Highline: US$ 27.490 y 25.000 km de service")
+        self.assertEqual(sheet.prices, [21990, 27490])
+        self.assertNotIn("launch_price", sheet.values)
+
+    def test_remaining_content(self):
+        content = "Nuevo modelo. FICHA TÉCNICA: Potencia: 150 hp Torque: 250 Nm Equipamiento completo"
+        sheet = extract_spec_sheet(content)
+        self.assertEqual(sheet.remaining_content, "Nuevo modelo. FICHA TÉCNICA: Equipamiento completo")
+        # Without a spec sheet the values are still read, but the text is kept whole
+        content = "Potencia: 150 hp y equipamiento completo"
+        sheet = extract_spec_sheet(content)
+        self.assertEqual(sheet.values["power"], 150)
+        self.assertEqual(sheet.remaining_content, content)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+from unittest import mock
+from lib.job_queue import Job
+from lib.processor_result import ProcessorResult
+from processor import STAGE_PENDING_QUERIES
+from worker import Worker
+
+class FakeDB:
+    """Returns the entities of pending_ids among those asked for."""
+    def __init__(self, pending_ids=()):
+        self.pending_ids = set(pending_ids)
+        self.queries = []
+
+    def execute_query(self, query, params=None):
+        self.queries.append(query)
+        return [{"id": entity_id} for entity_id in params[0] if entity_id in self.pending_ids]
+
+def make_jobs(stage: str, entity_ids):
+    return [Job(id=entity_id + 100, stage=stage, entity_id=entity_id, attempts=1) for entity_id in entity_ids]
+
+class TestWorker(unittest.TestCase):
+    def create_worker(self, pending_ids=(), budget_exhausted=False):
+        self.db = FakeDB(pending_ids)
+        self.queue = mock.Mock(lease_seconds=600)
+        self.processor = mock.Mock()
+        self.processor.is_budget_exhausted.return_value = budget_exhausted
+        with mock.patch("worker.DBHelper", return_value=self.db):
+            return Worker(self.processor, self.queue, ["process_articles", "parse_launches", "connect"])
+
+    def get_entity_ids(self, method) -> list:
+        return [job.entity_id for call in method.call_args_list for job in call.args[0]]
+
+    def test_stage_order(self):
+        self.assertEqual(self.create_worker().stages, ["parse_launches", "process_articles", "connect"])
+
+    def test_unfinished_entities_fail(self):
+        worker = self.create_worker(pending_ids=[2])
+        worker._run_jobs("process_articles", make_jobs("process_articles", [1, 2, 3]))
+        self.processor.run_stage.assert_called_once_with("process_articles", [1, 2, 3])
+        # Entities still returned by the stage's pending query were not handled
+        self.assertIn(STAGE_PENDING_QUERIES["process_articles"], self.db.queries[0])
+        self.assertEqual(self.get_entity_ids(self.queue.complete), [1, 3])
+        self.assertEqual(self.get_entity_ids(self.queue.fail), [2])
+        self.queue.release.assert_not_called()
+
+    def test_unfinished_entities_without_budget(self):
+        worker = self.create_worker(pending_ids=[2, 3], budget_exhausted=True)
+        worker._run_jobs("process_articles", make_jobs("process_articles", [1, 2, 3]))
+        self.assertEqual(self.get_entity_ids(self.queue.complete), [1])
+        # Skipped for lack of budget: back to pending without counting the attempt
+        self.assertEqual(self.get_entity_ids(self.queue.release), [2, 3])
+        self.queue.fail.assert_not_called()
+
+    def test_singleton_stage(self):
+        worker = self.create_worker()
+        worker._run_jobs("connect", make_jobs("connect", [0]))
+        self.assertEqual(self.db.queries, [])
+        self.assertEqual(self.get_entity_ids(self.queue.complete), [0])
+
+    def test_failed_stage(self):
+        worker = self.create_worker()
+        self.processor.run_stage.side_effect = ValueError("Stage error")
+        worker._run_jobs("parse_launches", make_jobs("parse_launches", [1, 2]))
+        self.queue.fail.assert_called_once()
+        self.assertEqual((self.get_entity_ids(self.queue.fail), self.queue.fail.call_args.args[1]), ([1, 2], "Stage error"))
+        self.queue.complete.assert_not_called()
+
+    def test_run_until_empty(self):
+        worker = self.create_worker()
+        jobs = {"parse_launches": [make_jobs("parse_launches", [1])], "connect": [make_jobs("connect", [0])]}
+        self.queue.claim.side_effect = lambda stage, limit: jobs.get(stage, []).pop() if jobs.get(stage) else []
+        self.queue.enqueue.return_value = 0
+        self.processor.run_stage.side_effect = lambda stage, entity_ids: ProcessorResult(action=stage, items_processed=len(entity_ids))
+        self.assertEqual(worker.run().items_processed, 2)
+        self.assertEqual([call.args[0] for call in self.processor.run_stage.call_args_list], ["parse_launches", "connect"])
+        # Whole-data stages claim one job at a time
+        self.assertIn(mock.call("connect", 1), self.queue.claim.call_args_list)
+        self.assertIn(mock.call("parse_launches", 10), self.queue.claim.call_args_list)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -36,6 +36,7 @@ class ArticleSectionUploader(PineconeUploader):
             return
 
         sections = self._get_article_sections(article['article_id'])
+        car_metadata = self._get_car_metadata(article['article_title'])
         all_embeddings = []
 
         for section in sections:
@@ -45,7 +46,8 @@ class ArticleSectionUploader(PineconeUploader):
             metadata = {
                 "article_title": article['article_title'],
                 "article_url": article['article_url'],
-                "section_title": section['section_title']
+                "section_title": section['section_title'],
+                **car_metadata
             }
 
             section_embeddings = [
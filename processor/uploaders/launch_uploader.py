@@ -31,7 +31,8 @@ class LaunchUploader(PineconeUploader):
 
         metadata = {
             "launch_title": launch['launch_title'],
-            "launch_url": launch['launch_url']
+            "launch_url": launch['launch_url'],
+            **self._get_car_metadata(launch['launch_title'])
         }
 
         launch_embeddings = [
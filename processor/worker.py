@@ -0,0 +1,104 @@
+import threading
+import time
+from typing import List
+from loguru import logger
+from shared.utils import DBHelper
+from lib.job_queue import Job, JobQueue
+from lib.processor_result import ProcessorResult
+from processor import Processor, STAGE_PENDING_QUERIES
+
+class Worker:
+    """
+    Runs pipeline stages from the job queue. Any number of workers, on one or several
+    machines, can share the same database: each batch of jobs is claimed by a single
+    worker, which renews its lease while the stage runs.
+    """
+    def __init__(self, processor: Processor, queue: JobQueue, stages: List[str], batch_size: int = 10,
+                 poll_seconds: int = 30, follow: bool = False):
+        self.db = DBHelper()
+        self.processor = processor
+        self.queue = queue
+        # Earlier stages go first, so their output is available to the later ones
+        self.stages = [stage for stage in STAGE_PENDING_QUERIES if stage in stages]
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.follow = follow
+
+    def enqueue(self, include_singletons: bool = True) -> int:
+        enqueued = 0
+        for stage in self.stages:
+            pending_query = STAGE_PENDING_QUERIES[stage]
+            if pending_query:
+                enqueued += self.queue.enqueue(stage, pending_query)
+            elif include_singletons:
+                enqueued += self.queue.enqueue_singleton(stage)
+        if enqueued:
+            logger.info(f"Enqueued {enqueued} jobs")
+        return enqueued
+
+    def run(self) -> ProcessorResult:
+        result = ProcessorResult(action="work", entity="jobs")
+        while True:
+            if self.processor.is_budget_exhausted():
+                logger.warning("Run budget exhausted, the worker stops claiming jobs")
+                break
+            if self._run_next_batch(result):
+                continue
+            # Out of jobs: pick up entities added by earlier stages or by other processes
+            if self.enqueue(include_singletons=False):
+                continue
+            if not self.follow:
+                break
+            time.sleep(self.poll_seconds)
+        return result
+
+    def _run_next_batch(self, result: ProcessorResult) -> bool:
+        for stage in self.stages:
+            limit = self.batch_size if STAGE_PENDING_QUERIES[stage] else 1
+            jobs = self.queue.claim(stage, limit)
+            if jobs:
+                result.append_result(self._run_jobs(stage, jobs))
+                return True
+        return False
+
+    def _run_jobs(self, stage: str, jobs: List[Job]) -> ProcessorResult:
+        logger.info(f"Running {stage} for {len(jobs)} jobs (entities {[job.entity_id for job in jobs]})")
+        stop_heartbeat = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(jobs, stop_heartbeat), daemon=True)
+        heartbeat.start()
+        try:
+            stage_result = self.processor.run_stage(stage, [job.entity_id for job in jobs])
+        except Exception as e:
+            logger.error(f"Stage {stage} failed: {str(e)}")
+            self.queue.fail(jobs, str(e))
+            return ProcessorResult(action=stage)
+        finally:
+            stop_heartbeat.set()
+            heartbeat.join()
+
+        # Stages log and skip the entities they could not handle; those are still pending
+        unfinished = self._get_unfinished_entities(stage, jobs)
+        self.queue.complete([job for job in jobs if job.entity_id not in unfinished])
+        if self.processor.is_budget_exhausted():
+            # Skipped for lack of budget, not failed
+            self.queue.release([job for job in jobs if job.entity_id in unfinished])
+            return stage_result
+        self.queue.fail([job for job in jobs if job.entity_id in unfinished], f"Entity not handled by {stage}, see the worker logs")
+        if unfinished:
+            logger.warning(f"{len(unfinished)} entities of {stage} were not handled: {sorted(unfinished)}")
+        return stage_result
+
+    def _get_unfinished_entities(self, stage: str, jobs: List[Job]) -> set:
+        pending_query = STAGE_PENDING_QUERIES[stage]
+        if not pending_query:
+            return set()
+        rows = self.db.execute_query(f"SELECT p.id FROM ({pending_query}) AS p WHERE p.id = ANY(%s)",
+                                     ([job.entity_id for job in jobs],))
+        return {row["id"] for row in rows}
+
+    def _heartbeat(self, jobs: List[Job], stop: threading.Event) -> None:
+        while not stop.wait(self.queue.lease_seconds / 3):
+            try:
+                self.queue.heartbeat(jobs)
+            except Exception as e:
+                logger.warning(f"Could not renew the lease of {len(jobs)} jobs: {str(e)}")
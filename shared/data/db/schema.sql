@@ -3,6 +3,9 @@
 SET client_encoding = 'UTF8';
 
 -- Drop tables in reverse order of dependencies
+DROP TABLE IF EXISTS "connect_state";
+DROP TABLE IF EXISTS "llm_batches";
+DROP TABLE IF EXISTS "jobs";
 DROP TABLE IF EXISTS "unclassified_car_sales";
 DROP TABLE IF EXISTS "similar_launches";
 DROP TABLE IF EXISTS "similar_cars";
@@ -14,11 +17,23 @@ DROP TABLE IF EXISTS "car_articles";
 DROP TABLE IF EXISTS "car_prices";
 DROP TABLE IF EXISTS "cars";
 DROP TABLE IF EXISTS "car_models";
+DROP TABLE IF EXISTS "car_name_aliases";
 DROP TABLE IF EXISTS "article_sections";
 DROP TABLE IF EXISTS "articles";
 DROP TABLE IF EXISTS "launches";
 DROP TABLE IF EXISTS "posts";
 
+--
+-- Trigram matching of car names (see shared/utils/db/trigram_matcher.py)
+-- normalize_car_name follows normalize_name of shared/lib/car_names.py: lowercase ASCII words separated by single spaces
+--
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE OR REPLACE FUNCTION normalize_car_name(name TEXT) RETURNS TEXT AS $$
+  SELECT btrim(regexp_replace(translate(lower(name), 'áàäâãéèëêíìïîóòöôõúùüûñç', 'aaaaaeeeeiiiiooooouuuunc'), '[^a-z0-9]+', ' ', 'g'))
+$$ LANGUAGE SQL IMMUTABLE PARALLEL SAFE;
+
 --
 -- Table structure for table "posts"
 --
@@ -37,6 +52,8 @@ CREATE TABLE "posts" (
   "date_comments_processed" TIMESTAMP
 );
 
+CREATE INDEX "posts_url" ON "posts" ("url");
+
 --
 -- Table structure for table "launches"
 --
@@ -47,6 +64,7 @@ CREATE TABLE "launches" (
   "car_model_id" INTEGER,
   "title" VARCHAR(255),
   "content" TEXT,
+  "duplicate_of_id" INTEGER,
   "date_processed" TIMESTAMP,
   FOREIGN KEY ("post_id") REFERENCES "posts" ("id")
 );
@@ -70,6 +88,7 @@ CREATE TABLE "articles" (
   "comments_summary" TEXT,
   "comments_sentiment_score" REAL,
   "date_processed" TIMESTAMP,
+  "launch_links" TEXT[],
   FOREIGN KEY ("post_id") REFERENCES "posts" ("id")
 );
 
@@ -86,6 +105,7 @@ CREATE TABLE "article_sections" (
   "sentiment_score" REAL,
   "sentiment_evidence" TEXT,
   "sentiment_emotions" TEXT,
+  "duplicate_of_id" INTEGER,
   "date_processed" TIMESTAMP,
   FOREIGN KEY ("article_id") REFERENCES "articles" ("id")
 );
@@ -97,6 +117,24 @@ CREATE TABLE "article_sections" (
 CREATE TABLE "car_models" (
   "id" SERIAL PRIMARY KEY,
   "make" VARCHAR(255),
+  "model" VARCHAR(255),
+  "normalized_name" TEXT GENERATED ALWAYS AS (normalize_car_name(COALESCE("make", '') || ' ' || COALESCE("model", ''))) STORED,
+  UNIQUE ("make", "model")
+);
+
+CREATE INDEX "car_models_normalized_name" ON "car_models" USING GIN ("normalized_name" gin_trgm_ops);
+
+--
+-- Table structure for table "car_name_aliases"
+-- Ways of writing makes and models, recognized in sales reports, launches, articles and chatbot questions.
+-- A row with no model is an alias of a make; a model row may have no make when it is not known.
+-- Seeded with the defaults of shared/lib/car_names.py when empty.
+--
+
+CREATE TABLE "car_name_aliases" (
+  "id" SERIAL PRIMARY KEY,
+  "alias" VARCHAR(255) NOT NULL UNIQUE,
+  "make" VARCHAR(255),
   "model" VARCHAR(255)
 );
 
@@ -173,9 +211,14 @@ CREATE TABLE "cars" (
   "features_num_speakers" INTEGER,
   "warranty_years" INTEGER,
   "warranty_kms" INTEGER,
+  "date_similar_connected" TIMESTAMP,
+  "normalized_name" TEXT GENERATED ALWAYS AS (normalize_car_name(COALESCE("full_model_name", '') || ' ' || COALESCE("variant", ''))) STORED,
   FOREIGN KEY ("launch_id") REFERENCES "launches" ("id")
 );
 
+CREATE INDEX "cars_launch_id" ON "cars" ("launch_id");
+CREATE INDEX "cars_normalized_name" ON "cars" USING GIN ("normalized_name" gin_trgm_ops);
+
 --
 -- Table structure for table "car_prices"
 --
@@ -186,9 +229,12 @@ CREATE TABLE "car_prices" (
   "name" VARCHAR(255) NOT NULL,
   "price" INTEGER,
   "date_processed" TIMESTAMP,
-  "process_result" VARCHAR(50)
+  "process_result" VARCHAR(50),
+  "normalized_name" TEXT GENERATED ALWAYS AS (normalize_car_name("name")) STORED
 );
 
+CREATE INDEX "car_prices_normalized_name" ON "car_prices" USING GIN ("normalized_name" gin_trgm_ops);
+
 --
 -- Table structure for table "car_articles"
 --
@@ -260,11 +306,15 @@ CREATE TABLE "car_sales" (
 
 --
 -- Table structure for table "similar_cars"
+-- source is 'link' for the cars of the competitor launches linked from a launch post, and 'specs' for the
+-- nearest cars by price, specs and equipment, with their distance (see processor/lib/spec_neighbours.py)
 --
 
 CREATE TABLE "similar_cars" (
   "launch_car_id" INTEGER NOT NULL,
   "similar_car_id" INTEGER NOT NULL,
+  "source" VARCHAR(20) NOT NULL DEFAULT 'link',
+  "distance" REAL,
   PRIMARY KEY ("launch_car_id", "similar_car_id"),
   FOREIGN KEY ("launch_car_id") REFERENCES "cars" ("id"),
   FOREIGN KEY ("similar_car_id") REFERENCES "cars" ("id")
@@ -282,6 +332,8 @@ CREATE TABLE "similar_launches" (
   FOREIGN KEY ("launch_id") REFERENCES "launches" ("id")
 );
 
+CREATE INDEX "similar_launches_launch_id" ON "similar_launches" ("launch_id");
+
 --
 -- Table structure for table "unclassified_car_sales"
 --
@@ -292,4 +344,62 @@ CREATE TABLE "unclassified_car_sales" (
   "units" INTEGER,
   PRIMARY KEY ("model", "sales_report_id"),
   FOREIGN KEY ("sales_report_id") REFERENCES "sales_reports" ("id")
-);
\ No newline at end of file
+);
+
+--
+-- Table structure for table "jobs"
+--
+
+CREATE TABLE "jobs" (
+  "id" SERIAL PRIMARY KEY,
+  "stage" VARCHAR(50) NOT NULL,
+  "entity_id" INTEGER NOT NULL,
+  "status" VARCHAR(20) NOT NULL DEFAULT 'pending',
+  "attempts" INTEGER NOT NULL DEFAULT 0,
+  "max_attempts" INTEGER NOT NULL DEFAULT 3,
+  "worker_id" VARCHAR(255),
+  "lease_expires_at" TIMESTAMP,
+  "last_error" TEXT,
+  "date_created" TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  "date_started" TIMESTAMP,
+  "date_finished" TIMESTAMP,
+  UNIQUE ("stage", "entity_id")
+);
+
+CREATE INDEX "jobs_stage_status" ON "jobs" ("stage", "status", "id");
+
+--
+-- Table structure for table "llm_batches"
+--
+
+CREATE TABLE "llm_batches" (
+  "id" SERIAL PRIMARY KEY,
+  "batch_id" VARCHAR(255) NOT NULL UNIQUE,
+  "entity" VARCHAR(50) NOT NULL,
+  "entity_ids" INTEGER[] NOT NULL,
+  "requests" JSONB NOT NULL,
+  "num_requests" INTEGER NOT NULL,
+  "status" VARCHAR(20) NOT NULL DEFAULT 'submitted',
+  "input_file_id" VARCHAR(255),
+  "output_file_id" VARCHAR(255),
+  "last_error" TEXT,
+  "date_created" TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  "date_finished" TIMESTAMP
+);
+
+CREATE INDEX "llm_batches_entity_status" ON "llm_batches" ("entity", "status");
+
+--
+-- Table structure for table "connect_state"
+-- Last connect attempt of each item (a launch, article...) of an entity, with the versions of the inputs it
+-- depended on. Items that did not connect are attempted again only when their input versions change.
+--
+
+CREATE TABLE "connect_state" (
+  "entity" VARCHAR(50) NOT NULL,
+  "item_id" INTEGER NOT NULL,
+  "result" VARCHAR(50) NOT NULL,
+  "input_versions" JSONB NOT NULL,
+  "date_attempted" TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY ("entity", "item_id")
+);
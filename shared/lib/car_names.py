@@ -0,0 +1,156 @@
+import re
+import unicodedata
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+TOKEN_PATTERN = re.compile(r"[^\W_]+")
+
+# Makes as written in car_models, used to seed car_name_aliases
+DEFAULT_MAKES = [
+    "Alfa Romeo", "Audi", "BMW", "BYD", "Baic", "Bestune", "Brilliance", "Changan", "Chery", "Chevrolet", "Citroën", "DFM", "DFSK", "Dodge", "Dongfeng", "FAW", "Fiat", "Ford", "Foton",
+    "Geely", "Great Wall", "Haval", "Honda", "Hyundai", "Iveco", "JAC", "JMC", "Jaguar", "Jeep", "Jetour", "Kaiyi", "Karry", "Kia", "Land Rover", "Leapmotor", "MG", "MINI", "Maple", "Maserati", "Maxus", "Mazda",
+    "Mercedes-AMG", "Mercedes-Benz", "Mitsubishi", "Nissan", "Omoda", "Opel", "Peugeot", "Porsche", "RAM", "Renault", "Seat", "Suzuki", "Subaru", "Toyota", "Victory", "Volkswagen", "Volvo", "ZNA"
+]
+# Other ways of writing a make
+DEFAULT_MAKE_ALIASES = {"VW": "Volkswagen", "Mercedes": "Mercedes-Benz", "GWM": "Great Wall", "Alfa": "Alfa Romeo"}
+# Model names of more than one word, with their make where it is unambiguous
+DEFAULT_MODELS = [
+    ("M2 Competition", "BMW"), ("M3 Competition", "BMW"), ("M4 Competition", "BMW"), ("M8 Competition", "BMW"),
+    ("Serie 1", "BMW"), ("Serie 2", "BMW"), ("Serie 3", "BMW"), ("Serie 4", "BMW"), ("Serie 5", "BMW"), ("Serie 6", "BMW"), ("Serie 7", "BMW"), ("Serie 8", "BMW"),
+    ("New F3", "BYD"), ("New e2", "BYD"), ("New CS15", "Changan"), ("Tiggo 2", "Chery"), ("Tiggo 4", "Chery"), ("Tiggo 7", "Chery"), ("Tiggo 8", "Chery"),
+    ("Serie K", None), ("Serie C", None), ("Serie EC", None), ("Serie V", None), ("Grand Siena", "Fiat"), ("Nueva Strada", "Fiat"), ("Mobi Trekking", "Fiat"),
+    ("View Cargo", "Foton"), ("Toano Cargo", "Foton"), ("New Coolray", "Geely"), ("Grand i10", "Hyundai"), ("New Kona", "Hyundai"), ("Touring Cargo", None),
+    ("Grand Cherokee", "Jeep"), ("Range Evoque", "Land Rover"), ("Range Rover", "Land Rover"), ("Range Sport", "Land Rover"), ("Range Velar", "Land Rover"),
+    ("Cooper S", "MINI"), ("Cooper SE", "MINI"), ("John Cooper Works", "MINI"), ("Clase A", "Mercedes-Benz"), ("Clase C", "Mercedes-Benz"), ("Clase CLA", "Mercedes-Benz"),
+    ("Clase B", "Mercedes-Benz"), ("Clase E", "Mercedes-Benz"), ("Clase G", "Mercedes-Benz"), ("Clase S", "Mercedes-Benz"), ("New Sentra", "Nissan"), ("New Versa", "Nissan"),
+    ("New 2008", "Peugeot"), ("New 208", "Peugeot"), ("Grand Captur", "Renault"), ("Grand Vitara", "Suzuki"), ("Land Cruiser", "Toyota"),
+]
+
+def _fold(text: str) -> str:
+    return unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii").lower()
+
+def tokenize(text: str) -> List[Tuple[str, int, int]]:
+    """Words of text as (normalized word, start, end), split on spaces and punctuation."""
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text or ""):
+        word = _fold(match.group())
+        if word:
+            tokens.append((word, match.start(), match.end()))
+    return tokens
+
+def normalize_name(name: str) -> str:
+    """Lowercase ASCII words separated by single spaces, so that accents and punctuation do not affect matching."""
+    return " ".join(word for word, _, _ in tokenize(name))
+
+def contains_name(text: str, name: str) -> bool:
+    """Whether the words of name appear one after the other in text, e.g. "Renault Kwid" in "Renault Kwid Outsider"."""
+    words, name_words = normalize_name(text).split(), normalize_name(name).split()
+    if not name_words:
+        return False
+    return any(words[i:i + len(name_words)] == name_words for i in range(len(words) - len(name_words) + 1))
+
+@dataclass(frozen=True)
+class CarNameEntry:
+    alias: str
+    # None for a model whose make is not known, or an alias of a make alone
+    make: Optional[str]
+    model: Optional[str] = None
+
+@dataclass(frozen=True)
+class CarNameMatch:
+    make: Optional[str]
+    model: Optional[str]
+    # Characters of the text where the name was found
+    start: int
+    end: int
+
+def get_default_entries() -> List[CarNameEntry]:
+    entries = [CarNameEntry(make, make) for make in DEFAULT_MAKES]
+    entries += [CarNameEntry(alias, make) for alias, make in DEFAULT_MAKE_ALIASES.items()]
+    entries += [CarNameEntry(model, make, model) for model, make in DEFAULT_MODELS]
+    return entries
+
+class CarNameRecognizer:
+    """
+    Finds mentions of car makes and models in any text, in a single pass over its
+    words with a word trie of every alias. Aliases are matched on whole words,
+    ignoring case, accents and punctuation, preferring the longest alias at each
+    position. The dictionary is the car_name_aliases table plus the "make model"
+    of every row of car_models (see from_db).
+    """
+    def __init__(self, entries: Iterable[CarNameEntry]):
+        self.trie: Dict[str, Any] = {}
+        for entry in entries:
+            self.add(entry)
+
+    def add(self, entry: CarNameEntry) -> None:
+        words = normalize_name(entry.alias).split()
+        if not words:
+            return
+        node = self.trie
+        for word in words:
+            node = node.setdefault(word, {})
+        # A full make and model is kept over a less specific entry with the same alias
+        existing = node.get(None)
+        if existing is None or (entry.make and entry.model and not (existing.make and existing.model)):
+            node[None] = entry
+
+    @classmethod
+    def from_db(cls, db) -> 'CarNameRecognizer':
+        """Recognizer with the aliases of car_name_aliases, seeded with the defaults when empty, and the car_models."""
+        rows = db.execute_query("SELECT alias, make, model FROM car_name_aliases")
+        if not rows:
+            entries = get_default_entries()
+            db.execute_values("INSERT INTO car_name_aliases (alias, make, model) VALUES %s ON CONFLICT (alias) DO NOTHING",
+                              [(entry.alias, entry.make, entry.model) for entry in entries])
+        else:
+            entries = [CarNameEntry(row['alias'], row['make'], row['model']) for row in rows]
+        car_models = db.execute_query("SELECT DISTINCT make, model FROM car_models WHERE make IS NOT NULL AND model IS NOT NULL")
+        entries += [CarNameEntry(f"{row['make']} {row['model']}", row['make'], row['model']) for row in car_models]
+        return cls(entries)
+
+    def find_all(self, text: str) -> List[CarNameMatch]:
+        """Every mention in text, from left to right, without overlaps."""
+        tokens = tokenize(text)
+        matches = []
+        i = 0
+        while i < len(tokens):
+            node, found, found_end = self.trie, None, i
+            for j in range(i, len(tokens)):
+                node = node.get(tokens[j][0])
+                if node is None:
+                    break
+                if None in node:
+                    found, found_end = node[None], j
+            if found is None:
+                i += 1
+                continue
+            matches.append(CarNameMatch(found.make, found.model, tokens[i][1], tokens[found_end][2]))
+            i = found_end + 1
+        return matches
+
+    def find(self, text: str) -> Optional[CarNameMatch]:
+        """
+        Longest make and model mentioned in text: a full "make model" alias, or a make
+        followed by a model of that make (or of an unknown make). Without any, the
+        first make mentioned, and otherwise the first model.
+        """
+        mentions = self.find_all(text)
+        best = None
+        for i, mention in enumerate(mentions):
+            candidate = None
+            if mention.make and mention.model:
+                candidate = mention
+            elif mention.make and i + 1 < len(mentions):
+                following = mentions[i + 1]
+                if following.model and following.make in (None, mention.make):
+                    candidate = CarNameMatch(mention.make, following.model, mention.start, following.end)
+            if candidate and (best is None or candidate.end - candidate.start > best.end - best.start):
+                best = candidate
+        if best:
+            return best
+        return next((mention for mention in mentions if mention.make), None) or next(iter(mentions), None)
+
+    def find_make(self, text: str) -> Optional[str]:
+        match = self.find(text)
+        return match.make if match else None
@@ -0,0 +1,47 @@
+from dataclasses import dataclass
+from typing import Optional
+
+@dataclass(frozen=True)
+class ModelPricing:
+    # USD per million tokens
+    input: float
+    output: float
+    # Prompt tokens served from the provider's prefix cache; None when not discounted
+    cached_input: Optional[float] = None
+    # Rough average generation speed, for wall time estimates
+    output_tokens_per_second: float = 60.0
+    # Seconds before the first token
+    latency: float = 0.5
+
+# List prices of the models used by the processor and the chatbot. Keep in sync with the providers' pricing pages.
+MODEL_PRICING = {
+    "gpt-4o-mini": ModelPricing(input=0.15, output=0.60, cached_input=0.075, output_tokens_per_second=80),
+    "gpt-3.5-turbo": ModelPricing(input=0.50, output=1.50, output_tokens_per_second=90),
+    "gpt-4o": ModelPricing(input=2.50, output=10.00, cached_input=1.25, output_tokens_per_second=70),
+    "gpt-4-turbo": ModelPricing(input=10.00, output=30.00, output_tokens_per_second=30),
+    "llama3-8b-8192": ModelPricing(input=0.05, output=0.08, output_tokens_per_second=800, latency=0.3),
+    "llama3-70b-8192": ModelPricing(input=0.59, output=0.79, output_tokens_per_second=300, latency=0.3),
+    "claude-3-5-sonnet-20240620": ModelPricing(input=3.00, output=15.00, cached_input=0.30, output_tokens_per_second=60, latency=1.0),
+    "claude-3-haiku-20240307": ModelPricing(input=0.25, output=1.25, cached_input=0.03, output_tokens_per_second=120),
+    "text-embedding-3-small": ModelPricing(input=0.02, output=0.0),
+    "text-embedding-3-large": ModelPricing(input=0.13, output=0.0),
+}
+# Unknown models are priced as the most expensive chat model above, so that estimates err on the safe side
+DEFAULT_PRICING = MODEL_PRICING["gpt-4-turbo"]
+# The OpenAI Batch API bills input and output tokens at half price
+BATCH_DISCOUNT = 0.5
+
+def get_pricing(model_name: str) -> ModelPricing:
+    return MODEL_PRICING.get(model_name, DEFAULT_PRICING)
+
+def get_cost(model_name: str, token_input: int, token_output: int, token_cached: int = 0, batch: bool = False) -> float:
+    """Cost in USD of a call. token_cached is the part of token_input served from the prompt cache."""
+    pricing = get_pricing(model_name)
+    cached_price = pricing.cached_input if pricing.cached_input is not None else pricing.input
+    cost = ((token_input - token_cached) * pricing.input + token_cached * cached_price + token_output * pricing.output) / 1_000_000
+    return cost * BATCH_DISCOUNT if batch else cost
+
+def estimate_time(model_name: str, token_output: int) -> float:
+    """Rough wall time in seconds of a call generating token_output tokens."""
+    pricing = get_pricing(model_name)
+    return pricing.latency + token_output / pricing.output_tokens_per_second
@@ -0,0 +1,45 @@
+from functools import lru_cache
+from typing import List
+import tiktoken
+
+DEFAULT_ENCODING = "cl100k_base"
+
+# Context window of each model, in tokens (prompt + completion)
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+    "gpt-4-turbo": 128000,
+    "llama3-8b-8192": 8192,
+    "llama3-70b-8192": 8192,
+    "claude-3-5-sonnet-20240620": 200000,
+    "claude-3-haiku-20240307": 200000,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+@lru_cache(maxsize=None)
+def get_encoding(model_name: str) -> tiktoken.Encoding:
+    # Non-OpenAI models have no tiktoken encoding; cl100k_base is a close enough estimate for them
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+def encode(text: str, model_name: str = "gpt-3.5-turbo") -> List[int]:
+    return get_encoding(model_name).encode(text or "", disallowed_special=())
+
+def decode(tokens: List[int], model_name: str = "gpt-3.5-turbo") -> str:
+    return get_encoding(model_name).decode(tokens)
+
+def count_tokens(text: str, model_name: str = "gpt-3.5-turbo") -> int:
+    return len(encode(text, model_name))
+
+def get_context_window(model_name: str) -> int:
+    return MODEL_CONTEXT_WINDOWS.get(model_name, DEFAULT_CONTEXT_WINDOW)
+
+def split_tokens(tokens: List[int], max_tokens: int, model_name: str = "gpt-3.5-turbo", overlap: int = 0) -> List[str]:
+    """Split already encoded text into chunks of at most max_tokens, overlapping by overlap tokens."""
+    if max_tokens <= overlap:
+        raise ValueError(f"Chunks of {max_tokens} tokens cannot overlap by {overlap} tokens")
+    step = max_tokens - overlap
+    return [decode(tokens[i:i + max_tokens], model_name) for i in range(0, max(1, len(tokens) - overlap), step)]
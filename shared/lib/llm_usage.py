@@ -1,51 +1,183 @@
+import math
 from dataclasses import dataclass, field
-from typing import List, Set, Tuple, Optional
+from typing import Dict, List, Set, Tuple, Optional
+import threading
+
+# Latency histogram buckets grow by 2%, so percentiles are within 2% of the exact latencies
+LATENCY_BUCKET_GROWTH = 1.02
+# Latencies up to this many seconds (cached or estimated calls) share the first bucket
+MIN_LATENCY = 0.001
+
+class LatencyHistogram:
+    """Counts of latencies in logarithmic buckets, which can be merged and give percentiles without keeping every value."""
+    def __init__(self, counts: Optional[Dict[int, int]] = None):
+        self.counts: Dict[int, int] = dict(counts or {})
+
+    @staticmethod
+    def get_bucket(seconds: float) -> int:
+        if seconds <= MIN_LATENCY:
+            return 0
+        return 1 + int(math.log(seconds / MIN_LATENCY) / math.log(LATENCY_BUCKET_GROWTH))
+
+    def record(self, seconds: float, count: int = 1) -> None:
+        bucket = self.get_bucket(seconds)
+        self.counts[bucket] = self.counts.get(bucket, 0) + count
+
+    def merge(self, other: 'LatencyHistogram', sign: int = 1) -> None:
+        for bucket, count in other.counts.items():
+            total = self.counts.get(bucket, 0) + sign * count
+            if total:
+                self.counts[bucket] = total
+            else:
+                self.counts.pop(bucket, None)
+
+    def percentile(self, percent: float) -> float:
+        """Latency below which percent of the calls fall, as the middle of its bucket (0 for the first bucket)."""
+        total = sum(self.counts.values())
+        if not total:
+            return 0.0
+        rank = percent / 100 * total
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                break
+        return 0.0 if bucket == 0 else MIN_LATENCY * LATENCY_BUCKET_GROWTH ** (bucket - 0.5)
+
+@dataclass
+class UsageStats:
+    """Totals of the calls of one model and action."""
+    token_input: int = 0
+    token_output: int = 0
+    token_cached: int = 0
+    cost: float = 0.0
+    time: float = 0.0
+    calls: int = 0
+    latencies: LatencyHistogram = field(default_factory=LatencyHistogram)
+
+    def merge(self, other: 'UsageStats', sign: int = 1) -> None:
+        self.token_input += sign * other.token_input
+        self.token_output += sign * other.token_output
+        self.token_cached += sign * other.token_cached
+        self.cost += sign * other.cost
+        self.time += sign * other.time
+        self.calls += sign * other.calls
+        self.latencies.merge(other.latencies, sign)
+
+    def copy(self) -> 'UsageStats':
+        stats = UsageStats()
+        stats.merge(self)
+        return stats
+
+StatsByGroup = Dict[Tuple[str, str], UsageStats]
+
+def _merge_groups(stats: StatsByGroup, other: StatsByGroup, sign: int = 1) -> None:
+    for group, group_stats in other.items():
+        stats.setdefault(group, UsageStats()).merge(group_stats, sign)
+        if not stats[group].calls:
+            del stats[group]
 
 @dataclass
 class LLMUsage:
+    """
+    Usage of LLM calls as a tree: leaves are single calls, and nodes (with usage) group the
+    calls of a task. Every node keeps the totals of the calls below it per (model, action),
+    updated as usage is added at any depth, so summaries take O(models x actions) instead of
+    walking the tree. A leaf is counted with the values it has when added, so set them first.
+    Usage can be added from several threads at once.
+    """
     node_title: str = ""
     action: str = ""
     model_name: str = ""
     token_input: int = 0
     token_output: int = 0
+    # Input tokens served from the provider's prompt cache, already included in token_input
+    token_cached: int = 0
     cost: float = 0.0
     time: float = 0.0
     usage: List['LLMUsage'] = field(default_factory=list)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False, compare=False)
+    _stats: StatsByGroup = field(default_factory=dict, init=False, repr=False, compare=False)
+    _parents: List['LLMUsage'] = field(default_factory=list, init=False, repr=False, compare=False)
 
     def add_usage(self, usage: 'LLMUsage') -> None:
-        self.usage.append(usage)
+        added = usage._add_parent(self)
+        with self._lock:
+            delta = added
+            if not self.usage:
+                # Until now this node counted as a call of its own
+                delta = {group: stats.copy() for group, stats in added.items()}
+                _merge_groups(delta, self._get_own_stats(), sign=-1)
+                self._stats = {}
+            self.usage.append(usage)
+            _merge_groups(self._stats, added)
+            parents = list(self._parents)
+        for parent in parents:
+            parent._propagate(delta)
 
-    def summarize(self, model_name: Optional[str] = None, action: Optional[str] = None) -> Tuple[int, int, float, float, int]:
+    def _add_parent(self, parent: 'LLMUsage') -> StatsByGroup:
+        # Registering the parent and taking the totals at once, so that usage added here meanwhile reaches it exactly once
+        with self._lock:
+            self._parents.append(parent)
+            return self._copy_stats()
+
+    def _propagate(self, delta: StatsByGroup) -> None:
+        with self._lock:
+            _merge_groups(self._stats, delta)
+            parents = list(self._parents)
+        for parent in parents:
+            parent._propagate(delta)
+
+    def _get_own_stats(self) -> StatsByGroup:
+        latencies = LatencyHistogram()
+        latencies.record(self.time)
+        return {(self.model_name, self.action): UsageStats(self.token_input, self.token_output, self.token_cached,
+                                                           self.cost, self.time, 1, latencies)}
+
+    def _copy_stats(self) -> StatsByGroup:
         if not self.usage:
-            if (not model_name or model_name == self.model_name) and (not action or action == self.action):
-                return (self.token_input, self.token_output, self.cost, self.time, 1)
-            return (0, 0, 0.0, 0.0, 0)
-        
-        total_input, total_output, total_cost, total_time, total_calls = (0, 0, 0.0, 0.0, 0)
-        for u in self.usage:
-            input, output, cost, time, calls = u.summarize(model_name, action)
-            total_input += input
-            total_output += output
-            total_cost += cost
-            total_time += time
-            total_calls += calls
-        return (total_input, total_output, total_cost, total_time, total_calls)
+            return self._get_own_stats()
+        return {group: stats.copy() for group, stats in self._stats.items()}
+
+    def _get_stats(self, model_name: Optional[str] = None, action: Optional[str] = None) -> UsageStats:
+        total = UsageStats()
+        with self._lock:
+            for (group_model, group_action), stats in self._copy_stats().items():
+                if (not model_name or model_name == group_model) and (not action or action == group_action):
+                    total.merge(stats)
+        return total
+
+    def summarize(self, model_name: Optional[str] = None, action: Optional[str] = None) -> Tuple[int, int, float, float, int]:
+        stats = self._get_stats(model_name, action)
+        return (stats.token_input, stats.token_output, stats.cost, stats.time, stats.calls)
+
+    def summarize_cached_tokens(self, model_name: Optional[str] = None, action: Optional[str] = None) -> int:
+        return self._get_stats(model_name, action).token_cached
+
+    def get_latency_percentiles(self, model_name: Optional[str] = None, action: Optional[str] = None,
+                                percents: Tuple[float, ...] = (50, 95, 99)) -> Tuple[float, ...]:
+        latencies = self._get_stats(model_name, action).latencies
+        return tuple(latencies.percentile(percent) for percent in percents)
 
     def get_summary(self, model_name: Optional[str] = None, action: Optional[str] = None, print_model: bool = True, print_action: bool = True) -> str:
-        token_input, token_output, cost, time, count_calls = self.summarize(model_name, action)
+        stats = self._get_stats(model_name, action)
         model_str = f"Model: {model_name}, " if model_name and print_model else ""
         action_str = f"Action: {action}, " if action and print_action else ""
-        return f"{model_str}{action_str}Token input: {token_input}, Token output: {token_output}, Cost: ${cost:.3f}, Time: {time:.2f}s, Calls: {count_calls}"
+        return f"{model_str}{action_str}{self._format_stats(stats)}"
+
+    @staticmethod
+    def _format_stats(stats: UsageStats) -> str:
+        p50, p95, p99 = (stats.latencies.percentile(percent) for percent in (50, 95, 99))
+        return (f"Token input: {stats.token_input} ({stats.token_cached} cached), Token output: {stats.token_output}, "
+                f"Cost: ${stats.cost:.3f}, Time: {stats.time:.2f}s, Latency p50/p95/p99: {p50:.2f}/{p95:.2f}/{p99:.2f}s, Calls: {stats.calls}")
 
     def get_distinct_models(self) -> Set[str]:
-        if not self.usage:
-            return {self.model_name}
-        return set.union(*(u.get_distinct_models() for u in self.usage))
+        with self._lock:
+            return {model for model, _ in self._copy_stats()}
 
     def get_distinct_actions(self) -> Set[str]:
-        if not self.usage:
-            return {self.action}
-        return set.union(*(u.get_distinct_actions() for u in self.usage))
+        with self._lock:
+            return {action for _, action in self._copy_stats()}
 
     def print_summary_per_model(self) -> str:
         return "\n".join(self.get_summary(model_name=model, print_action=False) for model in self.get_distinct_models())
@@ -54,26 +186,23 @@ class LLMUsage:
         return "\n".join(self.get_summary(action=action, print_model=False) for action in self.get_distinct_actions())
 
     def print_summary_per_model_action(self) -> str:
+        with self._lock:
+            stats = self._copy_stats()
         result = [f"\nUsage of {self.node_title}\n{'=' * 40}"]
-        for model in self.get_distinct_models():
+        for model in sorted({model for model, _ in stats}, key=str):
             result.append(f"\nModel: {model}\n{'-' * 20}")
-            for action in self.get_distinct_actions():
-                result.append(self.get_summary(model_name=model, action=action, print_model=False))
-            token_input, token_output, cost, time, count_calls = self.summarize(model_name=model)
-            result.append(f"TOTAL: Token input: {token_input}, Token output: {token_output}, Cost: ${cost:.3f}, Time: {time:.2f}s, Calls: {count_calls}")
+            total = UsageStats()
+            for (group_model, action), group_stats in sorted(stats.items(), key=lambda item: str(item[0][1])):
+                if group_model == model:
+                    result.append(f"Action: {action}, {self._format_stats(group_stats)}")
+                    total.merge(group_stats)
+            result.append(f"TOTAL: {self._format_stats(total)}")
         return "\n".join(result)
-    
+
     def set_estimated_token_usage_and_cost(self, company_name: str, model_name: str, input_text: str, output_text: str):
-        self.token_input = len(input_text.split())
-        self.token_output = len(output_text.split())
-        # Implement cost estimation logic here for non-OpenAI models
-        # This is a placeholder implementation
-        if company_name == "groq":
-            # Add Groq pricing logic
-            pass
-        elif company_name == "anthropic":
-            # Add Anthropic pricing logic
-            pass
-        # Add more pricing logic for other models/companies
-        
-    
\ No newline at end of file
+        # For responses without token counts: tiktoken counts (approximate for non-OpenAI models) and list prices
+        from shared.lib.llm_pricing import get_cost
+        from shared.lib.llm_tokens import count_tokens
+        self.token_input = count_tokens(input_text, model_name)
+        self.token_output = count_tokens(output_text, model_name)
+        self.cost = get_cost(model_name, self.token_input, self.token_output)
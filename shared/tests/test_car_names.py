@@ -0,0 +1,54 @@
+import unittest
+from shared.lib.car_names import CarNameEntry, CarNameRecognizer, contains_name, get_default_entries, normalize_name
+
+class TestCarNameRecognizer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.recognizer = CarNameRecognizer(get_default_entries() + [
+            CarNameEntry("Chery Tiggo 4 Pro", "Chery", "Tiggo 4 Pro"),
+            CarNameEntry("Toyota Corolla Cross", "Toyota", "Corolla Cross"),
+        ])
+
+    def test_normalize_name(self):
+        self.assertEqual(normalize_name("  Citroën C4-Cactus "), "citroen c4 cactus")
+        self.assertEqual(normalize_name(""), "")
+
+    def test_contains_name(self):
+        self.assertTrue(contains_name("Volkswagen T-Cross 200 TSI Highline", "volkswagen t cross"))
+        self.assertTrue(contains_name("Citroën C3 Aircross", "Citroen C3"))
+        self.assertFalse(contains_name("Chery Tiggo 5", "chery tiggo 4"))
+        self.assertFalse(contains_name("Chery Tiggo 7 Pro", "chery tiggo 8 pro"))
+        self.assertFalse(contains_name("Renault Kwid", "renault kwid outsider"))
+        self.assertFalse(contains_name("Renault Kwid", ""))
+
+    def test_longest_alias(self):
+        match = self.recognizer.find("Lanzamiento: nuevo Chery Tiggo 4 Pro en Uruguay")
+        self.assertEqual((match.make, match.model), ("Chery", "Tiggo 4 Pro"))
+
+    def test_make_followed_by_model(self):
+        match = self.recognizer.find("Llegó el Chery Tiggo 7 a Uruguay")
+        self.assertEqual((match.make, match.model), ("Chery", "Tiggo 7"))
+        self.assertEqual(match.start, len("Llegó el "))
+        self.assertEqual(match.end, len("Llegó el Chery Tiggo 7"))
+
+    def test_make_alias(self):
+        self.assertEqual(self.recognizer.find_make("Nuevo VW Polo"), "Volkswagen")
+        self.assertEqual(self.recognizer.find_make("MERCEDES clase c"), "Mercedes-Benz")
+
+    def test_whole_words(self):
+        self.assertIsNone(self.recognizer.find("Fordham y Kiara"))
+
+    def test_model_of_another_make(self):
+        match = self.recognizer.find("Toyota Land Cruiser vs Jeep Grand Cherokee")
+        self.assertEqual((match.make, match.model), ("Toyota", "Land Cruiser"))
+        self.assertEqual([mention.make for mention in self.recognizer.find_all("Toyota Land Cruiser vs Jeep Grand Cherokee")],
+                         ["Toyota", "Toyota", "Jeep", "Jeep"])
+
+    def test_default_makes_are_separate(self):
+        for make in ["Foton", "Geely", "Haval", "Honda", "JMC", "Jaguar"]:
+            self.assertEqual(self.recognizer.find_make(f"Nuevo {make}"), make)
+        self.assertEqual(self.recognizer.find("Range Velar").model, "Range Velar")
+        self.assertEqual(self.recognizer.find("Cooper S").model, "Cooper S")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -104,6 +104,29 @@ class TestDBHelper(unittest.TestCase):
         self.assertEqual(len(result), 1)
         self.assertEqual(result[0]['email'], 'param@example.com')
 
+    def test_execute_values(self):
+        rows = [('Batch One', 'one@example.com', 20), ('Batch Two', 'two@example.com', 21)]
+        inserted = self.db.execute_values("INSERT INTO test_users (name, email, age) VALUES %s RETURNING id", rows, fetch=True)
+        self.assertEqual(len(inserted), 2)
+
+        updates = [(inserted[0]['id'], 30), (inserted[1]['id'], 31)]
+        self.db.execute_values("""
+            UPDATE test_users AS u SET age = v.age
+            FROM (VALUES %s) AS v(id, age)
+            WHERE u.id = v.id
+        """, updates)
+        result = self.db.execute_query("SELECT name, age FROM test_users ORDER BY id")
+        self.assertEqual([(r['name'], r['age']) for r in result], [('Batch One', 30), ('Batch Two', 31)])
+
+    def test_execute_values_in_transaction(self):
+        with self.assertRaises(psycopg2.IntegrityError):
+            with self.db.get_cursor() as cur:
+                self.db.execute_values("INSERT INTO test_users (name, email, age) VALUES %s",
+                                       [('Tx User', 'tx@example.com', 40)], cur=cur)
+                self.db.execute_values("INSERT INTO test_users (name, email, age) VALUES %s",
+                                       [('Tx Duplicate', 'tx@example.com', 41)], cur=cur)
+        self.assertFalse(self.db.exists('test_users', {'email': 'tx@example.com'}))
+
     def test_execute_query_no_results(self):
         result = self.db.execute_query("SELECT * FROM test_users WHERE name = 'Nonexistent'")
         self.assertEqual(result, [])
@@ -0,0 +1,16 @@
+import unittest
+from shared.lib.llm_tokens import get_context_window, split_tokens, DEFAULT_CONTEXT_WINDOW
+
+class TestLLMTokens(unittest.TestCase):
+    def test_context_window(self):
+        self.assertEqual(get_context_window("llama3-8b-8192"), 8192)
+        self.assertEqual(get_context_window("unknown-model"), DEFAULT_CONTEXT_WINDOW)
+
+    def test_split_without_room(self):
+        # A budget left without room would otherwise split into one empty chunk per token, each an LLM call
+        for max_tokens, overlap in ((0, 0), (-100, 0), (50, 50)):
+            with self.assertRaises(ValueError):
+                split_tokens(list(range(1000)), max_tokens, overlap=overlap)
+
+if __name__ == '__main__':
+    unittest.main()
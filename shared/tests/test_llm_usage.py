@@ -0,0 +1,94 @@
+import random
+import threading
+import unittest
+from shared.lib.llm_usage import LLMUsage, LatencyHistogram
+
+def make_call(model_name: str, action: str, time: float, tokens: int = 10) -> LLMUsage:
+    return LLMUsage(action=action, model_name=model_name, token_input=tokens, token_output=tokens // 2,
+                    token_cached=tokens // 4, cost=tokens / 1000, time=time)
+
+class TestLLMUsage(unittest.TestCase):
+    def test_summaries_of_nested_usage(self):
+        root = LLMUsage(node_title="Processor")
+        article = LLMUsage(node_title="process_article")
+        # Added before its calls, as processors do with their own usage
+        root.add_usage(article)
+        article.add_usage(make_call("gpt-4o-mini", "process_article", 1.0))
+        sections = LLMUsage(node_title="process_article_sections")
+        sections.add_usage(make_call("gpt-4o-mini", "process_article_section", 2.0))
+        sections.add_usage(make_call("gpt-4o", "process_article_section", 4.0, tokens=20))
+        article.add_usage(sections)
+
+        self.assertEqual(root.summarize(), (40, 20, 0.04, 7.0, 3))
+        self.assertEqual(root.summarize(model_name="gpt-4o-mini"), (20, 10, 0.02, 3.0, 2))
+        self.assertEqual(root.summarize(action="process_article_section"), (30, 15, 0.03, 6.0, 2))
+        self.assertEqual(root.summarize_cached_tokens(model_name="gpt-4o"), 5)
+        self.assertEqual(root.get_distinct_models(), {"gpt-4o-mini", "gpt-4o"})
+        self.assertEqual(root.get_distinct_actions(), {"process_article", "process_article_section"})
+
+    def test_leaf_and_empty_node(self):
+        call = make_call("gpt-4o-mini", "process_launch", 1.5)
+        self.assertEqual(call.summarize(), (10, 5, 0.01, 1.5, 1))
+        self.assertEqual(call.summarize(model_name="gpt-4o"), (0, 0, 0.0, 0.0, 0))
+        # A node without calls counts as one call of its own, and stops counting once it has calls
+        root = LLMUsage(node_title="Processor")
+        node = LLMUsage(node_title="process_launch")
+        root.add_usage(node)
+        self.assertEqual(root.summarize()[4], 1)
+        node.add_usage(call)
+        self.assertEqual(root.summarize(), (10, 5, 0.01, 1.5, 1))
+        self.assertEqual(root.get_distinct_models(), {"gpt-4o-mini"})
+
+    def test_concurrent_producers(self):
+        root = LLMUsage(node_title="Processor")
+        nodes = [LLMUsage(node_title=f"worker {i}") for i in range(8)]
+        for node in nodes[:4]:
+            root.add_usage(node)
+
+        def produce(node: LLMUsage, seed: int):
+            rng = random.Random(seed)
+            for _ in range(500):
+                node.add_usage(make_call(rng.choice(["a", "b"]), rng.choice(["x", "y", "z"]), 1.0))
+
+        threads = [threading.Thread(target=produce, args=(node, i)) for i, node in enumerate(nodes)]
+        for thread in threads:
+            thread.start()
+        for node in nodes[4:]:
+            root.add_usage(node)
+        for thread in threads:
+            thread.join()
+        token_input, token_output, cost, time, calls = root.summarize()
+        self.assertEqual((token_input, token_output, time, calls), (40000, 20000, 4000.0, 4000))
+        self.assertAlmostEqual(cost, 40.0)
+        self.assertEqual(sum(root.summarize(model_name=model)[4] for model in root.get_distinct_models()), 4000)
+
+    def test_latency_percentiles(self):
+        root = LLMUsage(node_title="Processor")
+        latencies = [0.1 * (i + 1) for i in range(1000)]
+        random.Random(1).shuffle(latencies)
+        for latency in latencies:
+            root.add_usage(make_call("gpt-4o-mini", "process_launch", latency))
+        for estimate, exact in zip(root.get_latency_percentiles(), (50.0, 95.0, 99.0)):
+            self.assertAlmostEqual(estimate, exact, delta=exact * 0.02)
+        self.assertEqual(root.get_latency_percentiles(model_name="gpt-4o"), (0.0, 0.0, 0.0))
+
+    def test_histogram_merge(self):
+        histogram = LatencyHistogram()
+        other = LatencyHistogram()
+        other.record(2.0, count=3)
+        histogram.merge(other)
+        histogram.merge(other, sign=-1)
+        self.assertEqual(histogram.counts, {})
+        self.assertEqual(histogram.percentile(50), 0.0)
+
+    def test_summary_per_model_action(self):
+        root = LLMUsage(node_title="Processor")
+        root.add_usage(make_call("gpt-4o-mini", "process_launch", 1.0))
+        root.add_usage(make_call("gpt-4o", "process_article", 2.0))
+        summary = root.print_summary_per_model_action()
+        self.assertIn("Model: gpt-4o\n", summary)
+        self.assertIn("Action: process_article, Token input: 10 (2 cached)", summary)
+        self.assertEqual(summary.count("TOTAL:"), 2)
+
+if __name__ == '__main__':
+    unittest.main()
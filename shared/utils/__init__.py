@@ -1 +1 @@
-from .db import DBHelper
\ No newline at end of file
+from .db import DBHelper, TrigramMatcher
@@ -1 +1,2 @@
-from .db_helper import DBHelper
\ No newline at end of file
+from .db_helper import DBHelper
+from .trigram_matcher import TrigramMatcher
@@ -5,6 +5,7 @@ import threading
 
 import psycopg2
 from psycopg2 import sql
+from psycopg2.extras import execute_values
 from psycopg2.pool import ThreadedConnectionPool
 from dotenv import load_dotenv
 
@@ -54,6 +55,28 @@ class DBHelper:
                 return [dict(zip(columns, row)) for row in cur.fetchall()]
         return []
 
+    def execute_values(self, query: Union[str, sql.Composed], rows: List[tuple], template: Optional[str] = None,
+                       fetch: bool = False, page_size: int = 100, cur=None) -> List[Dict[str, Any]]:
+        """
+        Execute a query with a single VALUES %s placeholder for all rows at once.
+        Set fetch for queries with a RETURNING clause. Pass cur to run it inside an
+        open transaction from get_cursor().
+        """
+        if not rows:
+            return []
+        if cur is None:
+            with self.get_cursor() as cur:
+                return self._execute_values(cur, query, rows, template, fetch, page_size)
+        return self._execute_values(cur, query, rows, template, fetch, page_size)
+
+    @staticmethod
+    def _execute_values(cur, query, rows, template, fetch, page_size) -> List[Dict[str, Any]]:
+        results = execute_values(cur, query, rows, template=template, page_size=page_size, fetch=fetch)
+        if fetch and cur.description:
+            columns = [col.name for col in cur.description]
+            return [dict(zip(columns, row)) for row in results]
+        return []
+
     def _build_conditions(self, attributes: Dict[str, Any]) -> sql.Composed:
         return sql.SQL(' AND ').join(
             sql.SQL("{} = {}").format(sql.Identifier(k), sql.Placeholder())
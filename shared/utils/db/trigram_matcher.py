@@ -0,0 +1,61 @@
+from typing import Any, List, Optional, Sequence, Tuple
+
+from psycopg2 import sql
+
+from .db_helper import DBHelper
+
+class TrigramMatcher:
+    """
+    Finds the rows of a table whose name is most similar to each of a list of names,
+    scored by Postgres with pg_trgm, so candidate rows never leave the database.
+    The name column holds normalize_car_name() of the row (see schema.sql), and should
+    have a gin_trgm_ops index for unscoped matches. The input names are normalized the
+    same way in the query.
+
+    With word_similarity, a row matches when its name appears in the input name (e.g. a
+    car in an article title) instead of when both names are similar as a whole.
+    With scope_column, each name is only compared with the rows whose scope_column is in
+    the scope given for it (e.g. the cars of some launches).
+    """
+    def __init__(self, table: str, key_column: str = "id", name_column: str = "normalized_name",
+                 scope_column: Optional[str] = None, word_similarity: bool = False,
+                 threshold: float = 0.3, top_k: int = 3, db: Optional[DBHelper] = None):
+        self.db = db or DBHelper()
+        self.threshold = threshold
+        self.word_similarity = word_similarity
+        name = sql.SQL("t.{}").format(sql.Identifier(name_column))
+        if word_similarity:
+            score = sql.SQL("word_similarity({}, normalize_car_name(v.name))").format(name)
+            condition = sql.SQL("{} <%% normalize_car_name(v.name)").format(name)
+        else:
+            score = sql.SQL("similarity({}, normalize_car_name(v.name))").format(name)
+            condition = sql.SQL("{} %% normalize_car_name(v.name)").format(name)
+        if scope_column:
+            condition += sql.SQL(" AND t.{} = ANY(v.scope)").format(sql.Identifier(scope_column))
+        self.query = sql.SQL("""
+            SELECT v.i, m.key, m.name, m.score
+            FROM (VALUES %s) AS v(i, name, scope)
+            CROSS JOIN LATERAL (
+                SELECT t.{key} AS key, {name} AS name, {score} AS score
+                FROM {table} t
+                WHERE {condition}
+                ORDER BY score DESC, t.{key}
+                LIMIT {top_k}
+            ) m
+        """).format(key=sql.Identifier(key_column), name=name, score=score, table=sql.Identifier(table),
+                    condition=condition, top_k=sql.Literal(top_k))
+
+    def match(self, names: Sequence[str], scopes: Optional[Sequence[Sequence[Any]]] = None) -> List[List[Tuple[Any, str, float]]]:
+        """Best matches for each name, as (key, name, similarity) sorted by descending similarity, all in one query."""
+        matches: List[List[Tuple[Any, str, float]]] = [[] for _ in names]
+        rows = [(i, name, list(scopes[i]) if scopes else None) for i, name in enumerate(names)
+                if name and (scopes is None or scopes[i])]
+        if not rows:
+            return matches
+        # The % and <% operators, which the trigram indexes support, match above the current threshold
+        setting = "pg_trgm.word_similarity_threshold" if self.word_similarity else "pg_trgm.similarity_threshold"
+        with self.db.get_cursor() as cur:
+            cur.execute("SELECT set_config(%s, %s, true)", (setting, str(self.threshold)))
+            for row in self.db.execute_values(self.query, rows, fetch=True, page_size=1000, cur=cur):
+                matches[row['i']].append((row['key'], row['name'], float(row['score'])))
+        return matches